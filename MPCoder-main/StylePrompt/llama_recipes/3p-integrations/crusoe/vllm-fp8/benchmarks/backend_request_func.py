@@ -1,3 +1,4 @@
+import contextlib
 import json
 import os
 import sys
@@ -15,6 +16,17 @@ from transformers import (AutoTokenizer, PreTrainedTokenizer,
 AIOHTTP_TIMEOUT = aiohttp.ClientTimeout(total=6 * 60 * 60)
 
 
+@contextlib.asynccontextmanager
+async def client_session(session: Optional[aiohttp.ClientSession] = None):
+    # Reuse the caller's session so that concurrent requests share its
+    # connection pool, or open one for a single request.
+    if session is not None:
+        yield session
+        return
+    async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
+        yield session
+
+
 @dataclass
 class RequestFuncInput:
     prompt: str
@@ -35,17 +47,20 @@ class RequestFuncOutput:
     itl: List[float] = field(
         default_factory=list)  # List of inter-token latencies
     prompt_len: int = 0
+    # Number of generated tokens reported by the server, if any
+    output_tokens: Optional[int] = None
     error: str = ""
 
 
 async def async_request_tgi(
     request_func_input: RequestFuncInput,
     pbar: Optional[tqdm] = None,
+    session: Optional[aiohttp.ClientSession] = None,
 ) -> RequestFuncOutput:
     api_url = request_func_input.api_url
     assert api_url.endswith("generate_stream")
 
-    async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
+    async with client_session(session) as session:
         assert not request_func_input.use_beam_search
         params = {
             "best_of": request_func_input.best_of,
@@ -112,11 +127,12 @@ async def async_request_tgi(
 async def async_request_trt_llm(
     request_func_input: RequestFuncInput,
     pbar: Optional[tqdm] = None,
+    session: Optional[aiohttp.ClientSession] = None,
 ) -> RequestFuncOutput:
     api_url = request_func_input.api_url
     assert api_url.endswith("generate_stream")
 
-    async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
+    async with client_session(session) as session:
         assert not request_func_input.use_beam_search
         assert request_func_input.best_of == 1
         payload = {
@@ -178,8 +194,9 @@ async def async_request_trt_llm(
 async def async_request_deepspeed_mii(
     request_func_input: RequestFuncInput,
     pbar: Optional[tqdm] = None,
+    session: Optional[aiohttp.ClientSession] = None,
 ) -> RequestFuncOutput:
-    async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
+    async with client_session(session) as session:
         assert request_func_input.best_of == 1
         assert not request_func_input.use_beam_search
 
@@ -222,13 +239,14 @@ async def async_request_deepspeed_mii(
 async def async_request_openai_completions(
     request_func_input: RequestFuncInput,
     pbar: Optional[tqdm] = None,
+    session: Optional[aiohttp.ClientSession] = None,
 ) -> RequestFuncOutput:
     api_url = request_func_input.api_url
     assert api_url.endswith(
         ("completions", "profile")
     ), "OpenAI Completions API URL must end with 'completions' or 'profile'."
 
-    async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
+    async with client_session(session) as session:
         assert not request_func_input.use_beam_search
         payload = {
             "model": request_func_input.model,
@@ -237,6 +255,9 @@ async def async_request_openai_completions(
             "best_of": request_func_input.best_of,
             "max_tokens": request_func_input.output_len,
             "stream": True,
+            "stream_options": {
+                "include_usage": True,
+            },
         }
         headers = {
             "Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY')}"
@@ -264,11 +285,14 @@ async def async_request_openai_completions(
                             latency = time.perf_counter() - st
                         else:
                             data = json.loads(chunk)
+                            if data.get("usage"):
+                                output.output_tokens = data["usage"].get(
+                                    "completion_tokens")
 
                             # NOTE: Some completion API might have a last
                             # usage summary response without a token so we
                             # want to check a token was generated
-                            if data["choices"][0]["text"]:
+                            if data["choices"] and data["choices"][0]["text"]:
                                 timestamp = time.perf_counter()
                                 # First token
                                 if ttft == 0.0:
@@ -302,13 +326,14 @@ async def async_request_openai_completions(
 async def async_request_openai_chat_completions(
     request_func_input: RequestFuncInput,
     pbar: Optional[tqdm] = None,
+    session: Optional[aiohttp.ClientSession] = None,
 ) -> RequestFuncOutput:
     api_url = request_func_input.api_url
     assert api_url.endswith(
         "chat/completions"
     ), "OpenAI Chat Completions API URL must end with 'chat/completions'."
 
-    async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT) as session:
+    async with client_session(session) as session:
         assert not request_func_input.use_beam_search
         payload = {
             "model": request_func_input.model,
@@ -321,6 +346,9 @@ async def async_request_openai_chat_completions(
             "temperature": 0.0,
             "max_tokens": request_func_input.output_len,
             "stream": True,
+            "stream_options": {
+                "include_usage": True,
+            },
         }
         headers = {
             "Content-Type": "application/json",
@@ -350,8 +378,12 @@ async def async_request_openai_chat_completions(
                         else:
                             timestamp = time.perf_counter()
                             data = json.loads(chunk)
+                            if data.get("usage"):
+                                output.output_tokens = data["usage"].get(
+                                    "completion_tokens")
 
-                            delta = data["choices"][0]["delta"]
+                            delta = data["choices"][0][
+                                "delta"] if data["choices"] else {}
                             if delta.get("content", None):
                                 # First token
                                 if ttft == 0.0:
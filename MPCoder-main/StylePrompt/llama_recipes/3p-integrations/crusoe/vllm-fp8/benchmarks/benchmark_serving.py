@@ -24,6 +24,7 @@ On the client side, run:
 """
 import argparse
 import asyncio
+import hashlib
 import json
 import os
 import random
@@ -70,24 +71,118 @@ class BenchmarkMetrics:
     median_itl_ms: float
     std_itl_ms: float
     p99_itl_ms: float
+    # Requests per second that met all the latency SLOs, and their share of
+    # all requests
+    request_goodput: float
+    slo_attainment: float
 
 
-def sample_sharegpt_requests(
+SLO_METRICS = ("ttft", "tpot", "e2el")
+
+
+def parse_goodput(slos: Optional[List[str]]) -> Dict[str, float]:
+    # "ttft:500 tpot:50" -> {"ttft": 500.0, "tpot": 50.0}, in milliseconds
+    goodput_config: Dict[str, float] = {}
+    for slo in slos or []:
+        name, _, value = slo.partition(":")
+        if name not in SLO_METRICS or not value:
+            raise ValueError(
+                f"Invalid SLO {slo!r}. Please use KEY:VALUE with KEY in "
+                f"{', '.join(SLO_METRICS)} and VALUE in milliseconds.")
+        goodput_config[name] = float(value)
+    return goodput_config
+
+
+def count_tokens(
+    tokenizer: PreTrainedTokenizerBase,
+    texts: List[str],
+    add_special_tokens: bool = True,
+    batch_size: int = 1024,
+) -> List[int]:
+    # Fast tokenizers encode a batch in parallel, which is much faster than
+    # one call per text. Their backend is called directly since only the
+    # lengths are needed, not a BatchEncoding.
+    lens: List[int] = []
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i + batch_size]
+        if getattr(tokenizer, "is_fast", False):
+            encodings = tokenizer.backend_tokenizer.encode_batch(
+                batch, add_special_tokens=add_special_tokens)
+            lens.extend(len(encoding.ids) for encoding in encodings)
+        else:
+            token_ids = tokenizer(
+                batch, add_special_tokens=add_special_tokens).input_ids
+            lens.extend(len(ids) for ids in token_ids)
+    return lens
+
+
+def _tokenized_dataset_path(dataset_path: str, tokenizer: PreTrainedTokenizerBase,
+                            cache_dir: str) -> str:
+    # The key changes with the dataset file and with the tokenizer.
+    stat = os.stat(dataset_path)
+    key = ":".join([
+        os.path.abspath(dataset_path),
+        str(stat.st_size),
+        str(stat.st_mtime_ns),
+        type(tokenizer).__name__,
+        str(getattr(tokenizer, "name_or_path", "")),
+        str(len(tokenizer)),
+    ])
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(dataset_path))[0]
+    return os.path.join(cache_dir, f"{name}-{digest}.npz")
+
+
+def load_sharegpt_dataset(
     dataset_path: str,
-    num_requests: int,
     tokenizer: PreTrainedTokenizerBase,
-    fixed_output_len: Optional[int] = None,
+    cache_dir: Optional[str] = None,
 ) -> List[Tuple[str, int, int]]:
-    if fixed_output_len is not None and fixed_output_len < 4:
-        raise ValueError("output_len too small")
+    """Returns (prompt, prompt_len, completion_len) of every conversation.
+
+    The token counts are cached in cache_dir, so later runs with the same
+    dataset and tokenizer skip the tokenization.
+    """
     # Load the dataset.
     with open(dataset_path) as f:
         dataset = json.load(f)
     # Filter out the conversations with less than 2 turns.
     dataset = [data for data in dataset if len(data["conversations"]) >= 2]
     # Only keep the first two turns of each conversation.
-    dataset = [(data["conversations"][0]["value"],
-                data["conversations"][1]["value"]) for data in dataset]
+    prompts = [data["conversations"][0]["value"] for data in dataset]
+    completions = [data["conversations"][1]["value"] for data in dataset]
+
+    cache_path = None
+    if cache_dir:
+        cache_path = _tokenized_dataset_path(dataset_path, tokenizer,
+                                             cache_dir)
+        if os.path.exists(cache_path):
+            lens = np.load(cache_path)
+            if len(lens["prompt_lens"]) == len(prompts):
+                return list(
+                    zip(prompts, lens["prompt_lens"].tolist(),
+                        lens["completion_lens"].tolist()))
+
+    prompt_lens = count_tokens(tokenizer, prompts)
+    completion_lens = count_tokens(tokenizer, completions)
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_path,
+                 prompt_lens=np.array(prompt_lens, dtype=np.int32),
+                 completion_lens=np.array(completion_lens, dtype=np.int32))
+    return list(zip(prompts, prompt_lens, completion_lens))
+
+
+def sample_sharegpt_requests(
+    dataset_path: str,
+    num_requests: int,
+    tokenizer: PreTrainedTokenizerBase,
+    fixed_output_len: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+) -> List[Tuple[str, int, int]]:
+    if fixed_output_len is not None and fixed_output_len < 4:
+        raise ValueError("output_len too small")
+    dataset = load_sharegpt_dataset(dataset_path, tokenizer, cache_dir)
 
     # Shuffle the dataset.
     random.shuffle(dataset)
@@ -98,14 +193,9 @@ def sample_sharegpt_requests(
         if len(filtered_dataset) == num_requests:
             break
 
-        # Tokenize the prompts and completions.
-        prompt = dataset[i][0]
-        prompt_token_ids = tokenizer(prompt).input_ids
-        completion = dataset[i][1]
-        completion_token_ids = tokenizer(completion).input_ids
-        prompt_len = len(prompt_token_ids)
-        output_len = len(completion_token_ids
-                         ) if fixed_output_len is None else fixed_output_len
+        prompt, prompt_len, completion_len = dataset[i]
+        output_len = (completion_len
+                      if fixed_output_len is None else fixed_output_len)
         if prompt_len < 4 or output_len < 4:
             # Prune too short sequences.
             continue
@@ -235,30 +325,54 @@ def calculate_metrics(
     outputs: List[RequestFuncOutput],
     dur_s: float,
     tokenizer: PreTrainedTokenizerBase,
+    goodput_config: Optional[Dict[str, float]] = None,
 ) -> Tuple[BenchmarkMetrics, List[int]]:
     actual_output_lens: List[int] = []
     total_input = 0
     completed = 0
+    good_completed = 0
     itls: List[float] = []
     tpots: List[float] = []
     ttfts: List[float] = []
+    # We use the number of output tokens reported by the server. Otherwise we
+    # use the tokenizer instead of looking at len(outputs[i].itl) since
+    # multiple output tokens may be bundled together, all outputs without a
+    # count are tokenized in one batch.
+    # Note : this may inflate the output token count slightly
+    uncounted = [
+        i for i, output in enumerate(outputs)
+        if output.success and output.output_tokens is None
+    ]
+    tokenized_lens = dict(
+        zip(
+            uncounted,
+            count_tokens(tokenizer,
+                         [outputs[i].generated_text for i in uncounted],
+                         add_special_tokens=False)))
     for i in range(len(outputs)):
         if outputs[i].success:
-            # We use the tokenizer to count the number of output tokens for all
-            # serving backends instead of looking at len(outputs[i].itl) since
-            # multiple output tokens may be bundled together
-            # Note : this may inflate the output token count slightly
-            output_len = len(
-                tokenizer(outputs[i].generated_text,
-                          add_special_tokens=False).input_ids)
+            output_len = (outputs[i].output_tokens
+                          if outputs[i].output_tokens is not None else
+                          tokenized_lens[i])
             actual_output_lens.append(output_len)
             total_input += input_requests[i][1]
+            tpot = 0.0
             if output_len > 1:
-                tpots.append(
-                    (outputs[i].latency - outputs[i].ttft) / (output_len - 1))
+                tpot = (outputs[i].latency - outputs[i].ttft) / (output_len -
+                                                                  1)
+                tpots.append(tpot)
             itls += outputs[i].itl
             ttfts.append(outputs[i].ttft)
             completed += 1
+            if goodput_config:
+                latencies_ms = {
+                    "ttft": outputs[i].ttft * 1000,
+                    "tpot": tpot * 1000,
+                    "e2el": outputs[i].latency * 1000,
+                }
+                if all(latencies_ms[name] <= slo
+                       for name, slo in goodput_config.items()):
+                    good_completed += 1
         else:
             actual_output_lens.append(0)
 
@@ -287,11 +401,136 @@ def calculate_metrics(
         median_itl_ms=np.median(itls or 0) * 1000,
         std_itl_ms=np.std(itls or 0) * 1000,
         p99_itl_ms=np.percentile(itls or 0, 99) * 1000,
+        # Without SLOs every completed request counts as good
+        request_goodput=(good_completed if goodput_config else completed) /
+        dur_s,
+        slo_attainment=(good_completed if goodput_config else completed) /
+        max(len(outputs), 1),
     )
 
     return metrics, actual_output_lens
 
 
+def calculate_time_series(
+    start_times: List[float],
+    outputs: List[RequestFuncOutput],
+    output_lens: List[int],
+    dur_s: float,
+    interval_s: float = 1.0,
+) -> Dict[str, List[Optional[float]]]:
+    """Buckets the benchmark into intervals of interval_s seconds.
+
+    start_times are the send times of the requests, relative to the start of
+    the benchmark. The output tokens of a request are spread evenly over its
+    streamed chunks, requests are in flight from their start to their last
+    chunk and their latencies count in the interval they finished in. Failed
+    requests are left out.
+
+    in_flight_requests is the maximum number of requests in flight at any
+    time of the interval, mean_in_flight_requests its time-weighted mean.
+    """
+    num_intervals = max(int(np.ceil(dur_s / interval_s)), 1)
+    output_tokens = np.zeros(num_intervals)
+    completed = np.zeros(num_intervals)
+    ttfts: List[List[float]] = [[] for _ in range(num_intervals)]
+    e2els: List[List[float]] = [[] for _ in range(num_intervals)]
+    starts, ends = [], []
+
+    def interval_of(t):
+        return np.clip((np.asarray(t) // interval_s).astype(int), 0,
+                       num_intervals - 1)
+
+    for start, output, output_len in zip(start_times, outputs, output_lens):
+        if not output.success:
+            continue
+        end = start + output.latency
+        starts.append(start)
+        ends.append(end)
+        completed[interval_of(end)] += 1
+        e2els[interval_of(end)].append(output.latency * 1000)
+        if output.ttft > 0:
+            ttfts[interval_of(start + output.ttft)].append(output.ttft * 1000)
+            chunk_times = start + output.ttft + np.cumsum([0.0] + output.itl)
+        else:
+            # Not streamed, all tokens arrive at the end
+            chunk_times = np.array([end])
+        np.add.at(output_tokens, interval_of(chunk_times),
+                  output_len / len(chunk_times))
+
+    interval_ends = (np.arange(num_intervals) + 1) * interval_s
+    # The number of requests in flight only changes when a request starts or
+    # ends, it is constant on every segment between two such events (or
+    # interval boundaries) and the value of each segment goes to its interval
+    starts, ends = np.sort(starts), np.sort(ends)
+    breakpoints = np.unique(np.clip(
+        np.concatenate([[0.0], interval_ends, starts, ends]), 0.0,
+        interval_ends[-1]))
+    segment_starts = breakpoints[:-1]
+    levels = (np.searchsorted(starts, segment_starts, "right") -
+              np.searchsorted(ends, segment_starts, "right"))
+    segment_intervals = interval_of(segment_starts)
+    in_flight = np.zeros(num_intervals, dtype=int)
+    np.maximum.at(in_flight, segment_intervals, levels)
+    in_flight_time = np.zeros(num_intervals)
+    np.add.at(in_flight_time, segment_intervals,
+              levels * np.diff(breakpoints))
+
+    def percentile(values, q):
+        return float(np.percentile(values, q)) if values else None
+
+    return {
+        "time_s": interval_ends.tolist(),
+        "request_throughput": (completed / interval_s).tolist(),
+        "output_throughput": (output_tokens / interval_s).tolist(),
+        "in_flight_requests": in_flight.tolist(),
+        "mean_in_flight_requests": (in_flight_time / interval_s).tolist(),
+        "p50_ttft_ms": [percentile(v, 50) for v in ttfts],
+        "p99_ttft_ms": [percentile(v, 99) for v in ttfts],
+        "p50_e2el_ms": [percentile(v, 50) for v in e2els],
+        "p99_e2el_ms": [percentile(v, 99) for v in e2els],
+    }
+
+
+def find_max_sustainable_rate(
+    run_at_rate,
+    start_rate: float,
+    min_slo_attainment: float,
+    max_runs: int = 8,
+    tolerance: float = 0.1,
+) -> Tuple[float, List[Dict[str, Any]]]:
+    """Searches the highest request rate whose SLO attainment is at least
+    min_slo_attainment.
+
+    run_at_rate(rate) benchmarks one rate and returns its result. The rate is
+    doubled until the SLOs are missed, then bisected until the bounds are
+    within tolerance (relative) or max_runs benchmarks ran.
+    """
+    history: List[Dict[str, Any]] = []
+    low, high, rate = 0.0, None, start_rate
+    for _ in range(max_runs):
+        result = run_at_rate(rate)
+        sustainable = result["slo_attainment"] >= min_slo_attainment
+        history.append({
+            "request_rate": rate,
+            "sustainable": sustainable,
+            "slo_attainment": result["slo_attainment"],
+            "request_goodput": result["request_goodput"],
+            "request_throughput": result["request_throughput"],
+            "output_throughput": result["output_throughput"],
+        })
+        if sustainable:
+            low = rate
+        else:
+            high = rate
+        if high is None:
+            rate = low * 2
+        elif high - low <= tolerance * high:
+            break
+        else:
+            rate = (low + high) / 2
+    return low, history
+
+
 async def benchmark(
     backend: str,
     api_url: str,
@@ -304,6 +543,8 @@ async def benchmark(
     request_rate: float,
     disable_tqdm: bool,
     profile: bool,
+    goodput_config: Optional[Dict[str, float]] = None,
+    time_series_interval: float = 1.0,
 ):
     if backend in ASYNC_REQUEST_FUNCS:
         request_func = ASYNC_REQUEST_FUNCS[backend]
@@ -348,6 +589,14 @@ async def benchmark(
 
     pbar = None if disable_tqdm else tqdm(total=len(input_requests))
 
+    async def timed_request(
+        request_func_input: RequestFuncInput
+    ) -> Tuple[float, RequestFuncOutput]:
+        start_time = time.perf_counter() - benchmark_start_time
+        output = await request_func(request_func_input=request_func_input,
+                                    pbar=pbar)
+        return start_time, output
+
     benchmark_start_time = time.perf_counter()
     tasks: List[asyncio.Task] = []
     async for request in get_request(input_requests, request_rate):
@@ -361,11 +610,12 @@ async def benchmark(
             best_of=best_of,
             use_beam_search=use_beam_search,
         )
-        tasks.append(
-            asyncio.create_task(
-                request_func(request_func_input=request_func_input,
-                             pbar=pbar)))
-    outputs: List[RequestFuncOutput] = await asyncio.gather(*tasks)
+        tasks.append(asyncio.create_task(timed_request(request_func_input)))
+    timed_outputs = await asyncio.gather(*tasks)
+    start_times = [start_time for start_time, _ in timed_outputs]
+    outputs: List[RequestFuncOutput] = [
+        output for _, output in timed_outputs
+    ]
 
     if profile:
         print("Stopping profiler...")
@@ -392,7 +642,12 @@ async def benchmark(
         outputs=outputs,
         dur_s=benchmark_duration,
         tokenizer=tokenizer,
+        goodput_config=goodput_config,
     )
+    time_series = calculate_time_series(start_times, outputs,
+                                        actual_output_lens,
+                                        benchmark_duration,
+                                        time_series_interval)
 
     print("{s:{c}^{n}}".format(s=' Serving Benchmark Result ', n=50, c='='))
     print("{:<40} {:<10}".format("Successful requests:", metrics.completed))
@@ -407,6 +662,13 @@ async def benchmark(
                                     metrics.input_throughput))
     print("{:<40} {:<10.2f}".format("Output token throughput (tok/s):",
                                     metrics.output_throughput))
+    if goodput_config:
+        print("{:<40} {:<10.2f}".format("Request goodput (req/s):",
+                                        metrics.request_goodput))
+        print("{:<40} {:<10.2f}".format("SLO attainment (%):",
+                                        metrics.slo_attainment * 100))
+    print("{:<40} {:<10}".format("Peak in-flight requests:",
+                                 max(time_series["in_flight_requests"])))
     print("{s:{c}^{n}}".format(s='Time to First Token', n=50, c='-'))
     print("{:<40} {:<10.2f}".format("Mean TTFT (ms):", metrics.mean_ttft_ms))
     print("{:<40} {:<10.2f}".format("Median TTFT (ms):",
@@ -445,6 +707,10 @@ async def benchmark(
         "median_itl_ms": metrics.median_itl_ms,
         "std_itl_ms": metrics.std_itl_ms,
         "p99_itl_ms": metrics.p99_itl_ms,
+        "goodput_config": goodput_config,
+        "request_goodput": metrics.request_goodput,
+        "slo_attainment": metrics.slo_attainment,
+        "time_series": time_series,
         "input_lens": [output.prompt_len for output in outputs],
         "output_lens": actual_output_lens,
         "ttfts": [output.ttft for output in outputs],
@@ -485,6 +751,7 @@ def main(args: argparse.Namespace):
             num_requests=args.num_prompts,
             tokenizer=tokenizer,
             fixed_output_len=args.sharegpt_output_len,
+            cache_dir=args.dataset_cache_dir,
         )
 
     elif args.dataset_name == "sharegpt":
@@ -493,6 +760,7 @@ def main(args: argparse.Namespace):
             num_requests=args.num_prompts,
             tokenizer=tokenizer,
             fixed_output_len=args.sharegpt_output_len,
+            cache_dir=args.dataset_cache_dir,
         )
 
     elif args.dataset_name == "sonnet":
@@ -537,62 +805,113 @@ def main(args: argparse.Namespace):
     else:
         raise ValueError(f"Unknown dataset: {args.dataset_name}")
 
-    benchmark_result = asyncio.run(
-        benchmark(
-            backend=backend,
-            api_url=api_url,
-            base_url=base_url,
-            model_id=model_id,
-            tokenizer=tokenizer,
-            input_requests=input_requests,
-            best_of=args.best_of,
-            use_beam_search=args.use_beam_search,
-            request_rate=args.request_rate,
-            disable_tqdm=args.disable_tqdm,
-            profile=args.profile,
-        ))
+    goodput_config = parse_goodput(args.goodput)
 
-    # Save config and results to json
+    def run_at_rate(request_rate: float) -> Dict[str, Any]:
+        benchmark_result = asyncio.run(
+            benchmark(
+                backend=backend,
+                api_url=api_url,
+                base_url=base_url,
+                model_id=model_id,
+                tokenizer=tokenizer,
+                input_requests=input_requests,
+                best_of=args.best_of,
+                use_beam_search=args.use_beam_search,
+                request_rate=request_rate,
+                disable_tqdm=args.disable_tqdm,
+                profile=args.profile,
+                goodput_config=goodput_config,
+                time_series_interval=args.time_series_interval,
+            ))
+        if args.save_result:
+            save_result(args, benchmark_result, request_rate)
+        return benchmark_result
+
+    if not args.sweep:
+        run_at_rate(args.request_rate)
+        return
+
+    if not goodput_config:
+        raise ValueError("--sweep needs latency SLOs, please set --goodput.")
+    max_rate, history = find_max_sustainable_rate(
+        run_at_rate,
+        start_rate=args.sweep_start_rate,
+        min_slo_attainment=args.sweep_min_slo_attainment,
+        max_runs=args.sweep_max_runs,
+        tolerance=args.sweep_tolerance,
+    )
+    print("{s:{c}^{n}}".format(s=' Request Rate Sweep ', n=50, c='='))
+    print("{:<12} {:<12} {:<16} {:<10}".format("Rate (req/s)", "Sustainable",
+                                               "Goodput (req/s)",
+                                               "SLO attainment (%)"))
+    for run in history:
+        print("{:<12.2f} {:<12} {:<16.2f} {:<10.2f}".format(
+            run["request_rate"], str(run["sustainable"]),
+            run["request_goodput"], run["slo_attainment"] * 100))
+    print("{:<40} {:<10.2f}".format("Max sustainable rate (req/s):",
+                                    max_rate))
+    print("=" * 50)
     if args.save_result:
-        result_json: Dict[str, Any] = {}
-
-        # Setup
-        current_dt = datetime.now().strftime("%Y%m%d-%H%M%S")
-        result_json["date"] = current_dt
-        result_json["backend"] = backend
-        result_json["model_id"] = model_id
-        result_json["tokenizer_id"] = tokenizer_id
-        result_json["best_of"] = args.best_of
-        result_json["use_beam_search"] = args.use_beam_search
-        result_json["num_prompts"] = args.num_prompts
-
-        # Metadata
-        if args.metadata:
-            for item in args.metadata:
-                if "=" in item:
-                    kvstring = item.split("=")
-                    result_json[kvstring[0].strip()] = kvstring[1].strip()
-                else:
-                    raise ValueError(
-                        "Invalid metadata format. Please use KEY=VALUE format."
-                    )
-
-        # Traffic
-        result_json["request_rate"] = (
-            args.request_rate if args.request_rate < float("inf") else "inf")
-
-        # Merge with benchmark result
-        result_json = {**result_json, **benchmark_result}
-
-        # Save to file
+        sweep_json = {
+            "date": datetime.now().strftime("%Y%m%d-%H%M%S"),
+            "backend": backend,
+            "model_id": model_id,
+            "goodput_config": goodput_config,
+            "min_slo_attainment": args.sweep_min_slo_attainment,
+            "max_sustainable_rate": max_rate,
+            "runs": history,
+        }
         base_model_id = model_id.split("/")[-1]
-        file_name = f"{backend}-{args.request_rate}qps-{base_model_id}-{current_dt}.json"  #noqa
-        if args.result_filename:
-            file_name = args.result_filename
+        file_name = f"{backend}-sweep-{base_model_id}-{sweep_json['date']}.json"  #noqa
         if args.result_dir:
             file_name = os.path.join(args.result_dir, file_name)
         with open(file_name, "w") as outfile:
-            json.dump(result_json, outfile)
+            json.dump(sweep_json, outfile)
+
+
+def save_result(args: argparse.Namespace, benchmark_result: Dict[str, Any],
+                request_rate: float):
+    # Save config and results to json
+    result_json: Dict[str, Any] = {}
+
+    # Setup
+    current_dt = datetime.now().strftime("%Y%m%d-%H%M%S")
+    result_json["date"] = current_dt
+    result_json["backend"] = args.backend
+    result_json["model_id"] = args.model
+    result_json["tokenizer_id"] = (args.tokenizer if args.tokenizer is not None
+                                   else args.model)
+    result_json["best_of"] = args.best_of
+    result_json["use_beam_search"] = args.use_beam_search
+    result_json["num_prompts"] = args.num_prompts
+
+    # Metadata
+    if args.metadata:
+        for item in args.metadata:
+            if "=" in item:
+                kvstring = item.split("=")
+                result_json[kvstring[0].strip()] = kvstring[1].strip()
+            else:
+                raise ValueError(
+                    "Invalid metadata format. Please use KEY=VALUE format.")
+
+    # Traffic
+    result_json["request_rate"] = (request_rate
+                                   if request_rate < float("inf") else "inf")
+
+    # Merge with benchmark result
+    result_json = {**result_json, **benchmark_result}
+
+    # Save to file
+    base_model_id = args.model.split("/")[-1]
+    file_name = f"{args.backend}-{request_rate}qps-{base_model_id}-{current_dt}.json"  #noqa
+    if args.result_filename and not args.sweep:
+        file_name = args.result_filename
+    if args.result_dir:
+        file_name = os.path.join(args.result_dir, file_name)
+    with open(file_name, "w") as outfile:
+        json.dump(result_json, outfile)
 
 
 if __name__ == "__main__":
@@ -636,6 +955,14 @@ if __name__ == "__main__":
                         type=str,
                         default=None,
                         help="Path to the dataset.")
+    parser.add_argument(
+        "--dataset-cache-dir",
+        type=str,
+        default=os.path.join(os.path.expanduser("~"), ".cache",
+                             "benchmark_serving"),
+        help="Directory caching the token counts of the ShareGPT dataset "
+        "per tokenizer. Set to an empty string to disable the cache.",
+    )
     parser.add_argument(
         "--model",
         type=str,
@@ -719,6 +1046,55 @@ if __name__ == "__main__":
         "Otherwise, we use Poisson process to synthesize "
         "the request arrival times.",
     )
+    parser.add_argument(
+        "--goodput",
+        nargs="+",
+        default=None,
+        metavar="KEY:VALUE",
+        help="Latency SLOs in milliseconds, e.g. --goodput ttft:500 tpot:50. "
+        "KEY is one of ttft, tpot and e2el (end to end latency). Requests "
+        "meeting all of them count towards the goodput.",
+    )
+    parser.add_argument(
+        "--time-series-interval",
+        type=float,
+        default=1.0,
+        help="Interval in seconds of the throughput, in-flight requests and "
+        "latency time series saved with the results.",
+    )
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="Search the highest request rate meeting the --goodput SLOs "
+        "instead of benchmarking --request-rate.",
+    )
+    parser.add_argument(
+        "--sweep-start-rate",
+        type=float,
+        default=1.0,
+        help="First request rate of the sweep, doubled until the SLOs are "
+        "missed.",
+    )
+    parser.add_argument(
+        "--sweep-min-slo-attainment",
+        type=float,
+        default=0.9,
+        help="Share of requests that must meet the SLOs for a request rate "
+        "to be sustainable.",
+    )
+    parser.add_argument(
+        "--sweep-max-runs",
+        type=int,
+        default=8,
+        help="Maximum number of benchmarks run by the sweep.",
+    )
+    parser.add_argument(
+        "--sweep-tolerance",
+        type=float,
+        default=0.1,
+        help="The sweep stops once the highest sustainable rate is known "
+        "within this relative tolerance.",
+    )
     parser.add_argument("--seed", type=int, default=0)
     parser.add_argument(
         "--trust-remote-code",
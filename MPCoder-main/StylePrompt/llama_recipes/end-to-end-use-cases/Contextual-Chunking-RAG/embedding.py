@@ -1,6 +1,14 @@
+import os
+import asyncio
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import torch
 from transformers import AutoTokenizer, AutoModel
 from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
@@ -8,27 +16,123 @@ device = "cuda" if torch.cuda.is_available() else "cpu"
 model_id = "jinaai/jina-embeddings-v2-base-en" #"jinaai/jina-embeddings-v3"
 tokenizer = AutoTokenizer.from_pretrained(model_id)
 model = AutoModel.from_pretrained(model_id, trust_remote_code=True).to(device)
+model.eval()
 
-# Define function to generate embeddings
-def get_embedding(text):
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True).to(device)
+# The model is not safe to call from several threads, the async methods queue their work on this single worker
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jina-embedding")
+
+
+# Define function to generate embeddings for a list of texts
+def get_embeddings(texts, batch_size=32):
+    """
+    Embeds the texts batch_size at a time. The texts are sorted by token length so that every batch is only
+    padded up to its own longest text, and the embeddings are returned in the order of texts.
+    """
+    if not texts:
+        return np.zeros((0, model.config.hidden_size), dtype=np.float32)
+    encodings = tokenizer(list(texts), truncation=True)["input_ids"]
+    order = sorted(range(len(texts)), key=lambda i: len(encodings[i]))
+    embeddings = [None] * len(texts)
     with torch.no_grad():
-        outputs = model(**inputs)    
-    return outputs.last_hidden_state.mean(dim=1).squeeze().cpu().numpy() #.to(torch.float32)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            inputs = tokenizer.pad({"input_ids": [encodings[i] for i in batch]}, return_tensors="pt").to(device)
+            outputs = model(**inputs)
+            # Mean over the real tokens only, the padding of the shorter texts must not dilute their embedding
+            mask = inputs["attention_mask"].unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+            pooled = (outputs.last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            for i, emb in zip(batch, pooled.float().cpu().numpy()):
+                embeddings[i] = emb
+    return np.stack(embeddings)
+
+
+def get_embedding(text):
+    return get_embeddings([text])[0]
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by the sha256 of the model id and the text: the most recently used max_items are kept in memory,
+    and when cache_dir is set every embedding is also saved there as a .npy file so that it is reused across runs.
+    """
+    def __init__(self, cache_dir=None, max_items=10000):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.items = OrderedDict()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256((model_id + "\0" + text).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npy")
+
+    def get(self, key):
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]
+        if self.cache_dir and os.path.exists(self._path(key)):
+            emb = np.load(self._path(key))
+            self._remember(key, emb)
+            return emb
+        return None
+
+    def put(self, key, emb):
+        self._remember(key, emb)
+        if self.cache_dir:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a temporary name first, an interrupted run must not leave a truncated file behind
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, emb)
+            os.replace(tmp_path, path)
+
+    def _remember(self, key, emb):
+        self.items[key] = emb
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
 
 
 class LocalJinaEmbedding(BaseEmbedding):
-    def __init__(self):
-        super().__init__()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, embed_batch_size=32, cache_dir="./temp/embedding_cache", cache_size=10000):
+        # embed_batch_size is the number of texts LlamaIndex hands to _get_text_embeddings at once
+        super().__init__(model_name=model_id, embed_batch_size=embed_batch_size)
+        self._cache = EmbeddingCache(cache_dir, cache_size)
+
+    def _embed(self, texts):
+        keys = [self._cache.key(text) for text in texts]
+        found = {key: self._cache.get(key) for key in set(keys)}
+        # Only the texts missing from the cache go through the model, each of them once
+        missing = {key: text for key, text in zip(keys, texts) if found[key] is None}
+        if missing:
+            for key, emb in zip(missing, get_embeddings(list(missing.values()), self.embed_batch_size)):
+                self._cache.put(key, emb)
+                found[key] = emb
+        return [found[key].tolist() for key in keys]  # Ensure compatibility with LlamaIndex
 
     def _get_text_embedding(self, text):
-        return get_embedding(text).tolist()  # Ensure compatibility with LlamaIndex
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts):
+        return self._embed(texts)
 
     def _get_query_embedding(self, query):
-        return get_embedding(query).tolist()
-    
+        return self._embed([query])[0]
+
     async def _aget_query_embedding(self, query: str) -> list:
-        return get_embedding(query).tolist()
+        return await asyncio.get_running_loop().run_in_executor(_executor, self._get_query_embedding, query)
+
+    async def _aget_text_embedding(self, text: str) -> list:
+        return await asyncio.get_running_loop().run_in_executor(_executor, self._get_text_embedding, text)
+
+    async def _aget_text_embeddings(self, texts: list) -> list:
+        return await asyncio.get_running_loop().run_in_executor(_executor, self._get_text_embeddings, texts)
 
 
 
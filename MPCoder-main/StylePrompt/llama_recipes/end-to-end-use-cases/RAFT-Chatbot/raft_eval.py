@@ -15,6 +15,12 @@ from langchain_community.document_loaders import DirectoryLoader
 import re
 import string
 import pandas as pd 
+import hashlib
+import glob
+import os
+from pathlib import Path
+import numpy as np
+import torch
 
 
 def generate_answers_model_only(model_name,question_list,api_url="http://localhost:8000/v1",key="EMPTY"):
@@ -41,28 +47,83 @@ def format_docs_raft(docs):
     for doc in docs:
         context += "\n<DOCUMENT>" + str(doc.page_content) + "</DOCUMENT>\n"
     return context
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+def split_documents(api_config,manifest,text_splitter):
+    # Only read and split the files whose content changed since the index was last built, the others reuse their chunk hashes
+    files = {}
+    for path in sorted(Path(api_config['data_dir']).glob("**/[!.]*")):
+        if not path.is_file():
+            continue
+        relative_path = path.relative_to(api_config['data_dir']).as_posix()
+        file_hash = hashlib.sha256(path.read_bytes()).hexdigest()
+        cached = manifest["files"].get(relative_path)
+        if cached and cached["sha256"] == file_hash and all(h in manifest["chunks"] for h in cached["chunks"]):
+            files[relative_path] = cached
+            continue
+        # Use langchain to load the document with the same loader as the whole directory, the path is escaped
+        # so that a file name with glob characters (e.g. notes[1].txt) matches only itself
+        docs = DirectoryLoader(api_config['data_dir'], glob=glob.escape(relative_path)).load()
+        chunk_hashes = []
+        for doc in text_splitter.split_documents(docs):
+            chunk_hash = hash_text(doc.page_content)
+            manifest["chunks"].setdefault(chunk_hash, {"text": doc.page_content, "metadata": doc.metadata})
+            chunk_hashes.append(chunk_hash)
+        files[relative_path] = {"sha256": file_hash, "chunks": chunk_hashes}
+    manifest["files"] = files
+    # Remove duplicates, keeping the first occurrence of every chunk
+    return list(dict.fromkeys(h for f in files.values() for h in f["chunks"]))
 def build_retriever(api_config,embedding_model_name,retrieved_docs_num=5):
-    # Use langchain to load the documents from data directory
-    loader = DirectoryLoader(api_config['data_dir'])
-    docs = loader.load()
+    # The index is stored per embedding model and chunk size, the chunks are keyed by the hash of their content
+    # so only new or changed chunks are embedded again
+    index_dir = os.path.join(api_config.get("index_dir", "./rag_index"), f"{embedding_model_name.replace('/', '--')}-chunk{api_config['chunk_size']}")
+    manifest_path = os.path.join(index_dir, "manifest.json")
+    vectors_path = os.path.join(index_dir, "vectors.npy")
+    manifest = {"files": {}, "chunks": {}, "rows": []}
+    vectors = None
+    if os.path.exists(manifest_path) and os.path.exists(vectors_path):
+        with open(manifest_path) as fp:
+            manifest = json.load(fp)
+        # Memory map the vectors, rows of unchanged chunks are read from disk without loading the whole file
+        vectors = np.load(vectors_path, mmap_mode="r")
     # Split the document into chunks with a specified chunk size
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=api_config["chunk_size"],chunk_overlap=int(api_config["chunk_size"] / 10),separators= ["----------","\n\n", "\n", " ", ""],strip_whitespace=True)
-    docs_processed = text_splitter.split_documents(docs)
-    # Remove duplicates
-    unique_texts = {}
-    docs_processed_unique = []
-    for doc in docs_processed:
-        if doc.page_content not in unique_texts:
-            unique_texts[doc.page_content] = True
-            docs_processed_unique.append(doc)
-    logging.info(f"Total number of docs_processed used by vectorstore: {len(docs_processed_unique)}")
+    chunk_hashes = split_documents(api_config,manifest,text_splitter)
+    logging.info(f"Total number of docs_processed used by vectorstore: {len(chunk_hashes)}")
     # Store the document into a vector store with a specific embedding model
+    device = api_config.get("embedding_device") or ("cuda" if torch.cuda.is_available() else "cpu")
     embedding_model = HuggingFaceEmbeddings(
         model_name=embedding_model_name,
-        model_kwargs={"device": "cuda"},
-        encode_kwargs={"normalize_embeddings": True},  # Set `True` for cosine similarity
+        model_kwargs={"device": device},
+        encode_kwargs={"normalize_embeddings": True, "batch_size": api_config.get("embedding_batch_size", 64)},  # Set `True` for cosine similarity
+    )
+    row_of = {h: i for i, h in enumerate(manifest["rows"])} if vectors is not None else {}
+    new_hashes = [h for h in chunk_hashes if h not in row_of]
+    # The rows of vectors.npy follow manifest["rows"], they are rewritten whenever the chunks or their order change
+    # (e.g. a renamed file) so that vectors[i] is always the embedding of chunk_hashes[i]
+    if vectors is None or chunk_hashes != manifest["rows"]:
+        logging.info(f"Embedding {len(new_hashes)} new chunks, reusing {len(chunk_hashes) - len(new_hashes)} from {index_dir}")
+        new_vectors = {}
+        if new_hashes:
+            embedded = embedding_model.embed_documents([manifest["chunks"][h]["text"] for h in new_hashes])
+            new_vectors = dict(zip(new_hashes, np.asarray(embedded, dtype=np.float32)))
+        vectors = np.stack([new_vectors[h] if h in new_vectors else vectors[row_of[h]] for h in chunk_hashes]) if chunk_hashes else np.zeros((0, 0), dtype=np.float32)
+        # Drop the chunks of removed or changed files
+        manifest["chunks"] = {h: manifest["chunks"][h] for h in chunk_hashes}
+        manifest["rows"] = chunk_hashes
+        os.makedirs(index_dir, exist_ok=True)
+        # Write to temporary files first so an interrupted run never leaves a manifest that does not match the vectors
+        np.save(vectors_path + ".tmp.npy", vectors)
+        with open(manifest_path + ".tmp", "w") as fp:
+            json.dump(manifest, fp)
+        os.replace(vectors_path + ".tmp.npy", vectors_path)
+        os.replace(manifest_path + ".tmp", manifest_path)
+    vectorstore = FAISS.from_embeddings(
+        text_embeddings=[(manifest["chunks"][h]["text"], vectors[i]) for i, h in enumerate(chunk_hashes)],
+        embedding=embedding_model,
+        metadatas=[manifest["chunks"][h]["metadata"] for h in chunk_hashes],
+        distance_strategy=DistanceStrategy.COSINE,
     )
-    vectorstore = FAISS.from_documents(docs_processed_unique, embedding_model, distance_strategy=DistanceStrategy.COSINE)
     retriever = vectorstore.as_retriever(
         search_kwargs={"k": retrieved_docs_num},
     )
@@ -315,6 +376,9 @@ def parse_arguments():
         help="set the number of top k documents the RAG needs to retrieve."
     )
     parser.add_argument("--chunk_size", type=int, default=1000, help="The character size of each chunk used in RAG")
+    parser.add_argument("--index_dir", type=str, default="./rag_index", help="The folder caching the RAG chunks and their embeddings between eval runs")
+    parser.add_argument("--embedding_batch_size", type=int, default=64, help="The number of chunks embedded together")
+    parser.add_argument("--embedding_device", type=str, default=None, help="The device of the embedding model, cuda if available by default")
     return parser.parse_args()
 
 if __name__ == "__main__":
@@ -331,6 +395,9 @@ if __name__ == "__main__":
     api_config["api_key"] = args.api_key
     api_config["chunk_size"] = args.chunk_size
     api_config["rag_topk"] = args.rag_topk
+    api_config["index_dir"] = args.index_dir
+    api_config["embedding_batch_size"] = args.embedding_batch_size
+    api_config["embedding_device"] = args.embedding_device
     if api_config["judge_endpoint_url"]:
         logging.info(f"The judge model url is: '{args.judge_endpoint_url}'.")
     main(api_config)
@@ -0,0 +1,287 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+# Asyncio load testing harness for OpenAI compatible endpoints (vLLM, Azure serverless APIs, ...).
+# All requests stream over one pooled aiohttp session, so time to first token (TTFT) and inter-token latency (ITL)
+# are measured, and arrive either from a fixed number of concurrent users (closed loop) or as a Poisson process.
+
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, List, Optional, Tuple
+
+import aiohttp
+import numpy as np
+
+# The request functions of the vLLM serving benchmark are shared by all backends
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../3p-integrations/crusoe/vllm-fp8/benchmarks"))
+from backend_request_func import AIOHTTP_TIMEOUT, ASYNC_REQUEST_FUNCS, RequestFuncInput, RequestFuncOutput  # noqa: E402
+from mock_server import start_mock_server  # noqa: E402
+
+METRICS = [
+    ("Number of Requests", "num_requests", "{:d}"),
+    ("Failed Requests", "failed", "{:d}"),
+    ("P50 Latency (ms)", "p50_latency", "{:.2f}"),
+    ("P99 Latency (ms)", "p99_latency", "{:.2f}"),
+    ("Mean TTFT (ms)", "mean_ttft", "{:.2f}"),
+    ("P99 TTFT (ms)", "p99_ttft", "{:.2f}"),
+    ("Mean ITL (ms)", "mean_itl", "{:.2f}"),
+    ("P99 ITL (ms)", "p99_itl", "{:.2f}"),
+    ("RPS", "rps", "{:.2f}"),
+    ("Output Tokens per Second", "output_tps", "{:.2f}"),
+    ("Output Tokens per Second per GPU", "output_tps_per_gpu", "{:.2f}"),
+    ("Input Tokens per Second", "input_tps", "{:.2f}"),
+    ("Input Tokens per Second per GPU", "input_tps_per_gpu", "{:.2f}"),
+    ("Average Output Tokens per Second per Request", "output_tps_per_request", "{:.2f}"),
+    ("Number of Requests Below Threshold", "below_threshold", "{:d}"),
+]
+
+
+async def run_load(
+    request_func: Callable,
+    endpoints: List[str],
+    prompt: str,
+    prompt_len: int,
+    model: str,
+    output_len: int,
+    num_requests: int,
+    concurrency: Optional[int] = None,
+    request_rate: Optional[float] = None,
+    seed: int = 0,
+) -> Tuple[List[RequestFuncOutput], float]:
+    """
+    Sends num_requests requests and returns their outputs and the wall time it took.
+
+    Without request_rate, `concurrency` users each send their next request as soon as the previous one finished
+    (closed loop). With request_rate, requests arrive with exponential inter-arrival times of mean 1 / request_rate
+    (Poisson) whether or not earlier ones finished, and concurrency optionally caps the requests in flight.
+    Requests are dispatched round-robin over the endpoints.
+    """
+    if request_rate is None and not concurrency:
+        raise ValueError("a closed loop needs a concurrency level")
+    endpoint_cycle = itertools.cycle(endpoints)
+    outputs = []
+    connector = aiohttp.TCPConnector(limit=concurrency or 0)
+    async with aiohttp.ClientSession(timeout=AIOHTTP_TIMEOUT, connector=connector) as session:
+
+        async def send():
+            request_func_input = RequestFuncInput(
+                prompt=prompt,
+                api_url=next(endpoint_cycle),
+                prompt_len=prompt_len,
+                output_len=output_len,
+                model=model,
+            )
+            outputs.append(await request_func(request_func_input=request_func_input, session=session))
+
+        start = time.perf_counter()
+        if request_rate is None:
+            remaining = iter(range(num_requests))
+
+            async def user():
+                for _ in remaining:
+                    await send()
+
+            await asyncio.gather(*(user() for _ in range(concurrency)))
+        else:
+            rng = random.Random(seed)
+            in_flight = asyncio.Semaphore(concurrency) if concurrency else None
+
+            async def arrive():
+                if in_flight is None:
+                    await send()
+                    return
+                async with in_flight:
+                    await send()
+
+            tasks = []
+            for i in range(num_requests):
+                tasks.append(asyncio.create_task(arrive()))
+                if i < num_requests - 1:
+                    await asyncio.sleep(rng.expovariate(request_rate))
+            await asyncio.gather(*tasks)
+        duration = time.perf_counter() - start
+    return outputs, duration
+
+
+def summarize(outputs: List[RequestFuncOutput], duration: float, count_tokens: Callable, threshold_tps: float = 0, num_gpus: int = 1) -> dict:
+    succeeded = [o for o in outputs if o.success]
+    output_lens = [count_tokens(o) for o in succeeded]
+    latencies = [o.latency * 1000 for o in succeeded]
+    ttfts = [o.ttft * 1000 for o in succeeded]
+    itls = [t * 1000 for o in succeeded for t in o.itl]
+    per_request_tps = [n / o.latency for n, o in zip(output_lens, succeeded) if o.latency > 0]
+
+    def percentile(values, q):
+        return float(np.percentile(values, q)) if values else 0.0
+
+    def mean(values):
+        return float(np.mean(values)) if values else 0.0
+
+    output_tps = sum(output_lens) / duration
+    input_tps = sum(o.prompt_len for o in succeeded) / duration
+    return {
+        "num_requests": len(outputs),
+        "failed": len(outputs) - len(succeeded),
+        "p50_latency": percentile(latencies, 50),
+        "p99_latency": percentile(latencies, 99),
+        "mean_ttft": mean(ttfts),
+        "p99_ttft": percentile(ttfts, 99),
+        "mean_itl": mean(itls),
+        "p99_itl": percentile(itls, 99),
+        "rps": len(succeeded) / duration,
+        "output_tps": output_tps,
+        "output_tps_per_gpu": output_tps / num_gpus,
+        "input_tps": input_tps,
+        "input_tps_per_gpu": input_tps / num_gpus,
+        "output_tps_per_request": mean(per_request_tps),
+        "below_threshold": sum(1 for tps in per_request_tps if tps < threshold_tps),
+    }
+
+
+async def benchmark(args):
+    runner = None
+    endpoints = args.endpoints
+    if args.mock:
+        runner = await start_mock_server(ttft=args.mock_ttft, itl=args.mock_itl, max_batch_size=args.mock_max_batch_size)
+        host, port = runner.addresses[0][:2]
+        path = "/v1/chat/completions" if args.backend == "openai-chat" else "/v1/completions"
+        endpoints = [f"http://{host}:{port}{path}"]
+
+    # The number of output tokens reported by the server is used when there is one
+    if args.tokenizer:
+        from backend_request_func import get_tokenizer
+        tokenizer = get_tokenizer(args.tokenizer, trust_remote_code=False)
+        prompt_len = len(tokenizer.encode(args.prompt, add_special_tokens=False))
+
+        def count_tokens(output):
+            if output.output_tokens is not None:
+                return output.output_tokens
+            return len(tokenizer.encode(output.generated_text, add_special_tokens=False))
+    else:
+        # Without a tokenizer every streamed chunk counts as one token, which holds for vLLM
+        prompt_len = len(args.prompt.split())
+
+        def count_tokens(output):
+            if output.output_tokens is not None:
+                return output.output_tokens
+            return len(output.itl) + 1 if output.generated_text else 0
+    print(f"Number of token for input prompt: {prompt_len}")
+
+    request_func = ASYNC_REQUEST_FUNCS[args.backend]
+    closed_loop = args.mode == "closed"
+    label = "Number of Concurrent Requests" if closed_loop else "Request Rate (req/s)"
+    header = [label] + [name for name, _, _ in METRICS]
+    print("| " + " | ".join(header) + " |")
+    print("|" + "|".join("---" for _ in header) + "|")
+
+    rows = []
+    try:
+        for level in args.levels:
+            num_requests = args.num_requests or (4 * int(level) if closed_loop else 100)
+            outputs, duration = await run_load(
+                request_func,
+                endpoints,
+                args.prompt,
+                prompt_len,
+                args.model,
+                args.max_new_tokens,
+                num_requests,
+                concurrency=int(level) if closed_loop else args.max_concurrency,
+                request_rate=None if closed_loop else float(level),
+                seed=args.seed,
+            )
+            metrics = summarize(outputs, duration, count_tokens, args.threshold_tps, args.num_gpus)
+            failures = [o.error for o in outputs if not o.success]
+            if failures:
+                print(f"{len(failures)} requests failed, first error: {failures[0]}")
+            row = [level] + [fmt.format(metrics[key]) for _, key, fmt in METRICS]
+            print("| " + " | ".join(str(v) for v in row) + " |")
+            rows.append(row)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+    if args.output_csv:
+        with open(args.output_csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test OpenAI compatible inference endpoints")
+    parser.add_argument("--parameters", type=str, default=None, help="parameters.json of the on_prem or cloud benchmarks, used for the defaults")
+    parser.add_argument("--input", type=str, default=None, help="input.jsonl with the prompts by length")
+    parser.add_argument("--prompt-key", type=str, default="1k", help="prompt length to pick from --input: 5, 25, 50, 100, 500, 1k or 2k")
+    parser.add_argument("--prompt", type=str, default=None, help="prompt used instead of --input")
+    parser.add_argument("--backend", type=str, default="openai-chat", choices=list(ASYNC_REQUEST_FUNCS.keys()))
+    parser.add_argument("--endpoints", type=str, nargs="+", default=None, help="endpoints receiving the requests round-robin")
+    parser.add_argument("--model", type=str, default=None)
+    parser.add_argument("--tokenizer", type=str, default=None, help="tokenizer counting the tokens, defaults to --model, 'none' counts streamed chunks")
+    parser.add_argument("--api-key", type=str, default=None, help="sent as a bearer token, defaults to OPENAI_API_KEY")
+    parser.add_argument("--max-new-tokens", type=int, default=None)
+    parser.add_argument("--mode", type=str, default="closed", choices=["closed", "poisson"],
+                        help="closed: each level is a number of concurrent users, poisson: each level is a request rate")
+    parser.add_argument("--levels", type=float, nargs="+", default=None, help="concurrency levels or request rates, defaults to CONCURRENT_LEVELS")
+    parser.add_argument("--num-requests", type=int, default=None, help="requests per level, defaults to 4 per user in closed loop and 100 for poisson")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="cap of requests in flight in poisson mode")
+    parser.add_argument("--threshold-tps", type=float, default=None, help="tokens per second below which a request counts as slow")
+    parser.add_argument("--num-gpus", type=int, default=1)
+    parser.add_argument("--output-csv", type=str, default="performance_metrics.csv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mock", action="store_true", help="run against the local mock server, no GPU or network needed")
+    parser.add_argument("--mock-ttft", type=float, default=0.05)
+    parser.add_argument("--mock-itl", type=float, default=0.01)
+    parser.add_argument("--mock-max-batch-size", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    params = {}
+    if args.parameters:
+        with open(args.parameters) as f:
+            params = json.load(f)
+    if args.prompt is None:
+        if args.input:
+            with open(args.input) as f:
+                args.prompt = json.load(f)[args.prompt_key]
+        else:
+            args.prompt = "What is Deep Learning"
+    if args.endpoints is None:
+        endpoints = params.get("MODEL_ENDPOINTS", [])
+        args.endpoints = [endpoints] if isinstance(endpoints, str) else endpoints
+    if args.model is None:
+        args.model = params.get("MODEL_PATH", "mock-model")
+    if args.tokenizer is None and not args.mock:
+        args.tokenizer = args.model
+    if args.tokenizer == "none":
+        args.tokenizer = None
+    if args.max_new_tokens is None:
+        args.max_new_tokens = params.get("MAX_NEW_TOKENS", params.get("MAX_NEW_TOKEN", 256))
+    if args.levels is None:
+        args.levels = params.get("CONCURRENT_LEVELS", [1, 2, 4, 8, 16, 32, 64])
+    if args.mode == "closed":
+        args.levels = [int(level) for level in args.levels]
+    if args.threshold_tps is None:
+        args.threshold_tps = params.get("THRESHOLD_TPS", 7)
+    api_key = args.api_key or params.get("API_KEY")
+    if api_key:
+        # The request functions read the key from the environment
+        os.environ["OPENAI_API_KEY"] = api_key
+    if not args.endpoints and not args.mock:
+        parser.error("no endpoints, set --endpoints, MODEL_ENDPOINTS in --parameters or use --mock")
+    return args
+
+
+def main(argv=None):
+    asyncio.run(benchmark(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+# Offline OpenAI compatible server (/v1/completions, /v1/chat/completions, /v1/models) that streams fake tokens with a
+# configurable time to first token and inter-token latency, so load_test.py can be tried without a GPU or an API key.
+
+import argparse
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+
+def make_app(ttft: float = 0.05, itl: float = 0.01, max_batch_size: int = 0, model: str = "mock-model") -> web.Application:
+    # Requests above max_batch_size wait for a free slot, like a server with a bounded batch (0 means no limit)
+    slots = asyncio.Semaphore(max_batch_size) if max_batch_size > 0 else None
+
+    async def models(request):
+        return web.json_response({"object": "list", "data": [{"id": model, "object": "model"}]})
+
+    async def completions(request):
+        body = await request.json()
+        chat = request.path.rstrip("/").endswith("chat/completions")
+        if chat:
+            prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        else:
+            prompt = body.get("prompt", "")
+        prompt_tokens = len(str(prompt).split())
+        num_tokens = int(body.get("max_tokens") or 16)
+        tokens = [f" token{i}" for i in range(num_tokens)]
+
+        def chunk(text, finish_reason=None):
+            choice = {"index": 0, "finish_reason": finish_reason}
+            if chat:
+                choice["delta"] = {"content": text} if text else {}
+            else:
+                choice["text"] = text
+            return {
+                "id": f"mock-{id(request)}",
+                "object": "chat.completion.chunk" if chat else "text_completion",
+                "created": int(time.time()),
+                "model": body.get("model", model),
+                "choices": [choice],
+            }
+
+        if slots is not None:
+            await slots.acquire()
+        try:
+            if not body.get("stream", False):
+                await asyncio.sleep(ttft + itl * max(num_tokens - 1, 0))
+                text = "".join(tokens)
+                choice = {"index": 0, "finish_reason": "length"}
+                if chat:
+                    choice["message"] = {"role": "assistant", "content": text}
+                else:
+                    choice["text"] = text
+                return web.json_response({
+                    "id": f"mock-{id(request)}",
+                    "object": "chat.completion" if chat else "text_completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", model),
+                    "choices": [choice],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": num_tokens,
+                        "total_tokens": prompt_tokens + num_tokens,
+                    },
+                })
+
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+            await response.prepare(request)
+            await asyncio.sleep(ttft)
+            for i, token in enumerate(tokens):
+                if i > 0:
+                    await asyncio.sleep(itl)
+                await response.write(f"data: {json.dumps(chunk(token))}\n\n".encode())
+            await response.write(f"data: {json.dumps(chunk('', 'length'))}\n\n".encode())
+            if (body.get("stream_options") or {}).get("include_usage"):
+                usage = chunk("")
+                usage["choices"] = []
+                usage["usage"] = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": num_tokens,
+                    "total_tokens": prompt_tokens + num_tokens,
+                }
+                await response.write(f"data: {json.dumps(usage)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+            return response
+        finally:
+            if slots is not None:
+                slots.release()
+
+    app = web.Application()
+    app.router.add_get("/v1/models", models)
+    app.router.add_post("/v1/completions", completions)
+    app.router.add_post("/v1/chat/completions", completions)
+    return app
+
+
+async def start_mock_server(host: str = "127.0.0.1", port: int = 0, **kwargs) -> web.AppRunner:
+    """Starts the mock server in the running event loop, port 0 picks a free port (see runner.addresses)"""
+    runner = web.AppRunner(make_app(**kwargs))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI compatible server streaming fake tokens")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ttft", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--itl", type=float, default=0.01, help="seconds between two tokens")
+    parser.add_argument("--max-batch-size", type=int, default=0, help="requests served at the same time, 0 for no limit")
+    args = parser.parse_args()
+
+    print(f"Mock server on http://{args.host}:{args.port}/v1")
+    web.run_app(
+        make_app(ttft=args.ttft, itl=args.itl, max_batch_size=args.max_batch_size),
+        host=args.host,
+        port=args.port,
+        print=None,
+    )
+
+
+if __name__ == "__main__":
+    main()
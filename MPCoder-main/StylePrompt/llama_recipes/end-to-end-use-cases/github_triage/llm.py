@@ -3,6 +3,12 @@ from typing import Any, Dict, List, Optional, Union
 import yaml
 import time
 import json
+import random
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from tqdm import tqdm
 from openai import OpenAI
@@ -15,40 +21,34 @@ CFG = yaml.safe_load(open("config.yaml", "r"))
 class LlamaVLLM():
     def __init__(self, endpoint, model_id):
         self.model_id = model_id
-        self.client = OpenAI(base_url=endpoint, api_key='token')
+        self.client = OpenAI(base_url=endpoint, api_key='token', max_retries=0)
 
     def chat(
         self,
         inputs: List[Dict[str, str]],
         generation_kwargs: Optional[Dict[str, Any]] = None,
         guided_decode_json_schema: Optional[str] = None
-    ) -> List[str]:
+    ) -> str:
 
         if generation_kwargs is None:
             generation_kwargs = {}
             
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=inputs,
-                extra_body={
-                    "guided_json": guided_decode_json_schema
-                },
-                **generation_kwargs,
-            )
-            output = response.choices[0].message
-        except Exception as e:
-            logger.error(
-                f"FAILED to generate inference for input {inputs}\nError: {str(e)}"
-            )
-            output = None
-        return output
+        # Errors are raised to the dispatcher, which retries the request
+        response = self.client.chat.completions.create(
+            model=self.model_id,
+            messages=inputs,
+            extra_body={
+                "guided_json": guided_decode_json_schema
+            },
+            **generation_kwargs,
+        )
+        return response.choices[0].message.content
     
 
 class LlamaGroq():
     def __init__(self, key, model_id):
         self.model_id = model_id
-        self.client = groq.Groq(api_key=key)
+        self.client = groq.Groq(api_key=key, max_retries=0)
         logger.debug(f"Using Groq:{self.model_id} for inference")
 
     def chat(
@@ -63,33 +63,130 @@ class LlamaGroq():
             
         # Currently Groq doesn't support guided JSON decoding. Workaround:
         if guided_decode_json_schema is not None:
+            # Copied so that a retried request does not get the schema twice
+            inputs = [dict(m) for m in inputs]
             inputs[0]['content'] += f"\n\nEnsure your response aligns with the following JSON schema:\n{guided_decode_json_schema}\n\n"
         
-        output = None
-        
-        while True:
-            try:
-                response = self.client.chat.completions.with_raw_response.create(
-                    model=self.model_id,
-                    messages=inputs,
-                    stream=False,
-                    **generation_kwargs,
-                    response_format={"type": 'json_object' if guided_decode_json_schema is not None else 'text'}
-                )
-                completion = response.parse()
-                output = completion.choices[0].message.content
-                break
-            except groq.RateLimitError as e:
-                wait = e.response.headers['X-Ratelimit-Reset']
-                response = e.response
-                print(e)
-                print(f"[groq] waiting for {wait} to prevent ratelimiting")
-                time.sleep(wait)
-            except Exception as e:
-                logger.error(f"INFERENCE FAILED with Error: {e.response.status_code} for input:\n{inputs[-1]['content'][:300]}")
-                break
-
-        return output
+        # Errors, including rate limiting, are raised to the dispatcher, which waits and retries the request
+        response = self.client.chat.completions.with_raw_response.create(
+            model=self.model_id,
+            messages=inputs,
+            stream=False,
+            **generation_kwargs,
+            response_format={"type": 'json_object' if guided_decode_json_schema is not None else 'text'}
+        )
+        completion = response.parse()
+        return completion.choices[0].message.content
+
+
+@lru_cache(maxsize=None)
+def get_llm(model_type: str):
+    """
+    Returns the LLM accessor of model_type, created once and shared by all the calls (and threads) of run_llm_inference
+    """
+    if model_type == 'vllm':
+        return LlamaVLLM(**CFG['model']['vllm'])
+    elif model_type == 'groq':
+        return LlamaGroq(**CFG['model']['groq'])
+    raise ValueError("Invalid model type in config.yaml")
+
+
+class RateLimiter():
+    """
+    Spaces the start of the requests so that at most requests_per_minute are sent, across all the threads
+    """
+    def __init__(self, requests_per_minute: Optional[float] = None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        time.sleep(start - now)
+
+
+class ResponseCache():
+    """
+    SQLite store of the LLM responses keyed by the hash of everything that determines them, so that a rerun on the
+    same issues does not query the model again. Only used from the thread calling run_llm_inference.
+    """
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT)")
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, response: str):
+        self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?)", (key, response))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset"):
+        try:
+            return float(str(headers[header]).rstrip("s"))
+        except (KeyError, ValueError):
+            continue
+    return None
+
+
+def _is_json(text: str) -> bool:
+    try:
+        json.loads(text, strict=False)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+
+def _is_retryable(e: Exception) -> bool:
+    # Connection errors and timeouts have no status code, other client errors (e.g. a bad request) would fail again
+    status = getattr(e, "status_code", None)
+    return status is None or status in (408, 409, 429) or status >= 500
+
+
+def chat_with_retries(
+    LLM,
+    limiter: RateLimiter,
+    inputs: List[Dict[str, str]],
+    generation_kwargs: Optional[Dict] = None,
+    guided_decode_json_schema: Optional[str] = None,
+    max_retries: int = 3,
+) -> Optional[str]:
+    """
+    Sends one chat request, retrying it with exponential backoff (or after the wait asked by the server).
+    With a JSON schema, a response that is not valid JSON is retried as well. Returns None if the request still fails.
+    """
+    for attempt in range(max_retries + 1):
+        limiter.wait()
+        try:
+            response = LLM.chat(inputs, generation_kwargs, guided_decode_json_schema)
+            if guided_decode_json_schema is not None:
+                # Raises on a malformed answer, so that only valid JSON is returned and cached
+                json.loads(response, strict=False)
+            return response
+        except Exception as e:
+            if attempt == max_retries or not _is_retryable(e):
+                logger.error(f"INFERENCE FAILED with Error: {e} for input:\n{inputs[-1]['content'][:300]}")
+                return None
+            wait = min(_retry_after(e) or 2 ** attempt * (1 + random.random()), 60)
+            logger.debug(f"Retrying inference in {wait:.1f}s after Error: {e}")
+            time.sleep(wait)
 
 
 def run_llm_inference(
@@ -101,6 +198,10 @@ def run_llm_inference(
     """
     Run the LLM inference on the given inputs.
 
+    The requests are sent concurrently from a thread pool, up to `max_concurrency` in flight and at most
+    `requests_per_minute`, each retried up to `max_retries` times, and the responses are cached in the `cache`
+    SQLite file (all set in the `model` section of config.yaml).
+
     Args:
     - prompt_name (str): The name of the prompt to use.
     - inputs (str or List[str]): The input(s) to the LLM.
@@ -111,15 +212,11 @@ def run_llm_inference(
     - Union[str, List[str]]: The response(s) from the LLM.
     """
     
-    # initialize appropriate LLM accessor
-    if CFG['model']['use'] == 'vllm':
-        LLM = LlamaVLLM(**CFG['model']['vllm'])
-    elif CFG['model']['use'] == 'groq':
-        LLM = LlamaGroq(**CFG['model']['groq'])
-    else:
-        raise ValueError("Invalid model type in config.yaml")
+    # reuse the LLM accessor, and its connection pool, across calls
+    model_type = CFG['model']['use']
+    LLM = get_llm(model_type)
     
-    logger.debug(f"Running `{prompt_name}` inference with {CFG['model']['use']}")
+    logger.debug(f"Running `{prompt_name}` inference with {model_type}")
     
     _batch = True
     if isinstance(inputs, str):
@@ -142,10 +239,49 @@ def run_llm_inference(
             CFG["prompts"][prompt_name]["json_schema"].split()
         )
 
-    responses = [
-        LLM.chat(i, generation_kwargs, guided_decode_json_schema) 
-        for i in tqdm(inputs, desc=f"Inference[{prompt_name}]")
+    # The key covers everything the response depends on, so that editing a prompt or switching model is not served stale results
+    keys = [
+        ResponseCache.key(prompt_name, model_type, LLM.model_id, i, generation_kwargs, guided_decode_json_schema)
+        for i in inputs
     ]
+    cache = ResponseCache(CFG['model']['cache']) if CFG['model'].get('cache') else None
+    responses = {}
+    try:
+        if cache is not None:
+            for key in keys:
+                response = cache.get(key)
+                # Skip malformed answers cached before they were retried, so that they are requested again
+                if response is not None and (guided_decode_json_schema is None or _is_json(response)):
+                    responses[key] = response
+        # Identical inputs are sent only once
+        pending = {key: i for key, i in zip(keys, inputs) if key not in responses}
+        if len(responses):
+            logger.info(f"Inference[{prompt_name}]: {len(responses)} cached responses, {len(pending)} requests to send")
+
+        limiter = RateLimiter(CFG['model'].get('requests_per_minute'))
+        with ThreadPoolExecutor(max_workers=CFG['model'].get('max_concurrency', 8)) as executor:
+            futures = {
+                executor.submit(
+                    chat_with_retries,
+                    LLM,
+                    limiter,
+                    i,
+                    generation_kwargs,
+                    guided_decode_json_schema,
+                    CFG['model'].get('max_retries', 3),
+                ): key
+                for key, i in pending.items()
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc=f"Inference[{prompt_name}]"):
+                key = futures[future]
+                responses[key] = future.result()
+                if cache is not None and responses[key] is not None:
+                    cache.put(key, responses[key])
+    finally:
+        if cache is not None:
+            cache.close()
+
+    responses = [responses[key] for key in keys]
 
     if guided_decode_json_schema is not None:
         responses_json = []
@@ -1,10 +1,11 @@
 import logging
 import os
-from typing import Optional, Tuple, Dict
+from typing import Optional, Tuple, Dict, List
 import pandas as pd
 import fire
+from collections import Counter
 
-from llm import run_llm_inference
+from llm import run_llm_inference, CFG
 from utils import fetch_repo_issues, validate_df_values
 from plots import draw_all_plots
 from pdf_report import create_report_pdf
@@ -13,6 +14,59 @@ logging.basicConfig(level=logging.INFO, filename='log.txt', format='%(asctime)s
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
 
+def chunk_by_token_budget(
+    records: List[Dict], max_tokens: int
+) -> List[List[Dict]]:
+    """
+    Split the records into consecutive chunks whose prompt fits in max_tokens.
+
+    Args:
+    - records (List[Dict]): The records to split, in order.
+    - max_tokens (int): The token budget of a chunk, estimated as 4 characters per token. A record over the budget gets a chunk of its own.
+
+    Returns:
+    - List[List[Dict]]: The chunks of records.
+    """
+    chunks, chunk_tokens = [], 0
+    for record in records:
+        tokens = len(str(record)) // 4 + 1
+        if not chunks or chunk_tokens + tokens > max_tokens:
+            chunks.append([])
+            chunk_tokens = 0
+        chunks[-1].append(record)
+        chunk_tokens += tokens
+    return chunks
+
+
+def merge_theme_reports(
+    chunks: List[List[Dict]], reports: List[Optional[Dict]]
+) -> Dict[int, List[str]]:
+    """
+    Merge the themes assigned to every chunk of issues into one mapping of issue number to themes.
+
+    Args:
+    - chunks (List[List[Dict]]): The chunks of minified issues sent to `assign_category`.
+    - reports (List[Dict]): The `assign_category` response of every chunk, None if the inference failed.
+
+    Returns:
+    - Dict[int, List[str]]: The sorted themes of every categorized issue. Issue numbers which were not in the chunk are ignored.
+    """
+    issue_themes = {}
+    for chunk, report in zip(chunks, reports):
+        if report is None:
+            continue
+        numbers = {int(issue["number"]) for issue in chunk}
+        for t in report.get("report", []):
+            for num in t.get("related_issues", []):
+                try:
+                    num = int(num)
+                except (TypeError, ValueError):
+                    continue
+                if num in numbers:
+                    issue_themes.setdefault(num, set()).add(t["theme"])
+    return {num: sorted(themes) for num, themes in issue_themes.items()}
+
+
 def generate_issue_annotations(
     issues_df: pd.DataFrame
 ) -> Tuple[pd.DataFrame, Dict[str, int]]:
@@ -31,7 +85,8 @@ def generate_issue_annotations(
         issues_metadata_df: pd.DataFrame,
     ) -> Tuple[pd.Series, Dict[str, int]]:
         """
-        Categorize the issues.
+        Categorize the issues. The issues are split into chunks that fit the token budget of the `assign_category`
+        prompt, the chunks are categorized concurrently and their themes are merged per issue.
 
         Args:
         - issues_metadata_df (pd.DataFrame): The DataFrame containing the issues metadata.
@@ -49,23 +104,23 @@ def generate_issue_annotations(
                 "issue_type",
             ]
         ].to_dict(orient="records")
+        chunks = chunk_by_token_budget(
+            minified_issues,
+            CFG["prompts"]["assign_category"].get("max_input_tokens", 6000),
+        )
+        logger.info(f"Categorizing {len(minified_issues)} issues in {len(chunks)} chunks")
         themes_json = run_llm_inference(
             "assign_category",
-            str(minified_issues),
+            [str(chunk) for chunk in chunks],
             generation_kwargs={"temperature": 0.45, "max_tokens": 2048},
         )
 
-        tmp = {}
-        for t in themes_json["report"]:
-            for num in t["related_issues"]:
-                tmp[num] = tmp.get(num, []) + [t["theme"]]
+        tmp = merge_theme_reports(chunks, themes_json)
 
         themes = issues_metadata_df.number.apply(
             lambda x: tmp.get(x, ["Miscellaneous"])
         )
-        theme_count = {
-            k["theme"]: len(k["related_issues"]) for k in themes_json["report"]
-        }
+        theme_count = dict(sorted(Counter(t for ts in themes for t in ts).items()))
         return themes, theme_count
 
     logger.info(f"Generating annotations for {len(issues_df)} issues")
@@ -1,3 +1,11 @@
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import aiohttp
 import requests
 import yaml
 import pandas as pd
@@ -9,17 +17,141 @@ logger.addHandler(logging.StreamHandler())
 CFG = yaml.safe_load(open("config.yaml", "r"))
 
 
-def fetch_github_endpoint(url):
-    headers = {
+GITHUB_API = "https://api.github.com"
+
+# Reused across calls so that the connection to the API is kept alive
+_session = requests.Session()
+
+
+def github_headers():
+    return {
         "Authorization": f"Bearer {CFG['github_token']}",
         "Content-Type": "application/json"
     }
+
+
+def fetch_github_endpoint(url):
     logger.debug(f"Requesting url: {url}")
-    response = requests.get(url, headers=headers, timeout=10)
+    response = _session.get(url, headers=github_headers(), timeout=10)
     return response
 
 
-def fetch_repo_issues(repo, start_date=None, end_date=None):
+class GithubCache:
+    """
+    SQLite store of the GitHub responses along with their ETag, so that unchanged pages are revalidated with a
+    conditional request (a 304 does not count against the rate limit), and of the issues fetched by every search
+    query, so that a later run only fetches the issues updated since the previous one.
+    """
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, link TEXT, body TEXT);
+            CREATE TABLE IF NOT EXISTS issues (query TEXT, number INTEGER, updated_at TEXT, data TEXT, PRIMARY KEY (query, number));
+            CREATE TABLE IF NOT EXISTS runs (query TEXT PRIMARY KEY, fetched_at TEXT);
+        """)
+
+    def get_response(self, url):
+        return self.db.execute("SELECT etag, last_modified, link, body FROM responses WHERE url = ?", (url,)).fetchone()
+
+    def put_response(self, url, etag, last_modified, link, body):
+        self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (url, etag, last_modified, link, body))
+        self.db.commit()
+
+    def get_issues(self, query):
+        rows = self.db.execute("SELECT data FROM issues WHERE query = ?", (query,)).fetchall()
+        return {issue["number"]: issue for issue in (json.loads(row[0]) for row in rows)}
+
+    def put_issues(self, query, issues):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?)",
+            [(query, issue["number"], issue["updated_at"], json.dumps(issue)) for issue in issues],
+        )
+        self.db.commit()
+
+    def last_run(self, query):
+        row = self.db.execute("SELECT fetched_at FROM runs WHERE query = ?", (query,)).fetchone()
+        return row[0] if row else None
+
+    def set_last_run(self, query, fetched_at):
+        self.db.execute("INSERT OR REPLACE INTO runs VALUES (?, ?)", (query, fetched_at))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def next_page_url(link):
+    link_header = [h.split(';') for h in link.split(', ')] if link else []
+    link_header = [x for x in link_header if len(x) > 1 and "next" in x[1]]
+    if link_header:
+        return link_header[0][0].strip().replace('<', '').replace('>','')
+    return None
+
+
+async def fetch_github_endpoint_async(session, url, cache=None, max_retries=3):
+    """
+    Returns the decoded JSON and the Link header of url. A cached response is revalidated with its ETag, and
+    the request is retried after the wait asked by GitHub when the rate limit is hit.
+    """
+    cached = cache.get_response(url) if cache is not None else None
+    headers = {}
+    if cached:
+        if cached[0]:
+            headers["If-None-Match"] = cached[0]
+        if cached[1]:
+            headers["If-Modified-Since"] = cached[1]
+
+    for attempt in range(max_retries + 1):
+        logger.debug(f"Requesting url: {url}")
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and cached:
+                return json.loads(cached[3]), cached[2]
+            if response.status == 200:
+                body = await response.text()
+                link = response.headers.get("Link", "")
+                if cache is not None:
+                    cache.put_response(url, response.headers.get("ETag"), response.headers.get("Last-Modified"), link, body)
+                return json.loads(body), link
+            rate_limited = response.status in (403, 429) and (
+                "Retry-After" in response.headers or response.headers.get("X-RateLimit-Remaining") == "0"
+            )
+            if rate_limited and attempt < max_retries:
+                if "Retry-After" in response.headers:
+                    wait = float(response.headers["Retry-After"])
+                else:
+                    wait = float(response.headers.get("X-RateLimit-Reset", time.time())) - time.time()
+                wait = min(max(wait, 1), 60)
+                logger.info(f"GitHub rate limit hit, retrying {url} in {wait:.0f}s")
+                await asyncio.sleep(wait)
+                continue
+            raise Exception(f"Fetching issues failed with Error: {response.status} on url {url}")
+
+
+async def fetch_issue_comments(session, issue, cache, semaphore):
+    url = issue['comments_url'] + "?per_page=100"
+    comments = []
+    async with semaphore:
+        while url:
+            page, link = await fetch_github_endpoint_async(session, url, cache)
+            comments += page
+            url = next_page_url(link)
+    return comments
+
+
+async def afetch_repo_issues(
+    repo,
+    start_date=None,
+    end_date=None,
+    cache_path=None,
+    max_concurrency=16,
+    incremental=True,
+    api_url=GITHUB_API,
+):
+    """
+    Async version of fetch_repo_issues. The search pages and the comments of the issues are fetched concurrently
+    over one pooled session, at most max_concurrency requests at a time. With a cache_path, responses are cached
+    in SQLite and, when incremental is set, only the issues updated since the last run of the same query are fetched.
+    """
     time_filter = ""
     if start_date and not end_date:
         time_filter = f"+created:>{start_date}"
@@ -27,41 +159,56 @@ def fetch_repo_issues(repo, start_date=None, end_date=None):
         time_filter = f"+created:<{end_date}"
     if start_date and end_date:
         time_filter = f"+created:{start_date}..{end_date}"
-    
-    url = f"https://api.github.com/search/issues?per_page=100&sort=created&order=asc&q=repo:{repo}+is:issue{time_filter}"
-
-    samples = []
-
-    while True:
-        response = fetch_github_endpoint(url)
-        
-        if response.status_code == 200:
-            issues = response.json()['items']
-            for issue in issues:
-                if issue['body'] is None:
-                    continue
-                
-                issue['discussion'] = issue['title'] + "\n" + issue['body']
-                if issue['comments'] > 0:
-                    comments_response = fetch_github_endpoint(issue['comments_url']).json()
-                    comments = "\n> ".join([x['body'] for x in comments_response])
-                    issue['discussion'] += "\n> " + comments
-                    
-                samples.append(issue)
-        
-            # Check if there are more pages
-            if "Link" in response.headers:
-                link_header = [h.split(';') for h in response.headers["Link"].split(', ')]
-                link_header = [x for x in link_header if "next" in x[1]]
-                if link_header:
-                    url = link_header[0][0].strip().replace('<', '').replace('>','')
-                else:
-                    break
-            else:
-                break
-        else:
-            raise Exception(f"Fetching issues failed with Error: {response.status_code} on url {url}")
-        
+    query = f"repo:{repo}+is:issue{time_filter}"
+
+    cache = GithubCache(cache_path) if cache_path else None
+    stored = cache.get_issues(query) if cache is not None else {}
+    since = cache.last_run(query) if cache is not None and incremental else None
+    run_started = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    search_query = query + (f"+updated:>={since}" if since else "")
+    url = f"{api_url}/search/issues?per_page=100&sort=created&order=asc&q={search_query}"
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+    try:
+        async with aiohttp.ClientSession(headers=github_headers(), connector=connector, timeout=timeout) as session:
+            first_page, link = await fetch_github_endpoint_async(session, url, cache)
+            issues = first_page['items']
+            # The search API returns at most 1000 results, the remaining pages are known up front and fetched together
+            num_pages = min(-(-first_page.get('total_count', 0) // 100), 10)
+            if num_pages > 1 and next_page_url(link):
+                async def fetch_page(page):
+                    async with semaphore:
+                        return await fetch_github_endpoint_async(session, f"{url}&page={page}", cache)
+                for page, _ in await asyncio.gather(*[fetch_page(page) for page in range(2, num_pages + 1)]):
+                    issues += page['items']
+
+            # The discussion of an issue which was not updated since it was stored is reused as is
+            issues = [
+                issue for issue in issues
+                if issue['body'] is not None and stored.get(issue['number'], {}).get('updated_at') != issue['updated_at']
+            ]
+            with_comments = [issue for issue in issues if issue['comments'] > 0]
+            all_comments = await asyncio.gather(
+                *[fetch_issue_comments(session, issue, cache, semaphore) for issue in with_comments]
+            )
+
+        for issue in issues:
+            issue['discussion'] = issue['title'] + "\n" + issue['body']
+        for issue, comments in zip(with_comments, all_comments):
+            issue['discussion'] += "\n> " + "\n> ".join([x['body'] or "" for x in comments])
+
+        if cache is not None:
+            cache.put_issues(query, issues)
+            cache.set_last_run(query, run_started)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    samples = {**stored, **{issue['number']: issue for issue in issues}}
+    samples = sorted(samples.values(), key=lambda d: (d['created_at'], d['number']))
+
     rows = [{
         "repo_name": repo,
         "number": d['number'],
@@ -72,11 +219,28 @@ def fetch_repo_issues(repo, start_date=None, end_date=None):
         "discussion": d['discussion'],
     } for d in samples]
     
-    logger.info(f"Fetched {len(samples)} issues on {repo} from {start_date} to {end_date}")
+    logger.info(f"Fetched {len(issues)} new or updated issues, {len(samples)} issues on {repo} from {start_date} to {end_date}")
     
     return pd.DataFrame(rows)
 
 
+def fetch_repo_issues(repo, start_date=None, end_date=None, **kwargs):
+    """
+    Fetches the issues of repo created between start_date and end_date, see afetch_repo_issues for the kwargs.
+    The cache path and the number of concurrent requests default to github_cache and github_max_concurrency in config.yaml.
+    """
+    kwargs.setdefault("cache_path", CFG.get("github_cache"))
+    kwargs.setdefault("max_concurrency", CFG.get("github_max_concurrency", 16))
+    coroutine = afetch_repo_issues(repo, start_date, end_date, **kwargs)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    # An event loop is already running (e.g. in a notebook), run the fetch in its own loop on another thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
 def fetch_repo_stats(repo):
     repo_info = fetch_github_endpoint(f"https://api.github.com/repos/{repo}").json()
     
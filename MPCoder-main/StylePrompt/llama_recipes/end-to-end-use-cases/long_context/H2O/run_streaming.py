@@ -10,7 +10,7 @@ from utils.streaming import load, download_url, load_jsonl, greedy_generate
 
 from transformers import AutoModelForCausalLM, AutoTokenizer, AutoConfig
 from utils.llama import H2OLlamaForCausalLM
-from utils.cache import Cache, HHCache, StaticCache
+from utils.cache import Cache, HHCache, RingHHCache, StaticCache
 
 
 @torch.no_grad()
@@ -28,9 +28,12 @@ def streaming_inference_h2o(model, tokenizer, config, prompts, max_gen_len=1000,
         )
         if enable_h2o_generation:
             space_needed = seq_len + max_gen_len
-            past_key_values = HHCache.from_legacy_cache(config.num_window_length, config.num_heavy_hitter_tokens, past_key_values)
-            past_key_values.evict_for_space(space_needed)
-            past_key_values = past_key_values.to_legacy_cache()
+            if isinstance(past_key_values, RingHHCache):
+                past_key_values.evict_for_space(space_needed)
+            else:
+                past_key_values = HHCache.from_legacy_cache(config.num_window_length, config.num_heavy_hitter_tokens, past_key_values)
+                past_key_values.evict_for_space(space_needed)
+                past_key_values = past_key_values.to_legacy_cache()
 
 
 def main():
@@ -44,6 +47,8 @@ def main():
     parser.add_argument("--num_window_length", type=int, default=256)
 
     parser.add_argument("--enable_position_rolling", action='store_true')
+    parser.add_argument("--use_legacy_cache", action='store_true', help="use the concatenating HHCache instead of the preallocated ring buffer cache")
+    parser.add_argument("--kv_quant_bits", type=int, default=None, choices=[4, 8], help="store the KV cache as 8 or 4 bits integers")
 
     parser.add_argument("--seed", type=int, default=42, help="random seed for initialization")
 
@@ -52,6 +57,9 @@ def main():
     model_name = args.model_name
     data_root = args.input_path
 
+    if args.kv_quant_bits is not None and args.enable_h2o_generation and args.use_legacy_cache:
+        raise ValueError("The legacy HHCache does not support KV quantization, remove --use_legacy_cache or --kv_quant_bits")
+
     config = AutoConfig.from_pretrained(model_name)
     tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
 
@@ -59,6 +67,8 @@ def main():
         config.num_heavy_hitter_tokens = args.num_heavy_hitter_tokens
         config.num_window_length = args.num_window_length
         config.enable_position_rolling = args.enable_position_rolling
+        config.enable_ring_buffer_cache = not args.use_legacy_cache
+        config.kv_quant_bits = args.kv_quant_bits
         model = H2OLlamaForCausalLM.from_pretrained(model_name,
             torch_dtype=torch.float16,
             device_map='auto',
@@ -3,6 +3,7 @@ import tqdm
 import json
 import copy
 import math
+import time
 
 import torch
 import logging
@@ -22,6 +23,24 @@ def set_seed(args):
     torch.manual_seed(args.seed)
     torch.cuda.manual_seed_all(args.seed)
 
+def get_batches(requests, tokenizer, batch_size):
+    """
+    Groups the requests which share their generation parameters into batches of up to batch_size,
+    requests of similar length are batched together to limit the padding.
+    """
+    keys = [
+        ((r['temperature'], r['top_p'], r['max_tokens'], r['n']), len(tokenizer(r['article'], add_special_tokens=False).input_ids))
+        for r in requests
+    ]
+
+    batches = []
+    for idx in sorted(range(len(requests)), key=lambda idx: keys[idx]):
+        if batches and len(batches[-1]) < batch_size and keys[batches[-1][0]][0] == keys[idx][0]:
+            batches[-1].append(idx)
+        else:
+            batches.append([idx])
+    return batches
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
@@ -36,8 +55,11 @@ if __name__ == '__main__':
     parser.add_argument("--num_window_length", type=int, default=256)
 
     parser.add_argument("--enable_position_rolling", action='store_true')
+    parser.add_argument("--use_legacy_cache", action='store_true', help="use the concatenating HHCache instead of the preallocated ring buffer cache")
+    parser.add_argument("--kv_quant_bits", type=int, default=None, choices=[4, 8], help="store the KV cache as 8 or 4 bits integers")
 
     parser.add_argument("--sample_num", type=int, default=500)
+    parser.add_argument("--batch_size", type=int, default=1, help="number of requests generated together")
     parser.add_argument("--seed", type=int, default=42, help="random seed for initialization")
 
     args = parser.parse_args()
@@ -49,8 +71,17 @@ if __name__ == '__main__':
     output_path = args.output_path
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
+    if args.batch_size > 1 and args.enable_h2o_generation and args.use_legacy_cache:
+        raise ValueError("The legacy HHCache does not support padded batches, remove --use_legacy_cache or use --batch_size 1")
+    if args.kv_quant_bits is not None and args.enable_h2o_generation and args.use_legacy_cache:
+        raise ValueError("The legacy HHCache does not support KV quantization, remove --use_legacy_cache or --kv_quant_bits")
+
     config = AutoConfig.from_pretrained(model_name)
     tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+    # Prompts of a batch are left padded so that the generated tokens are aligned
+    tokenizer.padding_side = 'left'
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
     if args.num_heavy_hitter_tokens == -1:
         print('not assign number of heavy hitter tokens, use half of the cache size: {}'.format(args.num_window_length // 2))
         args.num_heavy_hitter_tokens = args.num_window_length // 2
@@ -59,6 +90,8 @@ if __name__ == '__main__':
         config.num_heavy_hitter_tokens = args.num_heavy_hitter_tokens
         config.num_window_length = args.num_window_length
         config.enable_position_rolling = args.enable_position_rolling
+        config.enable_ring_buffer_cache = not args.use_legacy_cache
+        config.kv_quant_bits = args.kv_quant_bits
         model = H2OLlamaForCausalLM.from_pretrained(model_name,
             torch_dtype=torch.float16,
             device_map='auto',
@@ -81,66 +114,85 @@ if __name__ == '__main__':
         print('Sample {} Examples from {} samples'.format(args.sample_num, len(requests)))
     requests = requests[:args.sample_num]
 
-    results = []
+    results = [None] * len(requests)
     rouge = Rouge()
     rouge1_score_list = []
     rouge2_score_list = []
     rougel_score_list = []
 
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
     with torch.no_grad():
-        for request in tqdm.tqdm(requests):
-            result = {'request': request, 'result': {}}
-            prompt = request['article']
-            label = request['summary_gt']
+        for batch in tqdm.tqdm(get_batches(requests, tokenizer, args.batch_size)):
+            batch_requests = [requests[idx] for idx in batch]
+            request = batch_requests[0]
             temperature = request['temperature']
-            stop = request['stop']
+            num_return_sequences = request['n']
 
-            input_ids = tokenizer(prompt, add_special_tokens=False, return_tensors='pt').input_ids.to(model.device)
+            inputs = tokenizer([r['article'] for r in batch_requests], add_special_tokens=False, padding=True, return_tensors='pt').to(model.device)
+            input_length = inputs.input_ids.shape[1]
 
+            start = time.perf_counter()
             output_sequences = model.generate(
-                input_ids=input_ids,
-                max_length=request['max_tokens'] + len(input_ids[0]),
+                **inputs,
+                max_new_tokens=request['max_tokens'],
                 temperature=temperature,
                 top_p=request['top_p'],
                 do_sample=True,
-                num_return_sequences=request['n'],
+                num_return_sequences=num_return_sequences,
                 return_dict_in_generate=True, output_scores=True,
-                pad_token_id=tokenizer.eos_token_id
+                pad_token_id=tokenizer.pad_token_id
             )
-
-            tokens = tokenizer.convert_ids_to_tokens(output_sequences['sequences'].squeeze(0))[len(input_ids[0]):]
-            logprobs = [logits.log_softmax(dim=-1).max().item() for logits in output_sequences['scores']]
-            top_logprobs = [{i: v for i, v in zip(tokens, logprobs)}]
-
-            generate_text = tokenizer.decode(output_sequences['sequences'].squeeze(0)[len(input_ids[0]):])
-            generate_text = generate_text[: generate_text.find(stop[0])]
-
-            scores = rouge.get_scores(generate_text, label)[0]
-            rouge1_score_list.append(scores['rouge-1']['f'])
-            rouge2_score_list.append(scores['rouge-2']['f'])
-            rougel_score_list.append(scores['rouge-l']['f'])
-
-            result['result'] = {
-                "choices": [
-                    {
-                        "text": generate_text,
-                        "logprobs": {
-                            "tokens": tokens, 
-                            "token_logprobs": logprobs, 
-                            "top_logprobs": top_logprobs, 
-                            "text_offset": []
-                        }, 
-                        "finish_reason": "length"
-                    }
-                ], 
-                "request_time": {
-                    "batch_time": 0, 
-                    "batch_size": 1}
-            }
-            
-            results.append(result)
+            batch_time = time.perf_counter() - start
+
+            # Only the first returned sequence of every request is scored, as with a batch size of 1
+            for row, (idx, request) in enumerate(zip(batch, batch_requests)):
+                result = {'request': request, 'result': {}}
+                label = request['summary_gt']
+                stop = request['stop']
+
+                sequence_row = row * num_return_sequences
+                generated_ids = output_sequences['sequences'][sequence_row, input_length:].tolist()
+                # Sequences that finished before the others are padded, cut them after their eos
+                if tokenizer.eos_token_id in generated_ids:
+                    generated_ids = generated_ids[: generated_ids.index(tokenizer.eos_token_id) + 1]
+
+                tokens = tokenizer.convert_ids_to_tokens(generated_ids)
+                logprobs = [logits[sequence_row].log_softmax(dim=-1).max().item() for logits in output_sequences['scores'][:len(generated_ids)]]
+                top_logprobs = [{i: v for i, v in zip(tokens, logprobs)}]
+
+                generate_text = tokenizer.decode(generated_ids)
+                generate_text = generate_text[: generate_text.find(stop[0])]
+
+                scores = rouge.get_scores(generate_text, label)[0]
+                rouge1_score_list.append(scores['rouge-1']['f'])
+                rouge2_score_list.append(scores['rouge-2']['f'])
+                rougel_score_list.append(scores['rouge-l']['f'])
+
+                result['result'] = {
+                    "choices": [
+                        {
+                            "text": generate_text,
+                            "logprobs": {
+                                "tokens": tokens, 
+                                "token_logprobs": logprobs, 
+                                "top_logprobs": top_logprobs, 
+                                "text_offset": []
+                            }, 
+                            "finish_reason": "length"
+                        }
+                    ], 
+                    "request_time": {
+                        "batch_time": batch_time, 
+                        "batch_size": len(batch)}
+                }
+
+                results[idx] = result
 
     print('Average Rouge1: {:.6f}, Rouge-2: {:.6f}, Rouge-l: {:.6f}'.format(np.mean(rouge1_score_list), np.mean(rouge2_score_list), np.mean(rougel_score_list)))
+    if torch.cuda.is_available():
+        print('Peak GPU memory: {:.2f} GiB'.format(torch.cuda.max_memory_allocated() / 1024 ** 3))
     with open(output_path, 'w') as f:
         for result in results:
             f.write(json.dumps(result) + '\n')
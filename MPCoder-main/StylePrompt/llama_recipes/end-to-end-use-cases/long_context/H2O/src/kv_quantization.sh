@@ -0,0 +1,19 @@
+model=${1:-meta-llama/Meta-Llama-3-8B}
+output_dir=summarization_output/kv_quantization
+for window in 128 256 512 1024; do
+    for bits in 16 8 4; do
+        if [[ ${bits} == 16 ]]; then
+            quant_args=""
+        else
+            quant_args="--kv_quant_bits ${bits}"
+        fi
+        echo "window ${window}, ${bits} bits KV cache"
+        python -u run_summarization.py \
+            --input-path data/summarization/xsum.jsonl \
+            --output-path ${output_dir}/xsum_h2o_${window}_${bits}bits.jsonl \
+            --model-name ${model} \
+            --enable_h2o_generation \
+            --num_window_length ${window} \
+            ${quant_args}
+    done
+done
@@ -8,6 +8,34 @@ from transformers.utils import logging
 
 logger = logging.get_logger(__name__)
 
+
+def quantize_kv(states: torch.Tensor, bits: int = 8) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Quantizes key or value states `[batch_size, num_heads, seq_len, head_dim]` to symmetric integers with one scale per
+    head and token. 8 bits are stored as int8, 4 bits are packed two per uint8 along `head_dim`.
+
+    Return:
+        The quantized states and their scales `[batch_size, num_heads, seq_len, 1]` in the dtype of `states`.
+    """
+    if bits not in (4, 8):
+        raise ValueError(f"Only 4 and 8 bits KV quantization are supported, got {bits}")
+    qmax = 2 ** (bits - 1) - 1
+    scale = (states.abs().amax(dim=-1, keepdim=True).float() / qmax).clamp(min=torch.finfo(states.dtype).tiny).to(states.dtype)
+    quantized = (states.float() / scale.float()).round().clamp(-qmax, qmax).to(torch.int8)
+    if bits == 4:
+        quantized = (quantized + 8).to(torch.uint8)
+        quantized = quantized[..., 0::2] | (quantized[..., 1::2] << 4)
+    return quantized, scale
+
+
+def dequantize_kv(quantized: torch.Tensor, scale: torch.Tensor) -> torch.Tensor:
+    """Inverse of `quantize_kv`, the number of bits is told by the storage dtype."""
+    if quantized.dtype == torch.uint8:
+        low = (quantized & 0xF).to(torch.int8) - 8
+        high = (quantized >> 4).to(torch.int8) - 8
+        quantized = torch.stack([low, high], dim=-1).flatten(-2)
+    return quantized.to(scale.dtype) * scale
+
 @dataclass
 class Cache:
     """
@@ -196,11 +224,16 @@ class SinkCache(Cache):
             The length of the context window.
         num_sink_tokens (`int`):
             The number of sink tokens. See the original paper for more information.
+        kv_quant_bits (`int`, `optional`):
+            Stores the keys and values as 8 or 4 bits integers with a scale per head and token, see `quantize_kv`.
     """
 
-    def __init__(self, window_length: int, num_sink_tokens: int) -> None:
+    def __init__(self, window_length: int, num_sink_tokens: int, kv_quant_bits: Optional[int] = None) -> None:
         self.key_cache: List[torch.Tensor] = []
         self.value_cache: List[torch.Tensor] = []
+        self.key_scales: List[torch.Tensor] = []
+        self.value_scales: List[torch.Tensor] = []
+        self.kv_quant_bits = kv_quant_bits
         self.window_length = window_length
         self.num_sink_tokens = num_sink_tokens
         self.cos_sin_cache = {}
@@ -287,6 +320,11 @@ class SinkCache(Cache):
         if layer_idx == 0:
             self._seen_tokens += key_states.shape[-2]
 
+        if self.kv_quant_bits is not None and len(self.key_cache) > layer_idx:
+            # The layer is shifted in full precision and quantized again, only one layer is dequantized at a time
+            self.key_cache[layer_idx] = dequantize_kv(self.key_cache[layer_idx], self.key_scales[layer_idx])
+            self.value_cache[layer_idx] = dequantize_kv(self.value_cache[layer_idx], self.value_scales[layer_idx])
+
         # [bsz, num_heads, seq_len, head_dim]
         if len(self.key_cache) <= layer_idx:
             # Empty cache
@@ -328,6 +366,17 @@ class SinkCache(Cache):
             ]
             self.value_cache[layer_idx] = torch.cat([sink_values, values_to_keep, value_states], dim=-2)
 
+        if self.kv_quant_bits is not None:
+            key_states, value_states = self.key_cache[layer_idx], self.value_cache[layer_idx]
+            self.key_cache[layer_idx], key_scale = quantize_kv(key_states, self.kv_quant_bits)
+            self.value_cache[layer_idx], value_scale = quantize_kv(value_states, self.kv_quant_bits)
+            if len(self.key_scales) <= layer_idx:
+                self.key_scales.append(key_scale)
+                self.value_scales.append(value_scale)
+            else:
+                self.key_scales[layer_idx], self.value_scales[layer_idx] = key_scale, value_scale
+            return key_states, value_states
+
         return self.key_cache[layer_idx], self.value_cache[layer_idx]
 
     def reorder_cache(self, beam_idx: torch.LongTensor):
@@ -337,6 +386,9 @@ class SinkCache(Cache):
             self.key_cache[layer_idx] = self.key_cache[layer_idx].index_select(0, beam_idx.to(device))
             device = self.value_cache[layer_idx].device
             self.value_cache[layer_idx] = self.value_cache[layer_idx].index_select(0, beam_idx.to(device))
+        for scales in (self.key_scales, self.value_scales):
+            for layer_idx in range(len(scales)):
+                scales[layer_idx] = scales[layer_idx].index_select(0, beam_idx.to(scales[layer_idx].device))
 
 
 class HHCache(Cache):
@@ -547,6 +599,308 @@ class HHCache(Cache):
                 self.accumulated_attention_scores[layer_idx] = self.accumulated_attention_scores[layer_idx][mask].view(bsz, num_heads, -1)
 
 
+# Accumulated attention score of the padding tokens in RingHHCache, lower than any score and still finite
+PADDING_SCORE = torch.finfo(torch.float32).min
+
+
+class RingHHCache(Cache):
+    """
+    A heavy-hitter oracle cache like `HHCache`, backed by preallocated buffers of `window_length + 1` tokens per layer.
+
+    Decoding never reallocates the cache: the new token is written into the first free slot, and the evicted token is
+    replaced in place by the token of the last slot. The tokens are therefore not kept in their original order, the
+    position of every token is tracked in `token_positions` (see `get_key_position_ids` for position rolling). The
+    buffers only grow when more tokens than fit are added at once (e.g. the prompt), and shrink back on the next eviction.
+
+    Every sequence of the batch is evicted independently. For batches of left-padded prompts, the padding tokens are
+    given the lowest possible score so they are evicted first, and `get_attention_mask` masks the ones still cached.
+
+    It stores the Key and Value states as a list of tensors, one for each layer. The expected shape for each tensor is
+    `[batch_size, num_heads, capacity, head_dim]`, only the first `get_seq_length(layer_idx)` slots are valid.
+
+    Parameters:
+        window_length (`int`):
+            The length of the context window.
+        num_hh_tokens (`int`):
+            The number of heavy hitter tokens. See the original paper for more information.
+        padding_mask (`torch.BoolTensor`, `optional`):
+            `[batch_size, prompt_length]`, True for the padding tokens of the prompt.
+        kv_quant_bits (`int`, `optional`):
+            Stores the keys and values as 8 or 4 bits integers with a scale per head and token, see `quantize_kv`.
+            They are dequantized when read, the prompt is attended in full precision.
+    """
+
+    def __init__(
+        self,
+        window_length: int,
+        num_hh_tokens: int,
+        padding_mask: Optional[torch.Tensor] = None,
+        kv_quant_bits: Optional[int] = None,
+    ) -> None:
+        self.key_cache: List[torch.Tensor] = []
+        self.value_cache: List[torch.Tensor] = []
+        self.key_scales: List[torch.Tensor] = []
+        self.value_scales: List[torch.Tensor] = []
+        self.kv_quant_bits = kv_quant_bits
+        self.accumulated_attention_scores: List[torch.Tensor] = []
+        self.token_positions: List[torch.Tensor] = []  # [bs, num_heads, capacity], index of each token in the sequence
+        self.seq_lengths: List[int] = []
+        self.window_length = window_length
+        self.num_hh_tokens = num_hh_tokens
+        self.capacity = window_length + 1
+        self._layer_seen_tokens: List[int] = []
+        self._scores_buffer: List[torch.Tensor] = []
+        self._mask_buffer: List[torch.Tensor] = []
+        self.padding_mask = padding_mask if padding_mask is not None and bool(padding_mask.any()) else None
+        self._seen_tokens = 0  # Used in `generate` to keep tally of how many tokens the cache has seen
+
+    def __len__(self):
+        """
+        Support for backwards-compatible `past_key_value` length, e.g. `len(past_key_value)`. This value corresponds
+        to the number of layers in the model.
+        """
+        return len(self.key_cache)
+
+    def get_seq_length(self, layer_idx: Optional[int] = 0) -> int:
+        """Returns the sequence length of the cached states. A layer index can be optionally passed."""
+        if len(self.seq_lengths) <= layer_idx:
+            return 0
+        return self.seq_lengths[layer_idx]
+
+    def get_max_length(self) -> Optional[int]:
+        """Returns the maximum sequence length of the cached states. Like the legacy cache, the attention mask is not cropped."""
+        return None
+
+    def _buffers(self) -> Tuple[List[torch.Tensor], ...]:
+        """All per-token buffers, which are evicted and reordered together."""
+        buffers = (self.key_cache, self.value_cache, self.accumulated_attention_scores, self.token_positions)
+        if self.kv_quant_bits is not None:
+            buffers += (self.key_scales, self.value_scales)
+        return buffers
+
+    def _read(self, layer_idx: int, length: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        key_states = self.key_cache[layer_idx][:, :, :length]
+        value_states = self.value_cache[layer_idx][:, :, :length]
+        if self.kv_quant_bits is not None:
+            key_states = dequantize_kv(key_states, self.key_scales[layer_idx][:, :, :length])
+            value_states = dequantize_kv(value_states, self.value_scales[layer_idx][:, :, :length])
+        return key_states, value_states
+
+    def _allocate(self, layer_idx: int, capacity: int) -> None:
+        """(Re)allocates the buffers of a layer with room for `capacity` tokens, keeping the valid ones."""
+        key_cache = self.key_cache[layer_idx]
+        bsz, num_heads = key_cache.shape[:2]
+        length = self.seq_lengths[layer_idx]
+        for buffer in self._buffers():
+            old = buffer[layer_idx]
+            new = old.new_zeros((bsz, num_heads, capacity) + old.shape[3:])
+            new[:, :, :length] = old[:, :, :length]
+            buffer[layer_idx] = new
+        self._scores_buffer[layer_idx] = self.accumulated_attention_scores[layer_idx].new_empty((bsz, num_heads, capacity))
+        self._mask_buffer[layer_idx] = torch.empty((bsz, num_heads, capacity), dtype=torch.bool, device=key_cache.device)
+
+    def update(
+        self,
+        key_states: torch.Tensor,
+        value_states: torch.Tensor,
+        layer_idx: int,
+        cache_kwargs: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Updates the cache with the new `key_states` and `value_states` for the layer `layer_idx`.
+
+        Parameters:
+            key_states (`torch.Tensor`):
+                The new key states to cache.
+            value_states (`torch.Tensor`):
+                The new value states to cache.
+            layer_idx (`int`):
+                The index of the layer to cache the states for.
+            cache_kwargs (`Dict[str, Any]`, `optional`):
+                Additional arguments for the cache subclass. No additional arguments are used in `RingHHCache`.
+
+        Return:
+            A tuple containing the updated key and value states, views of the valid slots of the buffers.
+        """
+        num_new_tokens = key_states.shape[-2]
+        if layer_idx == 0:
+            self._seen_tokens += num_new_tokens
+
+        if len(self.key_cache) <= layer_idx:
+            # The prompt is used as it is, the buffers are allocated when it is evicted down to the window
+            bsz, num_heads = key_states.shape[:2]
+            positions = torch.arange(num_new_tokens, device=key_states.device).repeat(bsz, num_heads, 1)
+            scores = torch.zeros((bsz, num_heads, num_new_tokens), dtype=torch.float32, device=key_states.device)
+            if self.padding_mask is not None:
+                # Padding tokens come before every other token and lose every heavy hitter competition
+                padding_mask = self.padding_mask[:, None, :].to(key_states.device)
+                positions = positions - padding_mask * num_new_tokens
+                scores.masked_fill_(padding_mask, PADDING_SCORE)
+            if self.kv_quant_bits is not None:
+                for cache, scales, states in ((self.key_cache, self.key_scales, key_states), (self.value_cache, self.value_scales, value_states)):
+                    quantized, scale = quantize_kv(states, self.kv_quant_bits)
+                    cache.append(quantized)
+                    scales.append(scale)
+            else:
+                self.key_cache.append(key_states)
+                self.value_cache.append(value_states)
+            self.accumulated_attention_scores.append(scores)
+            self.token_positions.append(positions)
+            self.seq_lengths.append(num_new_tokens)
+            self._layer_seen_tokens.append(num_new_tokens)
+            self._scores_buffer.append(None)
+            self._mask_buffer.append(None)
+            return key_states, value_states
+
+        start = self.seq_lengths[layer_idx]
+        end = start + num_new_tokens
+        if end > self.key_cache[layer_idx].shape[2]:
+            self._allocate(layer_idx, max(end, self.capacity))
+
+        seen = self._layer_seen_tokens[layer_idx]
+        if self.kv_quant_bits is not None:
+            self.key_cache[layer_idx][:, :, start:end], self.key_scales[layer_idx][:, :, start:end] = quantize_kv(key_states, self.kv_quant_bits)
+            self.value_cache[layer_idx][:, :, start:end], self.value_scales[layer_idx][:, :, start:end] = quantize_kv(value_states, self.kv_quant_bits)
+        else:
+            self.key_cache[layer_idx][:, :, start:end] = key_states
+            self.value_cache[layer_idx][:, :, start:end] = value_states
+        self.accumulated_attention_scores[layer_idx][:, :, start:end] = 0
+        if num_new_tokens == 1:
+            self.token_positions[layer_idx][:, :, start].fill_(seen)
+        else:
+            self.token_positions[layer_idx][:, :, start:end] = torch.arange(seen, seen + num_new_tokens, device=key_states.device)
+        self.seq_lengths[layer_idx] = end
+        self._layer_seen_tokens[layer_idx] = seen + num_new_tokens
+
+        return self._read(layer_idx, end)
+
+    def _evict(self, layer_idx: int, num_keep: int) -> None:
+        """Keeps the `num_hh_tokens` heavy hitters and the most recent tokens, `num_keep` tokens in total."""
+        length = self.seq_lengths[layer_idx]
+        if length <= num_keep:
+            return
+        num_local_tokens = num_keep - self.num_hh_tokens
+        positions = self.token_positions[layer_idx][:, :, :length]
+        scores = self.accumulated_attention_scores[layer_idx][:, :, :length]
+        # The num_local_tokens most recent tokens are kept, all older ones compete for the heavy hitter slots
+        if num_local_tokens > 0:
+            threshold = positions.kthvalue(length - num_local_tokens + 1, dim=-1, keepdim=True).values
+        else:
+            threshold = self._layer_seen_tokens[layer_idx]
+
+        if length == num_keep + 1 and self._scores_buffer[layer_idx] is not None:
+            # Decoding: a single token goes, the last token moves into its slot
+            is_local = torch.ge(positions, threshold, out=self._mask_buffer[layer_idx][:, :, :length])
+            candidate_scores = self._scores_buffer[layer_idx][:, :, :length]
+            candidate_scores.copy_(scores).masked_fill_(is_local, float("inf"))
+            evict_index = candidate_scores.argmin(dim=-1, keepdim=True)  # [bs, num_heads, 1]
+            for buffer in self._buffers():
+                last = buffer[layer_idx][:, :, length - 1 : length].clone()
+                index = evict_index.view(evict_index.shape + (1,) * (last.dim() - 3)).expand_as(last)
+                buffer[layer_idx].scatter_(2, index, last)
+            self.seq_lengths[layer_idx] = length - 1
+            return
+
+        is_local = positions >= threshold
+        _, keep_hh_index = torch.topk(scores.masked_fill(is_local, float("-inf")), self.num_hh_tokens, dim=-1)
+        _, keep_local_index = torch.topk(positions, num_local_tokens, dim=-1)
+        keep_index = torch.cat([keep_hh_index, keep_local_index], dim=-1).sort().values
+
+        kept = []
+        for buffer in self._buffers():
+            values = buffer[layer_idx][:, :, :length]
+            index = keep_index.view(keep_index.shape + (1,) * (values.dim() - 3)).expand(keep_index.shape + values.shape[3:])
+            kept.append(values.gather(2, index))
+        self.seq_lengths[layer_idx] = num_keep
+        if self.key_cache[layer_idx].shape[2] != self.capacity:
+            # Shrink the buffers back to the window, e.g. after the prompt
+            self._allocate(layer_idx, self.capacity)
+        for buffer, values in zip(self._buffers(), kept):
+            buffer[layer_idx][:, :, :num_keep] = values
+
+    def update_slimming(
+        self,
+        attention_scores: torch.Tensor,
+        num_kv_groups: int,
+        layer_idx: int,
+        cache_kwargs: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Slimming the cache based on accumulated attention scores, only keep heavy-hitters + local tokens.
+
+        Parameters:
+            attention_scores (`torch.Tensor`):
+                Attention_scores for current steps.
+            num_kv_groups (`int`):
+                The number of kv groups in repeat kv.
+            layer_idx (`int`):
+                The index of the layer to cache the states for.
+            cache_kwargs (`Dict[str, Any]`, `optional`):
+                Additional arguments for the cache subclass. No additional arguments are used in `RingHHCache`.
+        """
+        length = self.seq_lengths[layer_idx]
+        self.accumulated_attention_scores[layer_idx][:, :, :length] += attention_scores.sum(2)[:, ::num_kv_groups, :]
+        if length > self.window_length:
+            self._evict(layer_idx, self.window_length)
+
+    def evict_for_space(self, space_needed: int):
+        for layer_idx in range(len(self)):
+            # Update KV Cache, Evict for new coming prompts
+            if self.get_seq_length(layer_idx) + space_needed > self.window_length:
+                if self.window_length - self.num_hh_tokens <= space_needed:
+                    raise ValueError("The space_needed should be less than the window_length - num_hh_tokens.")
+                self._evict(layer_idx, self.window_length - space_needed)
+
+    def get_key_position_ids(self, layer_idx: int) -> torch.LongTensor:
+        """
+        Returns the rank of every cached token in the sequence, `[batch_size, num_heads, seq_len]`. These are the
+        positions of the tokens of an ordered cache, which position rolling assigns to the keys.
+        """
+        positions = self.token_positions[layer_idx][:, :, : self.seq_lengths[layer_idx]]
+        ranks = positions.argsort(dim=-1).argsort(dim=-1)
+        if self.padding_mask is not None:
+            # The padding tokens rank first, the first token of every sequence gets position 0
+            ranks = ranks - (positions < 0).sum(dim=-1, keepdim=True)
+        return ranks
+
+    def get_attention_mask(self, layer_idx: int, num_queries: int, num_kv_groups: int, dtype: torch.dtype) -> torch.Tensor:
+        """
+        Returns the additive attention mask of the cached tokens, `[batch_size, num_heads * num_kv_groups, num_queries,
+        seq_len]`. It masks the padding tokens still in the cache, and is causal over the `num_queries` newest tokens,
+        which are the last ones. Every query attends to itself, so padding queries never see only masked keys.
+        """
+        length = self.seq_lengths[layer_idx]
+        is_padding = self.accumulated_attention_scores[layer_idx][:, :, :length] <= PADDING_SCORE / 2
+        mask = is_padding[:, :, None, :].repeat(1, 1, num_queries, 1)
+        queries = torch.arange(num_queries, device=mask.device)
+        new_tokens = mask[:, :, :, length - num_queries :]
+        new_tokens |= queries[None, :] > queries[:, None]
+        new_tokens[:, :, queries, queries] = False
+        attention_mask = torch.zeros(mask.shape, dtype=dtype, device=mask.device).masked_fill_(mask, torch.finfo(dtype).min)
+        return attention_mask.repeat_interleave(num_kv_groups, dim=1)
+
+    def reorder_cache(self, beam_idx: torch.LongTensor):
+        """Reorders the cache for beam search, given the selected beam indices."""
+        for buffer in self._buffers():
+            for layer_idx in range(len(buffer)):
+                device = buffer[layer_idx].device
+                buffer[layer_idx] = buffer[layer_idx].index_select(0, beam_idx.to(device))
+
+    def to_legacy_cache(self) -> Tuple[Tuple[torch.Tensor], Tuple[torch.Tensor]]:
+        """Converts the `RingHHCache` instance into the legacy format of `HHCache`, with the tokens in their original order."""
+        legacy_cache = ()
+        for layer_idx in range(len(self)):
+            order = self.token_positions[layer_idx][:, :, : self.seq_lengths[layer_idx]].argsort(dim=-1)
+            key_states, value_states = self._read(layer_idx, self.seq_lengths[layer_idx])
+            key_index = order.unsqueeze(-1).expand(order.shape + key_states.shape[3:])
+            legacy_cache += ((
+                key_states.gather(2, key_index),
+                value_states.gather(2, key_index),
+                self.accumulated_attention_scores[layer_idx][:, :, : self.seq_lengths[layer_idx]].gather(2, order),
+            ))
+        return legacy_cache
+
+
 
 
 class StaticCache(Cache):
@@ -565,9 +919,12 @@ class StaticCache(Cache):
             The device on which the cache should be initialized. Should be the same as the layer.
         dtype (*optional*, defaults to `torch.float32`):
             The default `dtype` to use when initializing the layer.
+        kv_quant_bits (`int`, `optional`):
+            Stores the keys and values as 8 or 4 bits integers with a scale per head and token, see `quantize_kv`.
+            Defaults to `config.kv_quant_bits` if the config sets it.
     """
 
-    def __init__(self, config: PretrainedConfig, max_batch_size: int, max_cache_len: int, device, dtype=None) -> None:
+    def __init__(self, config: PretrainedConfig, max_batch_size: int, max_cache_len: int, device, dtype=None, kv_quant_bits=None) -> None:
         super().__init__()
         self.max_batch_size = max_batch_size
         self.max_cache_len = config.max_position_embeddings if max_cache_len is None else max_cache_len
@@ -581,9 +938,18 @@ class StaticCache(Cache):
             config.num_attention_heads if config.num_key_value_heads is None else config.num_key_value_heads
         )
 
+        self.kv_quant_bits = kv_quant_bits if kv_quant_bits is not None else getattr(config, "kv_quant_bits", None)
         cache_shape = (max_batch_size, self.num_key_value_heads, self.max_cache_len, self.head_dim)
-        self.key_cache: torch.Tensor = torch.zeros(cache_shape, dtype=self.dtype, device=device)
-        self.value_cache: torch.Tensor = torch.zeros(cache_shape, dtype=self.dtype, device=device)
+        if self.kv_quant_bits is not None:
+            storage_dtype = torch.int8 if self.kv_quant_bits == 8 else torch.uint8
+            storage_shape = cache_shape[:3] + (self.head_dim * self.kv_quant_bits // 8,)
+            self.key_cache: torch.Tensor = torch.zeros(storage_shape, dtype=storage_dtype, device=device)
+            self.value_cache: torch.Tensor = torch.zeros(storage_shape, dtype=storage_dtype, device=device)
+            self.key_scales: torch.Tensor = torch.zeros(cache_shape[:3] + (1,), dtype=self.dtype, device=device)
+            self.value_scales: torch.Tensor = torch.zeros(cache_shape[:3] + (1,), dtype=self.dtype, device=device)
+        else:
+            self.key_cache: torch.Tensor = torch.zeros(cache_shape, dtype=self.dtype, device=device)
+            self.value_cache: torch.Tensor = torch.zeros(cache_shape, dtype=self.dtype, device=device)
 
     def update(
         self,
@@ -614,6 +980,11 @@ class StaticCache(Cache):
         k_out = self.key_cache
         v_out = self.value_cache
 
+        if self.kv_quant_bits is not None:
+            k_out[:, :, new_cache_positions], self.key_scales[:, :, new_cache_positions] = quantize_kv(key_states, self.kv_quant_bits)
+            v_out[:, :, new_cache_positions], self.value_scales[:, :, new_cache_positions] = quantize_kv(value_states, self.kv_quant_bits)
+            return dequantize_kv(k_out, self.key_scales), dequantize_kv(v_out, self.value_scales)
+
         k_out[:, :, new_cache_positions] = key_states
         v_out[:, :, new_cache_positions] = value_states
 
@@ -625,6 +996,9 @@ class StaticCache(Cache):
         # limit the check to the first batch member and head dimension.
         # TODO: This is error prone, a filled cache may be `0.0`. Let's use a stateless integer instead, after
         # https://github.com/pytorch/pytorch/issues/120248 is fixed
+        if self.kv_quant_bits is not None:
+            # The scales of written slots are never 0
+            return (self.key_scales[0, 0, :, 0] != 0).sum()
         return (self.key_cache[0, 0].any(dim=-1)).sum()
 
     def get_max_length(self) -> Optional[int]:
@@ -637,6 +1011,9 @@ class StaticCache(Cache):
         self.key_cache = self.key_cache.index_select(0, beam_idx.to(device))
         device = self.value_cache.device
         self.value_cache = self.value_cache.index_select(0, beam_idx.to(device))
+        if self.kv_quant_bits is not None:
+            self.key_scales = self.key_scales.index_select(0, beam_idx.to(device))
+            self.value_scales = self.value_scales.index_select(0, beam_idx.to(device))
 
     def to_legacy_cache(self):
         """Dummy function for BC. We have to keep it because otherwise the call in the forward of models will break it"""
@@ -19,7 +19,7 @@ from transformers.models.llama.modeling_llama import (
     LlamaRotaryEmbedding,
     LlamaForCausalLM,
 )
-from utils.cache import Cache, HHCache, StaticCache
+from utils.cache import Cache, HHCache, RingHHCache, StaticCache
 from transformers.utils import logging
 from transformers.modeling_outputs import BaseModelOutputWithPast
 
@@ -49,6 +49,13 @@ def apply_rotary_pos_emb_single(x, cos, sin, position_ids=None, unsqueeze_dim=1)
 
     return x_embed
 
+def apply_rotary_pos_emb_per_head(x, position_ids, rotary_emb):
+    """Rotates x `[bsz, num_heads, seq_len, head_dim]` with different position_ids `[bsz, num_heads, seq_len]` for every head"""
+    cos, sin = rotary_emb(x, position_ids.flatten(1))
+    cos = cos.view(position_ids.shape + cos.shape[-1:])
+    sin = sin.view(position_ids.shape + sin.shape[-1:])
+    return (x * cos) + (rotate_half(x) * sin)
+
 def repeat_kv(hidden_states: torch.Tensor, n_rep: int) -> torch.Tensor:
     """
     This is the equivalent of torch.repeat_interleave(x, dim=1, repeats=n_rep). The hidden states go from (batch,
@@ -193,18 +200,33 @@ class H2OLlamaAttention(nn.Module):
                 query_position_ids = position_ids
                 key_position_ids = position_ids
 
-            key_cos, key_sin = self.rotary_emb(value_states, key_position_ids)
-            query_cos, query_sin = self.rotary_emb(value_states, query_position_ids)
+            if isinstance(past_key_value, RingHHCache) and key_position_ids is not position_ids:
+                # The ring buffer does not keep the tokens in order, every kv head rolls the positions of its own tokens
+                key_position_ids = past_key_value.get_key_position_ids(self.layer_idx)
+                key_states = apply_rotary_pos_emb_per_head(key_states, key_position_ids, self.rotary_emb)
+                if q_len == 1:
+                    # decoding stage, the new token is the last one of every sequence, padding excluded
+                    query_position_ids = key_position_ids[:, :, -1:].repeat_interleave(self.num_key_value_groups, dim=1)
+                    query_states = apply_rotary_pos_emb_per_head(query_states, query_position_ids, self.rotary_emb)
+                else:
+                    query_cos, query_sin = self.rotary_emb(value_states, query_position_ids)
+                    query_states = apply_rotary_pos_emb_single(query_states, query_cos, query_sin)
+            else:
+                key_cos, key_sin = self.rotary_emb(value_states, key_position_ids)
+                query_cos, query_sin = self.rotary_emb(value_states, query_position_ids)
 
-            query_states = apply_rotary_pos_emb_single(query_states, query_cos, query_sin)
-            key_states = apply_rotary_pos_emb_single(key_states, key_cos, key_sin)
+                query_states = apply_rotary_pos_emb_single(query_states, query_cos, query_sin)
+                key_states = apply_rotary_pos_emb_single(key_states, key_cos, key_sin)
 
         key_states = repeat_kv(key_states, self.num_key_value_groups)
         value_states = repeat_kv(value_states, self.num_key_value_groups)
 
         attn_weights = torch.matmul(query_states, key_states.transpose(2, 3)) / math.sqrt(self.head_dim)
 
-        if attention_mask is not None:  # no matter the length, we just slice it
+        if isinstance(past_key_value, RingHHCache) and past_key_value.padding_mask is not None:
+            # The cached tokens are not in the order of the attention mask, the cache masks its padding tokens itself
+            attn_weights = attn_weights + past_key_value.get_attention_mask(self.layer_idx, q_len, self.num_key_value_groups, attn_weights.dtype)
+        elif attention_mask is not None:  # no matter the length, we just slice it
             causal_mask = attention_mask[:, :, :, : key_states.shape[-2]]
             attn_weights = attn_weights + causal_mask
 
@@ -277,8 +299,17 @@ def enable_h2ocache_forward(
 
     past_seen_tokens = 0
     if use_cache:  # kept for BC (cache positions)
-        if not isinstance(past_key_values, StaticCache):
+        if past_key_values is None and self.enable_ring_buffer_cache:
+            padding_mask = attention_mask == 0 if attention_mask is not None and attention_mask.dim() == 2 else None
+            past_key_values = RingHHCache(
+                self.num_window_length,
+                self.num_heavy_hitter_tokens,
+                padding_mask=padding_mask,
+                kv_quant_bits=self.kv_quant_bits,
+            )
+        elif not isinstance(past_key_values, (StaticCache, RingHHCache)):
             past_key_values = HHCache.from_legacy_cache(self.num_window_length, self.num_heavy_hitter_tokens, past_key_values)
+        if not isinstance(past_key_values, StaticCache):
             past_seen_tokens = past_key_values.get_seq_length()
 
     if cache_position is None:
@@ -343,8 +374,11 @@ def enable_h2ocache_forward(
 
     next_cache = None
     if use_cache:
+        # The ring buffer cache is handed back as it is, converting it would copy the whole cache every step
         next_cache = (
-            next_decoder_cache.to_legacy_cache() if isinstance(next_decoder_cache, Cache) else next_decoder_cache
+            next_decoder_cache.to_legacy_cache()
+            if isinstance(next_decoder_cache, Cache) and not isinstance(next_decoder_cache, RingHHCache)
+            else next_decoder_cache
         )
     if not return_dict:
         return tuple(v for v in [hidden_states, next_cache, all_hidden_states, all_self_attns] if v is not None)
@@ -366,6 +400,8 @@ class H2OLlamaForCausalLM(LlamaForCausalLM):
         self.model.forward = types.MethodType(enable_h2ocache_forward, self.model)
         self.model.num_heavy_hitter_tokens = config.num_heavy_hitter_tokens
         self.model.num_window_length = config.num_window_length
+        self.model.enable_ring_buffer_cache = getattr(config, "enable_ring_buffer_cache", True)
+        self.model.kv_quant_bits = getattr(config, "kv_quant_bits", None)
     
     def prepare_inputs_for_generation(
         self, input_ids, past_key_values=None, attention_mask=None, inputs_embeds=None, cache_position=None, **kwargs
@@ -13,7 +13,7 @@ from transformers import AutoTokenizer
 
 from llama_cookbook.inference.chat_utils import read_dialogs_from_file
 from llama_cookbook.inference.model_utils import load_model, load_peft_model
-from llama_cookbook.inference.safety_utils import get_safety_checker
+from llama_cookbook.inference.safety_utils import get_safety_checker, SafetyPipeline
 from accelerate.utils import is_xpu_available
 
 def main(
@@ -75,15 +75,19 @@ def main(
 
     chats = [tokenizer.apply_chat_template(dialog) for dialog in dialogs]
 
-    with torch.no_grad():
-        for idx, chat in enumerate(chats):
-            safety_checker = get_safety_checker(enable_azure_content_safety,
+    safety_checker = get_safety_checker(enable_azure_content_safety,
                                         enable_sensitive_topics,
                                         enable_saleforce_content_safety,
                                         enable_llamaguard_content_safety,
                                         )
+    safety_pipeline = SafetyPipeline(safety_checker)
+    # The user prompts of all dialogs are checked together while the first ones are generated
+    prompt_checks = [safety_pipeline.submit(dialog[0]["content"]) for dialog in dialogs]
+
+    with torch.no_grad():
+        for idx, chat in enumerate(chats):
             # Safety check of the user prompt
-            safety_results = [check(dialogs[idx][0]["content"]) for check in safety_checker]
+            safety_results = prompt_checks[idx].result()
             are_safe = all([r[1] for r in safety_results])
             if are_safe:
                 print(f"User prompt deemed safe.")
@@ -121,7 +125,7 @@ def main(
             output_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
 
             # Safety check of the model output
-            safety_results = [check(output_text) for check in safety_checker]
+            safety_results = safety_pipeline.check(output_text)
             are_safe = all([r[1] for r in safety_results])
             if are_safe:
                 print("User input and model output deemed safe.")
@@ -4,6 +4,7 @@
 import os
 import sys
 import time
+from threading import Thread
 
 import fire
 
@@ -12,8 +13,17 @@ import torch
 from accelerate.utils import is_xpu_available
 from llama_cookbook.inference.model_utils import load_model, load_peft_model
 
-from llama_cookbook.inference.safety_utils import AgentType, get_safety_checker
-from transformers import AutoTokenizer
+from llama_cookbook.inference.safety_utils import AgentType, get_safety_checker, SafetyPipeline
+from transformers import AutoTokenizer, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+
+class StopWhenUnsafe(StoppingCriteria):
+    """Stops generating as soon as a check of the partial output found it unsafe"""
+    def __init__(self, stream_check):
+        self.stream_check = stream_check
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.stream_check.unsafe, dtype=torch.bool, device=input_ids.device)
 
 
 def main(
@@ -56,6 +66,15 @@ def main(
     tokenizer = AutoTokenizer.from_pretrained(model_name)
     tokenizer.pad_token = tokenizer.eos_token
 
+    # Loaded once and kept warm for all requests, the checkers run concurrently
+    safety_checker = get_safety_checker(
+        enable_azure_content_safety,
+        enable_sensitive_topics,
+        enable_salesforce_content_safety,
+        enable_llamaguard_content_safety,
+    )
+    safety_pipeline = SafetyPipeline(safety_checker)
+
     def inference(
         user_prompt,
         temperature,
@@ -64,15 +83,8 @@ def main(
         max_new_tokens,
         **kwargs,
     ):
-        safety_checker = get_safety_checker(
-            enable_azure_content_safety,
-            enable_sensitive_topics,
-            enable_salesforce_content_safety,
-            enable_llamaguard_content_safety,
-        )
-
         # Safety check of the user prompt
-        safety_results = [check(user_prompt) for check in safety_checker]
+        safety_results = safety_pipeline.check(user_prompt)
         are_safe = all([r[1] for r in safety_results])
         if are_safe:
             print("User prompt deemed safe.")
@@ -97,30 +109,51 @@ def main(
         else:
             batch = {k: v.to("cuda") for k, v in batch.items()}
 
+        # The output is checked while it is generated, generation stops early if it turns unsafe
+        stream_check = safety_pipeline.stream(agent_type=AgentType.AGENT, user_prompt=user_prompt)
+        streamer = TextIteratorStreamer(tokenizer, skip_special_tokens=True)
+        outputs = []
+        errors = []
+
+        def generate():
+            try:
+                with torch.no_grad():
+                    outputs.append(model.generate(
+                        **batch,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([StopWhenUnsafe(stream_check)]),
+                        max_new_tokens=max_new_tokens,
+                        do_sample=do_sample,
+                        top_p=top_p,
+                        temperature=temperature,
+                        min_length=min_length,
+                        use_cache=use_cache,
+                        top_k=top_k,
+                        repetition_penalty=repetition_penalty,
+                        length_penalty=length_penalty,
+                        **kwargs,
+                    ))
+            except BaseException as e:
+                # End the stream so the loop below does not wait forever, the error is raised once the thread is joined
+                errors.append(e)
+                streamer.end()
+
         start = time.perf_counter()
-        with torch.no_grad():
-            outputs = model.generate(
-                **batch,
-                max_new_tokens=max_new_tokens,
-                do_sample=do_sample,
-                top_p=top_p,
-                temperature=temperature,
-                min_length=min_length,
-                use_cache=use_cache,
-                top_k=top_k,
-                repetition_penalty=repetition_penalty,
-                length_penalty=length_penalty,
-                **kwargs,
-            )
+        thread = Thread(target=generate)
+        thread.start()
+        output_text = ""
+        for new_text in streamer:
+            output_text += new_text
+            stream_check.feed(output_text)
+        thread.join()
+        if errors:
+            raise errors[0]
         e2e_inference_time = (time.perf_counter() - start) * 1000
         print(f"the inference time is {e2e_inference_time} ms")
-        output_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
+        output_text = tokenizer.decode(outputs[0][0], skip_special_tokens=True)
 
         # Safety check of the model output
-        safety_results = [
-            check(output_text, agent_type=AgentType.AGENT, user_prompt=user_prompt)
-            for check in safety_checker
-        ]
+        safety_results = stream_check.finish(output_text)
         are_safe = all([r[1] for r in safety_results])
         if are_safe:
             print("User input and model output deemed safe.")
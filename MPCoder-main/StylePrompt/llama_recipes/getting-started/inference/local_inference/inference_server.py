@@ -0,0 +1,62 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import fire
+
+import torch
+
+from accelerate.utils import is_xpu_available
+from llama_cookbook.inference.continuous_batching import ContinuousBatchingEngine
+from llama_cookbook.inference.model_utils import load_model, load_peft_model
+from llama_cookbook.inference.openai_server import create_server
+from transformers import AutoTokenizer
+
+
+def main(
+    model_name,
+    peft_model: str = None,
+    quantization: str = None, # Options: 4bit, 8bit
+    host: str = "0.0.0.0",
+    port: int = 8000,
+    max_batch_size: int = 32,  # The maximum number of sequences decoded together
+    max_prefill_batch_size: int = 8,  # The maximum number of new prompts prefilled together
+    max_new_tokens: int = 256,  # Used when a request does not set max_tokens
+    seed: int = 42,  # seed value for reproducibility
+    use_fast_kernels: bool = False,  # Enable using SDPA from PyTroch Accelerated Transformers, make use Flash Attention and Xformer memory-efficient kernels
+    **kwargs,
+):
+    # Set the seeds for reproducibility
+    if is_xpu_available():
+        torch.xpu.manual_seed(seed)
+    else:
+        torch.cuda.manual_seed(seed)
+    torch.manual_seed(seed)
+
+    model = load_model(model_name, quantization, use_fast_kernels, **kwargs)
+    if peft_model:
+        model = load_peft_model(model, peft_model)
+
+    model.eval()
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.pad_token = tokenizer.eos_token
+
+    engine = ContinuousBatchingEngine(
+        model,
+        tokenizer,
+        max_batch_size=max_batch_size,
+        max_prefill_batch_size=max_prefill_batch_size,
+    ).start()
+    server = create_server(engine, model_name, host=host, port=port, default_max_tokens=max_new_tokens)
+    print(f"Serving {model_name} on http://{host}:{port}/v1 (completions, chat/completions)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        engine.stop()
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
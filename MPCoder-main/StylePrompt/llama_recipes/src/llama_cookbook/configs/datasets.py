@@ -9,6 +9,8 @@ class samsum_dataset:
     dataset: str =  "samsum_dataset"
     train_split: str = "train"
     test_split: str = "validation"
+    num_proc: int = 1 # number of processes tokenizing the dataset
+    preprocessing_batch_size: int = 1000 # number of samples tokenized per batch
 
 
 @dataclass
@@ -16,6 +18,8 @@ class grammar_dataset:
     dataset: str = "grammar_dataset"
     train_split: str = "src/llama_cookbook/datasets/grammar_dataset/gtrain_10k.csv"
     test_split: str = "src/llama_cookbook/datasets/grammar_dataset/grammar_validation.csv"
+    num_proc: int = 1 # number of processes tokenizing the dataset
+    preprocessing_batch_size: int = 1000 # number of samples tokenized per batch
 
 
 @dataclass
@@ -38,3 +42,5 @@ class llamaguard_toxicchat_dataset:
     dataset: str = "llamaguard_toxicchat_dataset"
     train_split: str = "train"
     test_split: str = "test"
+    num_proc: int = 1 # number of processes tokenizing the dataset
+    preprocessing_batch_size: int = 1000 # number of samples tokenized per batch
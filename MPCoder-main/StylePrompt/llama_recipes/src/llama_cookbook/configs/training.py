@@ -12,15 +12,24 @@ class train_config:
     low_cpu_fsdp: bool=False # saves cpu memory by loading pretrained model on rank0 only
     run_validation: bool=True
     batch_size_training: int=4
-    batching_strategy: str="packing" #alternative: padding
+    batching_strategy: str="packing" #alternative: padding, token_budget
     context_length: int=4096
+    packing_strategy: str="concat" # used with batching_strategy=packing, alternative: ffd (first-fit-decreasing keeps samples whole and pads the chunks)
+    packing_position_ids: bool=False # emit position ids that restart at each document boundary of a packed chunk (drops the attention mask and loads the model with flash_attention_2, which keeps attention within each document, requires flash-attn)
+    token_budget: int=0 # max padded tokens per batch with batching_strategy=token_budget, 0 means batch size * context_length
     gradient_accumulation_steps: int=1
     gradient_clipping: bool = False
     gradient_clipping_threshold: float = 1.0
     num_epochs: int=3
     max_train_step: int=0
     max_eval_step: int=0
+    checkpoint_every_n_steps: int=0 # save a resumable checkpoint (model, optimizer, scheduler, scaler, RNG states and data position) to output_dir/training_state every N steps, needs to be a multiple of gradient_accumulation_steps, 0 disables
+    resume_from_checkpoint: str="" # if not empty, resume training from the checkpoint saved by checkpoint_every_n_steps in this training_state folder, skipping the batches already consumed
+    eval_every_n_steps: int=0 # also evaluate every N training steps within an epoch, 0 only evaluates at the end of each epoch
+    eval_max_samples: int=0 # evaluate on a fixed random subsample of this many validation samples, 0 uses the whole validation set
+    eval_decode_predictions: bool=False # also decode the argmax predictions of every eval batch and save them to output_dir (slow)
     num_workers_dataloader: int=1
+    tokenized_cache_dir: str="" # if not empty, the tokenized dataset is cached as memory-mapped token files in this directory and reused by later runs
     lr: float=1e-4
     weight_decay: float=0.0
     gamma: float= 0.85 # multiplicatively decay the learning rate by gamma after each epoch
@@ -42,9 +51,11 @@ class train_config:
     dist_checkpoint_root_folder: str="PATH/to/save/FSDP/model" # will be used if using FSDP
     dist_checkpoint_folder: str="fine-tuned" # will be used if using FSDP
     save_optimizer: bool=False # will be used if using FSDP
+    async_checkpointing: bool=False # will be used if using FSDP, copies the checkpoint to host memory and writes it to disk in the background while training continues
     use_fast_kernels: bool = False # Enable using SDPA from PyTroch Accelerated Transformers, make use Flash Attention and Xformer memory-efficient kernels
     use_wandb: bool = False # Enable wandb for experient tracking
-    save_metrics: bool = False # saves training metrics to a json file for later plotting
+    save_metrics: bool = False # saves training metrics to a json lines file for later plotting
+    metrics_flush_interval: int = 10 # step losses stay on the device and are copied to the host for logging every N steps, avoiding a sync per step
     flop_counter: bool = False # Enable flop counter to measure model throughput, can not be used with pytorch profiler at the same time.
     flop_counter_start: int = 3 # The step to start profiling, default is 3, which means after 3 steps of warmup stage, the profiler will start to count flops.
     use_profiler: bool = False # Enable pytorch profiler, can not be used with flop counter at the same time.
@@ -0,0 +1,47 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import numpy as np
+import torch
+
+from llama_cookbook.data.token_budget_sampler import get_sample_lengths, make_token_budget_batches
+
+
+def get_eval_subset(dataset, max_samples: int, seed: int = 0):
+    """
+    Returns a fixed random subsample of max_samples samples of the dataset (the whole dataset if max_samples <= 0).
+    The same seed always selects the same samples, so evaluations during a run stay comparable.
+    """
+    if max_samples <= 0 or max_samples >= len(dataset):
+        return dataset
+    rng = np.random.default_rng(seed)
+    indices = np.sort(rng.choice(len(dataset), size=max_samples, replace=False))
+    return torch.utils.data.Subset(dataset, indices.tolist())
+
+
+class ShardedEvalBatchSampler(torch.utils.data.BatchSampler):
+    """
+    Splits the batches of an evaluation set across ranks so that every sample is evaluated exactly once.
+    Nothing is dropped or duplicated, ranks get at most one batch more than the others.
+
+    Batches hold batch_size samples of similar length, or as many samples as fit into max_tokens if it is set.
+    """
+    def __init__(self, data_source, batch_size: int, num_replicas: int = 1, rank: int = 0, max_tokens: int = 0, sort_by_length: bool = True) -> None:
+        if max_tokens > 0:
+            batches = make_token_budget_batches(get_sample_lengths(data_source), max_tokens)
+        else:
+            if sort_by_length:
+                ids = np.argsort(get_sample_lengths(data_source), kind="mergesort").tolist()
+            else:
+                ids = list(range(len(data_source)))
+            batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.batches = batches[rank::num_replicas]
+
+    def __iter__(self):
+        for b in self.batches:
+            yield b
+
+    def __len__(self):
+        return len(self.batches)
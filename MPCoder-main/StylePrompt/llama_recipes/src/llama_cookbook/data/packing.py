@@ -0,0 +1,197 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import numpy as np
+from torch.utils.data import Dataset
+from tqdm import tqdm
+
+from llama_cookbook.data.token_cache import MemmapTokenDataset, TOKEN_DTYPE
+
+PACKING_STRATEGIES = ("concat", "ffd")
+
+# Value used to fill the unused tail of a chunk, per column
+PAD_VALUES = {
+    "labels": -100,
+    "attention_mask": 0,
+}
+
+
+class _TokenBuffer:
+    """Growable flat int32 array, amortized O(1) appends"""
+    def __init__(self, capacity: int = 1 << 16):
+        self.data = np.empty(capacity, dtype=TOKEN_DTYPE)
+        self.size = 0
+
+    def append(self, values):
+        values = np.asarray(values, dtype=TOKEN_DTYPE)
+        end = self.size + len(values)
+        if end > len(self.data):
+            grown = np.empty(max(end, 2 * len(self.data)), dtype=TOKEN_DTYPE)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:end] = values
+        self.size = end
+
+    def finalize(self) -> np.ndarray:
+        return self.data[:self.size].copy()
+
+
+def first_fit_decreasing(lengths: np.ndarray, capacity: int) -> np.ndarray:
+    """
+    Assigns every item (all lengths <= capacity) to a bin using first-fit-decreasing.
+    A max segment tree over the remaining bin capacities finds the first fitting bin in O(log n).
+    Returns the bin id of every item, bins are numbered in the order they are opened.
+    """
+    n = len(lengths)
+    bin_ids = np.zeros(n, dtype=np.int64)
+    if n == 0:
+        return bin_ids
+    size = 1
+    while size < n:
+        size *= 2
+    # At most n bins are needed, unopened bins have the full capacity left
+    tree = [capacity] * (2 * size)
+    for item in np.argsort(-lengths, kind="stable").tolist():
+        length = int(lengths[item])
+        node = 1
+        while node < size:
+            node = 2 * node if tree[2 * node] >= length else 2 * node + 1
+        bin_ids[item] = node - size
+        tree[node] -= length
+        node //= 2
+        while node:
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+            node //= 2
+    return bin_ids
+
+
+class PackedDataset(Dataset):
+    """
+    Packs tokenized samples into chunks of chunk_size tokens.
+
+    The samples are streamed once into flat token arrays (or used in place when the dataset is a
+    MemmapTokenDataset) and only a packing plan of (start, length) pieces per chunk is kept, chunks
+    are assembled when they are requested.
+
+    strategy="concat" concatenates all samples and cuts the stream every chunk_size tokens, like ConcatDataset.
+    strategy="ffd" keeps samples whole where possible and places them into chunks with first-fit-decreasing
+    bin packing, the unused tail of a chunk is padded. Samples longer than chunk_size are split first.
+
+    With position_ids=True every chunk also gets position ids that restart at 0 at each document boundary and
+    no attention_mask, so that flash_attention_2 takes its varlen path on the position ids and restricts attention
+    to each document (given an attention_mask it unpads on the mask instead and ignores the position ids).
+    Other attention implementations only restart the rotary positions, documents still attend to each other.
+    The padded tail of an ffd chunk is a document of its own whose labels are -100.
+    """
+    def __init__(self, dataset, chunk_size=4096, strategy="concat", position_ids=False, pad_token_id=0):
+        if strategy not in PACKING_STRATEGIES:
+            raise ValueError(f"Unknown packing strategy: {strategy}, choose one of {PACKING_STRATEGIES}")
+        self.chunk_size = chunk_size
+        self.strategy = strategy
+        self.position_ids = position_ids
+        self.pad_token_id = pad_token_id
+
+        # Memory-mapped datasets are read in place, everything else is streamed into flat arrays once
+        self._memmap_dataset = None
+        self._tokens = None
+        if isinstance(dataset, MemmapTokenDataset):
+            self._memmap_dataset = dataset
+            self.columns = list(dataset.columns)
+            offsets = np.asarray(dataset.offsets, dtype=np.int64)
+        else:
+            self.columns, self._tokens, offsets = self._flatten(dataset)
+
+        if strategy == "concat":
+            self.piece_starts, self.piece_lengths, self.chunk_offsets = self._plan_concat(offsets)
+        else:
+            self.piece_starts, self.piece_lengths, self.chunk_offsets = self._plan_ffd(offsets)
+
+    @property
+    def tokens(self) -> dict:
+        if self._memmap_dataset is not None:
+            return self._memmap_dataset.tokens
+        return self._tokens
+
+    @staticmethod
+    def _flatten(dataset):
+        columns, buffers = None, None
+        offsets = np.zeros(len(dataset) + 1, dtype=np.int64)
+        for idx in tqdm(range(len(dataset)), desc="Preprocessing dataset", dynamic_ncols=True):
+            sample = dataset[idx]
+            if columns is None:
+                columns = list(sample.keys())
+                buffers = {k: _TokenBuffer() for k in columns}
+            for k in columns:
+                buffers[k].append(sample[k])
+            offsets[idx + 1] = offsets[idx] + len(sample[columns[0]])
+        if columns is None:
+            columns = ["input_ids", "attention_mask", "labels"]
+            buffers = {k: _TokenBuffer(0) for k in columns}
+        return columns, {k: b.finalize() for k, b in buffers.items()}, offsets
+
+    def _plan_concat(self, offsets):
+        lengths = np.diff(offsets)
+        total = int(offsets[-1])
+        # Matches ConcatDataset: the last (up to chunk_size tokens long) remainder of the stream is dropped
+        num_chunks = max(total - 1, 0) // self.chunk_size
+        used = num_chunks * self.chunk_size
+        # Every document start and every chunk start begins a new piece
+        doc_starts = offsets[:-1][(lengths > 0) & (offsets[:-1] < used)]
+        edges = np.union1d(doc_starts, np.arange(0, used + 1, self.chunk_size, dtype=np.int64))
+        piece_starts = edges[:-1]
+        piece_lengths = np.diff(edges)
+        chunk_ids = piece_starts // self.chunk_size
+        chunk_offsets = np.searchsorted(chunk_ids, np.arange(num_chunks + 1), side="left")
+        return piece_starts, piece_lengths, chunk_offsets
+
+    def _plan_ffd(self, offsets):
+        lengths = np.diff(offsets)
+        # Split documents longer than chunk_size into chunk_size pieces plus a remainder
+        num_pieces = -(-lengths // self.chunk_size)
+        doc_ids = np.repeat(np.arange(len(lengths)), num_pieces)
+        piece_index = np.arange(len(doc_ids)) - np.repeat(np.cumsum(num_pieces) - num_pieces, num_pieces)
+        piece_starts = offsets[doc_ids] + piece_index * self.chunk_size
+        piece_lengths = np.minimum(self.chunk_size, lengths[doc_ids] - piece_index * self.chunk_size)
+
+        bin_ids = first_fit_decreasing(piece_lengths, self.chunk_size)
+        order = np.argsort(bin_ids, kind="stable")
+        bin_ids = bin_ids[order]
+        num_chunks = int(bin_ids[-1]) + 1 if len(bin_ids) else 0
+        chunk_offsets = np.searchsorted(bin_ids, np.arange(num_chunks + 1), side="left")
+        return piece_starts[order], piece_lengths[order], chunk_offsets
+
+    @property
+    def padding_ratio(self) -> float:
+        """Fraction of the packed tokens that are padding"""
+        capacity = len(self) * self.chunk_size
+        return 1.0 - float(self.piece_lengths.sum()) / capacity if capacity else 0.0
+
+    def __len__(self):
+        return len(self.chunk_offsets) - 1
+
+    def __getitem__(self, idx):
+        if idx < 0 or idx >= len(self):
+            raise IndexError(f"Index {idx} out of range for dataset with {len(self)} chunks")
+        first, last = self.chunk_offsets[idx], self.chunk_offsets[idx + 1]
+        starts = self.piece_starts[first:last]
+        lengths = self.piece_lengths[first:last]
+        num_tokens = int(lengths.sum())
+        pad = self.chunk_size - num_tokens
+
+        sample = {}
+        for k in self.columns:
+            tokens = self.tokens[k]
+            chunk = np.concatenate([tokens[s:s + l] for s, l in zip(starts.tolist(), lengths.tolist())])
+            if pad:
+                fill = self.pad_token_id if k == "input_ids" else PAD_VALUES.get(k, 0)
+                chunk = np.concatenate([chunk, np.full(pad, fill, dtype=TOKEN_DTYPE)])
+            sample[k] = chunk.tolist()
+
+        if self.position_ids:
+            sample.pop("attention_mask", None)
+            # Positions restart at every piece, the padding tail counts as its own piece
+            if pad:
+                lengths = np.append(lengths, pad)
+            piece_offsets = np.cumsum(lengths) - lengths
+            sample["position_ids"] = (np.arange(self.chunk_size) - np.repeat(piece_offsets, lengths)).tolist()
+        return sample
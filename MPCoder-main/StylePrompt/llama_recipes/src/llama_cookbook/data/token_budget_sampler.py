@@ -0,0 +1,89 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import random
+
+import numpy as np
+import torch
+
+
+def get_sample_lengths(data_source) -> np.ndarray:
+    # Memory-mapped token caches know their lengths without reading any tokens
+    if hasattr(data_source, "lengths"):
+        return np.asarray(data_source.lengths, dtype=np.int64)
+    lengths = np.zeros(len(data_source), dtype=np.int64)
+    for idx in range(len(data_source)):
+        sample = data_source[idx]
+        if isinstance(sample, dict):
+            sample = sample["input_ids"] if "input_ids" in sample else next(iter(sample.values()))
+        lengths[idx] = len(sample)
+    return lengths
+
+
+def make_token_budget_batches(lengths: np.ndarray, max_tokens: int) -> list:
+    """
+    Groups sample ids sorted by length into batches whose padded size (batch size * longest sample)
+    stays within max_tokens. A sample longer than max_tokens forms a batch of its own.
+    """
+    ids = np.argsort(lengths, kind="mergesort")
+    batches, batch, batch_max = [], [], 0
+    for idx in ids.tolist():
+        length = int(lengths[idx])
+        # Samples are sorted, so the new sample is the longest of the batch
+        if batch and (len(batch) + 1) * max(batch_max, length) > max_tokens:
+            batches.append(batch)
+            batch, batch_max = [], 0
+        batch.append(idx)
+        batch_max = max(batch_max, length)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class TokenBudgetBatchSampler(torch.utils.data.BatchSampler):
+    def __init__(self, data_source, max_tokens: int, shuffle: bool=True, seed: int=0) -> None:
+        if max_tokens <= 0:
+            raise ValueError(f"max_tokens needs to be positive, got {max_tokens}")
+        self.lengths = get_sample_lengths(data_source)
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.rng = random.Random(seed)
+        self.batches = make_token_budget_batches(self.lengths, max_tokens)
+
+    def __iter__(self):
+        batches = list(self.batches)
+        if self.shuffle:
+            self.rng.shuffle(batches)
+        for b in batches:
+            yield b
+
+    def __len__(self):
+        return len(self.batches)
+
+
+class DistributedTokenBudgetBatchSampler(torch.utils.data.BatchSampler):
+    """
+    Every step, each rank gets one of num_replicas consecutive (similar length) token budget batches,
+    which keeps the step count equal and the work per step balanced across ranks.
+    Batches left over after the last full group are dropped.
+    """
+    def __init__(self, data_source, max_tokens: int, num_replicas: int, rank: int, shuffle: bool = True, seed: int = 0) -> None:
+        self.batch_sampler = TokenBudgetBatchSampler(data_source, max_tokens, shuffle=False)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        # Same seed on every rank, so all ranks shuffle the groups identically
+        self.rng = random.Random(seed)
+        batches = self.batch_sampler.batches
+        num_groups = len(batches) // num_replicas
+        self.groups = [batches[i * num_replicas:(i + 1) * num_replicas] for i in range(num_groups)]
+
+    def __iter__(self):
+        groups = list(self.groups)
+        if self.shuffle:
+            self.rng.shuffle(groups)
+        for g in groups:
+            yield g[self.rank]
+
+    def __len__(self):
+        return len(self.groups)
@@ -0,0 +1,220 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import Dataset
+from tqdm import tqdm
+
+TOKEN_DTYPE = np.int32
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+# Dataset config fields that change how fast a dataset is tokenized, but not the tokens
+PREPROCESSING_FIELDS = ("num_proc", "preprocessing_batch_size")
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Hash everything about the tokenizer that can change the token ids it produces"""
+    # Processors (e.g. for mllama) wrap the actual tokenizer
+    tokenizer = getattr(tokenizer, "tokenizer", tokenizer)
+    h = hashlib.sha256()
+    h.update(type(tokenizer).__name__.encode())
+    for attr in ("name_or_path", "bos_token_id", "eos_token_id", "pad_token_id", "special_tokens_map"):
+        h.update(f"{attr}={getattr(tokenizer, attr, None)}\n".encode())
+    if hasattr(tokenizer, "get_vocab"):
+        for token, idx in sorted(tokenizer.get_vocab().items(), key=lambda x: x[1]):
+            h.update(f"{idx}:{token}\n".encode())
+    else:
+        h.update(f"len={len(tokenizer)}\n".encode())
+    return h.hexdigest()
+
+
+def dataset_config_fingerprint(dataset_config, split: str) -> str:
+    """Hash the dataset config, the split and the state of any local file the config points to"""
+    if dataclasses.is_dataclass(dataset_config):
+        config = dataclasses.asdict(dataset_config)
+    else:
+        config = dict(vars(dataset_config))
+    for key in PREPROCESSING_FIELDS:
+        config.pop(key, None)
+    h = hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode())
+    h.update(split.encode())
+    # Local data files (or custom dataset .py files) can change while the config stays the same
+    for value in config.values():
+        if not isinstance(value, str):
+            continue
+        path = value.split(":")[0]
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            h.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def get_token_cache_path(cache_dir: str, tokenizer, dataset_config, split: str) -> str:
+    key = hashlib.sha256(
+        (dataset_config_fingerprint(dataset_config, split) + tokenizer_fingerprint(tokenizer)).encode()
+    ).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{dataset_config.dataset}-{split}-{key}")
+
+
+def token_cache_exists(cache_path: str) -> bool:
+    # The meta file is written last, a directory without it is an interrupted build
+    return os.path.isfile(os.path.join(cache_path, META_FILE))
+
+
+def _as_token_array(values) -> np.ndarray:
+    if isinstance(values, torch.Tensor):
+        values = values.numpy()
+    array = np.asarray(values)
+    if array.ndim != 1 or not (np.issubdtype(array.dtype, np.integer) or array.dtype == np.bool_):
+        raise ValueError(f"Expected a flat sequence of token ids, got an array of dtype {array.dtype} with shape {array.shape}")
+    return array.astype(TOKEN_DTYPE)
+
+
+def is_token_cacheable(sample) -> bool:
+    """Only samples made of flat integer sequences of equal length (input_ids, labels, attention_mask, ...) can be cached"""
+    if not isinstance(sample, dict) or len(sample) == 0:
+        return False
+    try:
+        lengths = set(len(_as_token_array(v)) for v in sample.values())
+    except (TypeError, ValueError):
+        return False
+    return len(lengths) == 1
+
+
+def write_token_cache(dataset, cache_path: str) -> None:
+    """
+    Tokenize every sample of the dataset once and store each column as a flat int32 token file
+    plus a shared offsets index. The cache is built in a temporary directory and moved into place
+    so a crashed build never leaves a half written cache behind.
+    """
+    parent_dir = os.path.dirname(os.path.abspath(cache_path))
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent_dir, prefix=".tmp-")
+    columns, files = None, {}
+    offsets = [0]
+    try:
+        for idx in tqdm(range(len(dataset)), desc="Tokenizing dataset into cache", dynamic_ncols=True):
+            sample = dataset[idx]
+            if columns is None:
+                columns = list(sample.keys())
+                files = {k: open(os.path.join(tmp_path, f"{k}.bin"), "wb") for k in columns}
+            arrays = [_as_token_array(sample[k]) for k in columns]
+            if any(len(a) != len(arrays[0]) for a in arrays):
+                raise ValueError(f"Sample {idx} has columns of different lengths, can not be cached")
+            for k, a in zip(columns, arrays):
+                a.tofile(files[k])
+            offsets.append(offsets[-1] + len(arrays[0]))
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    finally:
+        for f in files.values():
+            f.close()
+
+    np.save(os.path.join(tmp_path, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(tmp_path, META_FILE), "w") as f:
+        json.dump({"columns": columns or [], "num_samples": len(offsets) - 1, "num_tokens": offsets[-1]}, f)
+
+    try:
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # Another process finished the same cache first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not token_cache_exists(cache_path):
+            raise
+
+
+class MemmapTokenDataset(Dataset):
+    """
+    Reads samples from a token cache written by write_token_cache.
+    The token files are memory-mapped lazily so dataloader workers share the page cache
+    instead of each holding a copy of the tokenized dataset.
+    """
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        with open(os.path.join(cache_path, META_FILE)) as f:
+            meta = json.load(f)
+        self.columns = meta["columns"]
+        self.num_samples = meta["num_samples"]
+        self._offsets = None
+        self._tokens = None
+
+    def _open(self):
+        if self._tokens is None:
+            self._offsets = np.load(os.path.join(self.cache_path, OFFSETS_FILE), mmap_mode="r")
+            self._tokens = {}
+            for k in self.columns:
+                path = os.path.join(self.cache_path, f"{k}.bin")
+                # np.memmap can not map empty files
+                if os.path.getsize(path) > 0:
+                    self._tokens[k] = np.memmap(path, dtype=TOKEN_DTYPE, mode="r")
+                else:
+                    self._tokens[k] = np.zeros(0, dtype=TOKEN_DTYPE)
+        return self._offsets, self._tokens
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self._open()[0]
+
+    @property
+    def tokens(self) -> dict:
+        return self._open()[1]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Length of every sample, read from the offsets index without touching the token files"""
+        return np.diff(self.offsets)
+
+    def __getstate__(self):
+        # Never pickle the mapped arrays, each worker maps the files itself
+        state = self.__dict__.copy()
+        state["_offsets"] = None
+        state["_tokens"] = None
+        return state
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, index):
+        index = int(index)
+        if index < 0:
+            index += self.num_samples
+        if index < 0 or index >= self.num_samples:
+            raise IndexError(f"Index {index} out of range for dataset with {self.num_samples} samples")
+        offsets, tokens = self._open()
+        start, end = int(offsets[index]), int(offsets[index + 1])
+        return {k: tokens[k][start:end].tolist() for k in self.columns}
+
+
+def get_cached_dataset(build_dataset, cache_path: str):
+    """
+    Returns a MemmapTokenDataset for cache_path, building the cache from build_dataset() if it does not exist yet.
+    In a distributed run only rank 0 tokenizes while the other ranks wait for the cache to appear.
+    Datasets that can not be cached (e.g. samples containing images) are returned uncached.
+    """
+    dataset = None
+    if not token_cache_exists(cache_path):
+        if not dist.is_initialized() or dist.get_rank() == 0:
+            dataset = build_dataset()
+            if len(dataset) > 0 and is_token_cacheable(dataset[0]):
+                print(f"--> Writing tokenized dataset cache to {cache_path}")
+                write_token_cache(dataset, cache_path)
+            else:
+                print(f"Warning: dataset samples are not flat token id sequences, not caching {cache_path}")
+        if dist.is_initialized():
+            dist.barrier()
+
+    if not token_cache_exists(cache_path):
+        return dataset if dataset is not None else build_dataset()
+
+    print(f"--> Loading tokenized dataset cache from {cache_path}")
+    return MemmapTokenDataset(cache_path)
@@ -10,12 +10,15 @@ from pathlib import Path
 
 from torch.utils.data import Dataset
 
+from llama_cookbook.datasets.preprocessing import get_map_kwargs, tokenize_prompt_and_completion
+
 
 class grammar(Dataset):
     def __init__(
         self,
         tokenizer,
         csv_name=None,
+        map_kwargs=None,
     ):
 
         try:
@@ -32,35 +35,28 @@ class grammar(Dataset):
         # if num_samples:
         #    self.dataset = self.dataset.select(list(range(0, num_samples)))
         self.tokenizer = tokenizer
-        self.print_text = False  # print_text
+
+        # Tokenize all samples up front in batches (in parallel with map_kwargs num_proc) instead of in __getitem__
+        self.dataset = self.dataset.map(
+            self.convert_to_features,
+            remove_columns=self.dataset["train"].column_names,
+            **(map_kwargs or {"batched": True}),
+        )
 
     def __len__(self):
         return self.dataset["train"].shape[0]
 
     def convert_to_features(self, example_batch):
 
-        # Create prompt and tokenize contexts and questions
-
-        if self.print_text:
-            print("Input Text: ", self.clean_text(example_batch["text"]))
-
-        input_ = example_batch["input"]
-        target_ = example_batch["target"]
-
-        prompt = f"Correct this to standard English: {input_}\n---\nCorrected: "
-        prompt_ids = self.tokenizer.encode(self.tokenizer.bos_token + prompt, add_special_tokens=False)
-        label_ids = self.tokenizer.encode(target_ + self.tokenizer.eos_token, add_special_tokens=False)
-
-        sample = {
-            "input_ids": prompt_ids + label_ids,
-            "attention_mask": [1] * len(prompt_ids + label_ids),
-            "labels": [-100] * len(prompt_ids) + label_ids
-        }
-
-        return sample
+        # Create prompts and tokenize a batch of inputs and targets
+        prompts = [
+            f"Correct this to standard English: {input_}\n---\nCorrected: "
+            for input_ in example_batch["input"]
+        ]
+        return tokenize_prompt_and_completion(self.tokenizer, prompts, example_batch["target"])
 
     def __getitem__(self, index):
-        return self.convert_to_features(self.dataset["train"][int(index)])
+        return self.dataset["train"][int(index)]
 
 
 def get_dataset(
@@ -75,6 +71,7 @@ def get_dataset(
     dataset = grammar(
         tokenizer=tokenizer,
         csv_name=csv_name,
+        map_kwargs=get_map_kwargs(dataset_config),
     )
 
     return dataset
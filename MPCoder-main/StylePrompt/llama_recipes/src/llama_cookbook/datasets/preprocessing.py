@@ -0,0 +1,35 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+# Shared batched tokenization for the HuggingFace datasets backed loaders of DATASET_PREPROC
+
+
+def get_map_kwargs(dataset_config) -> dict:
+    """Arguments for datasets.Dataset.map that process batches of samples in num_proc worker processes"""
+    num_proc = getattr(dataset_config, "num_proc", 1)
+    return {
+        "batched": True,
+        "batch_size": getattr(dataset_config, "preprocessing_batch_size", 1000),
+        "num_proc": num_proc if num_proc > 1 else None,
+    }
+
+
+def batch_encode(tokenizer, texts, add_special_tokens=False):
+    """Tokenizes a list of texts with a single call, which fast tokenizers encode in parallel"""
+    return tokenizer(list(texts), add_special_tokens=add_special_tokens)["input_ids"]
+
+
+def tokenize_prompt_and_completion(tokenizer, prompts, completions) -> dict:
+    """
+    Tokenizes a batch of bos + prompt and completion + eos pairs into input_ids, attention_mask and labels,
+    with the prompt tokens masked out of the labels.
+    """
+    prompt_ids = batch_encode(tokenizer, [tokenizer.bos_token + p for p in prompts])
+    completion_ids = batch_encode(tokenizer, [c + tokenizer.eos_token for c in completions])
+
+    batch = {"input_ids": [], "attention_mask": [], "labels": []}
+    for prompt, completion in zip(prompt_ids, completion_ids):
+        batch["input_ids"].append(prompt + completion)
+        batch["attention_mask"].append([1] * (len(prompt) + len(completion)))
+        batch["labels"].append([-100] * len(prompt) + completion)
+    return batch
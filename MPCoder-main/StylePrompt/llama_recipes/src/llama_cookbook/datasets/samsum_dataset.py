@@ -8,6 +8,8 @@ import datasets
 
 from unittest.mock import patch
 
+from llama_cookbook.datasets.preprocessing import get_map_kwargs, tokenize_prompt_and_completion
+
 @patch('builtins.input', return_value="N")
 def load_samsum(split, _):
     try:
@@ -27,26 +29,11 @@ def get_preprocessed_samsum(dataset_config, tokenizer, split):
         f"Summarize this dialog:\n{{dialog}}\n---\nSummary:\n"
     )
 
-    def apply_prompt_template(sample):
-        return {
-            "prompt": prompt.format(dialog=sample["dialogue"]),
-            "summary": sample["summary"],
-        }
-
-    dataset = dataset.map(apply_prompt_template, remove_columns=list(dataset.features))
-
-    def tokenize_add_label(sample):
-        prompt = tokenizer.encode(tokenizer.bos_token + sample["prompt"], add_special_tokens=False)
-        summary = tokenizer.encode(sample["summary"] +  tokenizer.eos_token, add_special_tokens=False)
-
-        sample = {
-            "input_ids": prompt + summary,
-            "attention_mask" : [1] * (len(prompt) + len(summary)),
-            "labels": [-100] * len(prompt) + summary,
-            }
-
-        return sample
+    def tokenize_add_label(batch):
+        prompts = [prompt.format(dialog=dialog) for dialog in batch["dialogue"]]
+        return tokenize_prompt_and_completion(tokenizer, prompts, batch["summary"])
 
-    dataset = dataset.map(tokenize_add_label, remove_columns=list(dataset.features))
+    # Batched tokenization, in dataset_config.num_proc processes
+    dataset = dataset.map(tokenize_add_label, remove_columns=list(dataset.features), **get_map_kwargs(dataset_config))
 
     return dataset
@@ -9,14 +9,15 @@ import itertools
 from llama_cookbook.inference.prompt_format_utils import  LLAMA_GUARD_3_CATEGORY
 import ast
 import fire
-
-def tokenize_prompt_and_labels(full_prompt, tokenizer):
-        prompt_tokens = tokenizer.encode(full_prompt)
-        combined_tokens = {
-            "input_ids": list(prompt_tokens),
-            "labels": list(prompt_tokens)
+from llama_cookbook.datasets.preprocessing import batch_encode, get_map_kwargs
+
+def tokenize_prompt_and_labels(full_prompts, tokenizer):
+        prompt_tokens = batch_encode(tokenizer, full_prompts, add_special_tokens=True)
+        return {
+            "input_ids": [list(t) for t in prompt_tokens],
+            "labels": [list(t) for t in prompt_tokens],
+            "attention_mask": [[1] * len(t) for t in prompt_tokens],
         }
-        return dict(combined_tokens, attention_mask=[1]*len(combined_tokens["input_ids"]))
     
 
 from llama_cookbook.data.llama_guard.finetuning_data_formatter import TrainingExample, Guidelines, Category, LlamaGuardPromptConfigs, LlamaGuardGenerationConfigs, ExplanationPosition, AugmentationConfigs, FormatterConfigs, create_formatted_finetuning_examples
@@ -102,18 +103,21 @@ def get_llamaguard_toxicchat_dataset(dataset_config, tokenizer, split, return_js
         random_seed=42
     )
 
-    dataset = dataset.map(lambda x: {"full_prompt": create_formatted_finetuning_examples(
-        [TrainingExample(
-            prompt=x["user_input"],
-            response=None,
-            violated_category_codes = [] if x["toxicity"]==0 else [mapTcCategoriesToLGCategories(x["openai_moderation"])],
-            label="safe" if x["toxicity"]==0 else "unsafe",
-            explanation="The response contains violating information."
-        )],
-        formatter_configs)[0]}, 
-        remove_columns=list(dataset.features))
-
-    dataset = dataset.map(lambda x: tokenize_prompt_and_labels(x["full_prompt"], tokenizer), remove_columns=list(dataset.features))
+    def format_and_tokenize(batch):
+        full_prompts = [create_formatted_finetuning_examples(
+            [TrainingExample(
+                prompt=user_input,
+                response=None,
+                violated_category_codes = [] if toxicity==0 else [mapTcCategoriesToLGCategories(openai_moderation)],
+                label="safe" if toxicity==0 else "unsafe",
+                explanation="The response contains violating information."
+            )],
+            formatter_configs)[0]
+            for user_input, toxicity, openai_moderation in zip(batch["user_input"], batch["toxicity"], batch["openai_moderation"])]
+        return tokenize_prompt_and_labels(full_prompts, tokenizer)
+
+    # Batched formatting and tokenization, in dataset_config.num_proc processes
+    dataset = dataset.map(format_and_tokenize, remove_columns=list(dataset.features), **get_map_kwargs(dataset_config))
     return dataset
 
 def main(return_jsonl = False):
@@ -18,7 +18,8 @@ from llama_cookbook.configs import (
     quantization_config as QUANTIZATION_CONFIG,
     train_config as TRAIN_CONFIG,
 )
-from llama_cookbook.data.concatenator import ConcatDataset
+from llama_cookbook.data.eval_sampler import get_eval_subset
+from llama_cookbook.data.packing import PackedDataset
 from llama_cookbook.policies import AnyPrecisionAdamW, apply_fsdp_checkpointing
 
 from llama_cookbook.utils import fsdp_auto_wrap_policy
@@ -161,11 +162,16 @@ def main(**kwargs):
         model.language_model.supports_gradient_checkpointing = True
     elif config.model_type == "llama":
         is_vision = False
+        attn_implementation = "sdpa" if train_config.use_fast_kernels else None
+        if train_config.batching_strategy == "packing" and train_config.packing_position_ids:
+            # Packed chunks carry per document position ids and no attention mask, only the varlen path of
+            # flash_attention_2 keeps the documents of a chunk from attending to each other
+            attn_implementation = "flash_attention_2"
         model = LlamaForCausalLM.from_pretrained(
             train_config.model_name,
             quantization_config=bnb_config,
             use_cache=use_cache,
-            attn_implementation="sdpa" if train_config.use_fast_kernels else None,
+            attn_implementation=attn_implementation,
             device_map=(
                 "auto"
                 if train_config.quantization and not train_config.enable_fsdp
@@ -318,6 +324,7 @@ def main(**kwargs):
         dataset_processer,
         dataset_config,
         split="train",
+        cache_dir=train_config.tokenized_cache_dir,
     )
     if not train_config.enable_fsdp or rank == 0:
         print(f"--> Training Set Length = {len(dataset_train)}")
@@ -326,6 +333,7 @@ def main(**kwargs):
         dataset_processer,
         dataset_config,
         split="test",
+        cache_dir=train_config.tokenized_cache_dir,
     )
     if not train_config.enable_fsdp or rank == 0:
         print(f"--> Validation Set Length = {len(dataset_val)}")
@@ -334,8 +342,12 @@ def main(**kwargs):
         if is_vision:
             raise ValueError("Packing is not supported for vision datasets")
         else:
-            dataset_train = ConcatDataset(
-                dataset_train, chunk_size=train_config.context_length
+            dataset_train = PackedDataset(
+                dataset_train,
+                chunk_size=train_config.context_length,
+                strategy=train_config.packing_strategy,
+                position_ids=train_config.packing_position_ids,
+                pad_token_id=tokenizer.pad_token_id or 0,
             )
 
     train_dl_kwargs = get_dataloader_kwargs(
@@ -361,9 +373,14 @@ def main(**kwargs):
             if is_vision:
                 raise ValueError("Packing is not supported for vision datasets")
             else:
-                dataset_val = ConcatDataset(
-                    dataset_val, chunk_size=train_config.context_length
+                dataset_val = PackedDataset(
+                    dataset_val,
+                    chunk_size=train_config.context_length,
+                    strategy=train_config.packing_strategy,
+                    position_ids=train_config.packing_position_ids,
+                    pad_token_id=tokenizer.pad_token_id or 0,
                 )
+        dataset_val = get_eval_subset(dataset_val, train_config.eval_max_samples, train_config.seed)
 
         val_dl_kwargs = get_dataloader_kwargs(
             train_config, dataset_val, dataset_processer, "val"
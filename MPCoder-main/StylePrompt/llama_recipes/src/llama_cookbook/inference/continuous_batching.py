@@ -0,0 +1,365 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import numbers
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import torch
+from transformers import DynamicCache
+
+
+def _cache_to_tensors(cache):
+    # DynamicCache keeps its tensors in .layers since transformers 4.56, in key_cache/value_cache before
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def _tensors_to_cache(tensors):
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(tensors):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+def _left_pad(tensor, length, dim, value=0):
+    missing = length - tensor.shape[dim]
+    if missing == 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_full(shape, value), tensor], dim=dim)
+
+
+def sample_next_tokens(logits, temperature, top_k, top_p, do_sample):
+    """
+    Picks the next token of every row of logits (batch, vocab), each row with its own sampling parameters.
+    temperature, top_p (float) and top_k, do_sample (int/bool) are tensors of shape (batch,), top_k=0 disables top-k.
+    """
+    greedy = logits.argmax(dim=-1)
+    if not bool(do_sample.any()):
+        return greedy
+    logits = logits / temperature.clamp(min=1e-5).unsqueeze(-1)
+    sorted_logits, sorted_ids = logits.sort(dim=-1, descending=True)
+    ranks = torch.arange(logits.shape[-1], device=logits.device).unsqueeze(0)
+    top_k = torch.where(top_k > 0, top_k, logits.shape[-1])
+    sorted_logits = sorted_logits.masked_fill(ranks >= top_k.unsqueeze(-1), float("-inf"))
+    probs = sorted_logits.softmax(dim=-1)
+    # Drop the tokens outside of the nucleus, the most likely token is always kept
+    outside = probs.cumsum(dim=-1) - probs > top_p.unsqueeze(-1)
+    probs = probs.masked_fill(outside, 0.0)
+    sampled = sorted_ids.gather(-1, torch.multinomial(probs, 1)).squeeze(-1)
+    return torch.where(do_sample, sampled, greedy)
+
+
+@dataclass
+class GenerationRequest:
+    prompt_ids: List[int]
+    max_new_tokens: int = 100
+    temperature: float = 1.0
+    top_p: float = 1.0
+    top_k: int = 50
+    do_sample: bool = False
+    stop_token_ids: List[int] = field(default_factory=list)
+    output_ids: List[int] = field(default_factory=list)
+    finish_reason: Optional[str] = None
+    # Token ids are put here as they are generated, None marks the end of the generation
+    tokens: queue.Queue = field(default_factory=queue.Queue)
+    done: threading.Event = field(default_factory=threading.Event)
+
+
+class RequestHandle:
+    """Returned by ContinuousBatchingEngine.submit, streams or waits for the output of one request"""
+    def __init__(self, request, tokenizer):
+        self.request = request
+        self.tokenizer = tokenizer
+
+    def stream_tokens(self):
+        """Yields the generated token ids as soon as they are produced"""
+        while True:
+            token = self.request.tokens.get()
+            if token is None:
+                return
+            yield token
+
+    def stream(self):
+        """Yields the generated text in increments, decoding the whole output so multi-token characters stay intact"""
+        ids, text = [], ""
+        for token in self.stream_tokens():
+            ids.append(token)
+            new_text = self.tokenizer.decode(ids, skip_special_tokens=True)
+            if len(new_text) > len(text) and not new_text.endswith("�"):
+                yield new_text[len(text):]
+                text = new_text
+
+    def result(self, timeout=None):
+        """Waits for the request to finish and returns the generated text"""
+        if not self.request.done.wait(timeout):
+            raise TimeoutError("generation did not finish in time")
+        return self.tokenizer.decode(self.request.output_ids, skip_special_tokens=True)
+
+    @property
+    def output_ids(self):
+        return self.request.output_ids
+
+    @property
+    def finish_reason(self):
+        return self.request.finish_reason
+
+
+class ContinuousBatchingEngine:
+    """
+    Serves many generation requests concurrently with a single running decode batch.
+
+    A background thread runs the decode loop. Between two decode steps, new requests are prefilled together
+    and admitted into the running batch, and finished sequences are evicted. Sequences are left-padded in the
+    shared KV cache, every sequence keeps its own positions and sampling parameters.
+    """
+    def __init__(self, model, tokenizer, max_batch_size: int = 32, max_prefill_batch_size: int = 8):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_prefill_batch_size = max_prefill_batch_size
+        self.device = next(model.parameters()).device
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+        eos = getattr(getattr(model, "generation_config", None), "eos_token_id", None)
+        if eos is None:
+            eos = tokenizer.eos_token_id
+        self.eos_token_ids = [eos] if isinstance(eos, int) else list(eos or [])
+
+        self.waiting = queue.Queue()
+        self.running = []
+        self.cache = None
+        self.attention_mask = None
+        self.positions = None
+        self.next_tokens = None
+        self.stopped = threading.Event()
+        self.thread = None
+        # Serializes submit and stop, so that no request is queued after stop aborted the waiting ones
+        self.lock = threading.Lock()
+
+    def _start_thread(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def start(self):
+        with self.lock:
+            self.stopped.clear()
+            self._start_thread()
+        return self
+
+    def stop(self):
+        """Stops the decode loop and finishes the requests still running or waiting with finish_reason='abort'"""
+        with self.lock:
+            self.stopped.set()
+            self.waiting.put(None)
+            if self.thread is not None:
+                self.thread.join()
+                self.thread = None
+            for request in self.running:
+                self._finish(request, "abort")
+            self.running = []
+            self.cache = self.attention_mask = self.positions = self.next_tokens = None
+            while True:
+                try:
+                    request = self.waiting.get_nowait()
+                except queue.Empty:
+                    break
+                if request is not None:
+                    self._finish(request, "abort")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def encode_prompt(self, prompt) -> List[int]:
+        """Returns the token ids of a prompt (text or token ids), raises ValueError if it is empty or not token ids"""
+        if isinstance(prompt, str):
+            prompt = self.tokenizer(prompt, add_special_tokens=True)["input_ids"]
+        try:
+            prompt = list(prompt)
+        except TypeError:
+            raise ValueError("a prompt must be a string or a list of integer token ids")
+        # A malformed prompt is rejected here, in the loop its prefill would fail with the requests batched with it
+        if not prompt:
+            raise ValueError("the prompt is empty")
+        if not all(isinstance(t, numbers.Integral) and not isinstance(t, bool) for t in prompt):
+            raise ValueError("a prompt must be a string or a list of integer token ids")
+        return [int(t) for t in prompt]
+
+    def submit(self, prompt, **generation_kwargs) -> RequestHandle:
+        """Queues a prompt (text or token ids) for generation, generation_kwargs are the fields of GenerationRequest"""
+        request = GenerationRequest(prompt_ids=self.encode_prompt(prompt), **generation_kwargs)
+        request.stop_token_ids = list(request.stop_token_ids) + self.eos_token_ids
+        with self.lock:
+            if self.stopped.is_set():
+                raise RuntimeError("the engine is stopped, call start() before submitting new requests")
+            # The engine starts on the first request when it was not started explicitly
+            self._start_thread()
+            self.waiting.put(request)
+        return RequestHandle(request, self.tokenizer)
+
+    def generate(self, prompts, **generation_kwargs) -> List[str]:
+        """Generates the completions of all prompts, batched together"""
+        handles = [self.submit(p, **generation_kwargs) for p in prompts]
+        return [h.result() for h in handles]
+
+    def _loop(self):
+        while not self.stopped.is_set():
+            # Block while there is nothing to decode
+            new_requests = []
+            if not self.running:
+                request = self.waiting.get()
+                if request is None:
+                    continue
+                new_requests.append(request)
+            while len(self.running) + len(new_requests) < self.max_batch_size:
+                try:
+                    request = self.waiting.get_nowait()
+                except queue.Empty:
+                    break
+                if request is not None:
+                    new_requests.append(request)
+            with torch.no_grad():
+                for i in range(0, len(new_requests), self.max_prefill_batch_size):
+                    requests = new_requests[i:i + self.max_prefill_batch_size]
+                    try:
+                        self._admit(requests)
+                    except Exception as e:
+                        # _admit only updates the running batch once it succeeded, only these requests fail
+                        print(f"prefill failed: {e}")
+                        for request in requests:
+                            self._finish(request, "error")
+                if not self.running:
+                    continue
+                try:
+                    self._decode_step()
+                except Exception as e:
+                    # The decode step is shared, fail the requests in flight instead of leaving their callers waiting forever
+                    print(f"generation step failed: {e}")
+                    for request in self.running:
+                        self._finish(request, "error")
+                    self.running = []
+                    self.cache = self.attention_mask = self.positions = self.next_tokens = None
+
+    def _finish(self, request, reason):
+        if request.done.is_set():
+            return
+        request.finish_reason = reason
+        request.tokens.put(None)
+        request.done.set()
+
+    def _emit(self, requests, tokens):
+        """Appends the new tokens to their requests, returns the mask of the sequences that are still running"""
+        keep = []
+        for request, token in zip(requests, tokens.tolist()):
+            request.output_ids.append(token)
+            request.tokens.put(token)
+            if token in request.stop_token_ids:
+                self._finish(request, "stop")
+            elif len(request.output_ids) >= request.max_new_tokens:
+                self._finish(request, "length")
+            keep.append(not request.done.is_set())
+        return keep
+
+    def _sampling_params(self, requests):
+        def tensor(name, dtype):
+            return torch.tensor([getattr(r, name) for r in requests], dtype=dtype, device=self.device)
+        return (
+            tensor("temperature", torch.float32),
+            tensor("top_k", torch.long),
+            tensor("top_p", torch.float32),
+            tensor("do_sample", torch.bool),
+        )
+
+    def _admit(self, requests):
+        """Prefills the prompts of new requests as one left-padded batch and merges them into the running batch"""
+        length = max(len(r.prompt_ids) for r in requests)
+        input_ids = torch.tensor(
+            [[self.pad_token_id] * (length - len(r.prompt_ids)) + r.prompt_ids for r in requests], device=self.device
+        )
+        attention_mask = torch.tensor(
+            [[0] * (length - len(r.prompt_ids)) + [1] * len(r.prompt_ids) for r in requests], device=self.device
+        )
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=DynamicCache(),
+            use_cache=True,
+        )
+        tokens = sample_next_tokens(outputs.logits[:, -1, :].float(), *self._sampling_params(requests))
+        keep = self._emit(requests, tokens)
+        keep_ids = [i for i, k in enumerate(keep) if k]
+        if not keep_ids:
+            return
+
+        tensors = _cache_to_tensors(outputs.past_key_values)
+        index = torch.tensor(keep_ids, device=self.device)
+        tensors = [(k.index_select(0, index), v.index_select(0, index)) for k, v in tensors]
+        attention_mask = attention_mask.index_select(0, index)
+        positions = position_ids[:, -1].index_select(0, index) + 1
+        tokens = tokens.index_select(0, index)
+        requests = [requests[i] for i in keep_ids]
+
+        if self.running:
+            # Left-pad the shorter of both caches so the sequences line up at the right
+            length = max(attention_mask.shape[1], self.attention_mask.shape[1])
+            running = _cache_to_tensors(self.cache)
+            tensors = [
+                (torch.cat([_left_pad(rk, length, 2), _left_pad(k, length, 2)]),
+                 torch.cat([_left_pad(rv, length, 2), _left_pad(v, length, 2)]))
+                for (rk, rv), (k, v) in zip(running, tensors)
+            ]
+            attention_mask = torch.cat([_left_pad(self.attention_mask, length, 1), _left_pad(attention_mask, length, 1)])
+            positions = torch.cat([self.positions, positions])
+            tokens = torch.cat([self.next_tokens, tokens])
+            requests = self.running + requests
+
+        self.cache = _tensors_to_cache(tensors)
+        self.attention_mask = attention_mask
+        self.positions = positions
+        self.next_tokens = tokens
+        self.running = requests
+
+    def _decode_step(self):
+        attention_mask = torch.cat([self.attention_mask, self.attention_mask.new_ones((len(self.running), 1))], dim=1)
+        outputs = self.model(
+            input_ids=self.next_tokens.unsqueeze(-1),
+            attention_mask=attention_mask,
+            position_ids=self.positions.unsqueeze(-1),
+            past_key_values=self.cache,
+            use_cache=True,
+        )
+        tokens = sample_next_tokens(outputs.logits[:, -1, :].float(), *self._sampling_params(self.running))
+        keep = self._emit(self.running, tokens)
+
+        self.cache = outputs.past_key_values
+        self.attention_mask = attention_mask
+        self.positions = self.positions + 1
+        self.next_tokens = tokens
+        if all(keep):
+            return
+
+        # Evict the finished sequences and the padding columns nobody needs anymore
+        index = torch.tensor([i for i, k in enumerate(keep) if k], device=self.device)
+        self.running = [r for r, k in zip(self.running, keep) if k]
+        if not self.running:
+            self.cache = self.attention_mask = self.positions = self.next_tokens = None
+            return
+        attention_mask = self.attention_mask.index_select(0, index)
+        start = int(attention_mask.any(dim=0).int().argmax())
+        self.cache = _tensors_to_cache([
+            (k.index_select(0, index)[:, :, start:], v.index_select(0, index)[:, :, start:])
+            for k, v in _cache_to_tensors(self.cache)
+        ])
+        self.attention_mask = attention_mask[:, start:]
+        self.positions = self.positions.index_select(0, index)
+        self.next_tokens = self.next_tokens.index_select(0, index)
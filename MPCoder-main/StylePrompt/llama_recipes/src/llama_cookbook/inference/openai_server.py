@@ -0,0 +1,157 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+# Minimal OpenAI compatible HTTP API (/v1/completions, /v1/chat/completions, /v1/models) on top of a ContinuousBatchingEngine
+
+import itertools
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _generation_kwargs(body, default_max_tokens):
+    temperature = float(body.get("temperature", 1.0))
+    return {
+        "max_new_tokens": int(body.get("max_tokens") or default_max_tokens),
+        "temperature": temperature,
+        "top_p": float(body.get("top_p", 1.0)),
+        "top_k": int(body.get("top_k", 0)),
+        "do_sample": temperature > 0,
+    }
+
+
+def make_handler(engine, model_name, default_max_tokens=256):
+    ids = itertools.count()
+
+    class OpenAIHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/v1/models":
+                self._send_json(200, {"object": "list", "data": [{"id": model_name, "object": "model"}]})
+            else:
+                self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+        def do_POST(self):
+            path = self.path.rstrip("/")
+            if path not in ("/v1/completions", "/v1/chat/completions"):
+                self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                chat = path == "/v1/chat/completions"
+                if chat:
+                    text = engine.tokenizer.apply_chat_template(body["messages"], add_generation_prompt=True, tokenize=False)
+                    prompts = [engine.tokenizer(text, add_special_tokens=False)["input_ids"]]
+                else:
+                    prompts = body["prompt"]
+                    # A prompt is a string or a list of token ids, a batch is a list of prompts
+                    if isinstance(prompts, str) or (prompts and isinstance(prompts[0], int)):
+                        prompts = [prompts]
+                    if not isinstance(prompts, list) or not prompts:
+                        raise ValueError("prompt must be a string, a list of token ids or a non empty list of them")
+                kwargs = _generation_kwargs(body, default_max_tokens)
+                # All prompts are checked before any is submitted, so an invalid one does not leave the others generating
+                prompts = [engine.encode_prompt(p) for p in prompts]
+                handles = [engine.submit(p, **kwargs) for p in prompts]
+            except (KeyError, ValueError, TypeError) as e:
+                self._send_json(400, {"error": {"message": f"invalid request: {e}"}})
+                return
+            except RuntimeError as e:
+                # The engine is stopped
+                self._send_json(503, {"error": {"message": str(e)}})
+                return
+
+            request_id = f"{'chatcmpl' if chat else 'cmpl'}-{next(ids)}"
+            if body.get("stream", False):
+                self._stream(request_id, handles, chat)
+                return
+
+            choices = []
+            for i, handle in enumerate(handles):
+                text = handle.result()
+                choice = {"index": i, "finish_reason": handle.finish_reason}
+                if chat:
+                    choice["message"] = {"role": "assistant", "content": text}
+                else:
+                    choice["text"] = text
+                choices.append(choice)
+            completion_tokens = sum(len(h.output_ids) for h in handles)
+            prompt_tokens = sum(len(h.request.prompt_ids) for h in handles)
+            self._send_json(200, {
+                "id": request_id,
+                "object": "chat.completion" if chat else "text_completion",
+                "created": int(time.time()),
+                "model": model_name,
+                "choices": choices,
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+
+        def _stream(self, request_id, handles, chat):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            def event(index, delta, finish_reason=None):
+                choice = {"index": index, "finish_reason": finish_reason}
+                if chat:
+                    choice["delta"] = {"content": delta} if delta else {}
+                else:
+                    choice["text"] = delta
+                payload = {
+                    "id": request_id,
+                    "object": "chat.completion.chunk" if chat else "text_completion",
+                    "created": int(time.time()),
+                    "model": model_name,
+                    "choices": [choice],
+                }
+                self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+                self.wfile.flush()
+
+            # Every prompt of the request streams its own choice, the deltas are sent in the order they are generated
+            deltas = queue.Queue()
+
+            def forward(index, handle):
+                for delta in handle.stream():
+                    deltas.put((index, delta))
+                deltas.put((index, None))
+
+            for index, handle in enumerate(handles):
+                threading.Thread(target=forward, args=(index, handle), daemon=True).start()
+            remaining = len(handles)
+            while remaining:
+                index, delta = deltas.get()
+                if delta is None:
+                    event(index, "", handles[index].finish_reason)
+                    remaining -= 1
+                else:
+                    event(index, delta)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return OpenAIHandler
+
+
+def create_server(engine, model_name, host="0.0.0.0", port=8000, default_max_tokens=256):
+    """Returns a threading HTTP server, every connection gets its own thread and all of them share the engine"""
+    return ThreadingHTTPServer((host, port), make_handler(engine, model_name, default_max_tokens))
@@ -2,23 +2,41 @@
 # This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
 
 import os
+import queue
+import threading
+import time
 import torch
 import warnings
 from typing import List
 from string import Template
 from enum import Enum
+from concurrent.futures import Future
 
 
 class AgentType(Enum):
     AGENT = "Agent"
     USER = "User"
 
+
+class SafetyChecker(object):
+    """
+    Base class of the safety checkers. A checker is called with one text and returns a (method, is_safe, report) tuple,
+    check_many returns one such tuple per text. Checkers which can score several texts in one pass override check_many.
+    """
+    def __call__(self, output_text, **kwargs):
+        return self.check_many([output_text], **kwargs)[0]
+
+    def check_many(self, texts, agent_type=AgentType.USER, user_prompts=None):
+        user_prompts = user_prompts or [""] * len(texts)
+        return [self(text, agent_type=agent_type, user_prompt=user_prompt) for text, user_prompt in zip(texts, user_prompts)]
+
+
 # Class for performing safety checks using AuditNLG library
-class AuditNLGSensitiveTopics(object):
+class AuditNLGSensitiveTopics(SafetyChecker):
     def __init__(self):
         pass
 
-    def __call__(self, output_text, **kwargs):
+    def check_many(self, texts, **kwargs):
         try:
             from auditnlg.safety.exam import safety_scores
         except ImportError as e:
@@ -26,60 +44,67 @@ class AuditNLGSensitiveTopics(object):
             raise e
 
 
-        data = [{"output": output_text}]
+        data = [{"output": output_text} for output_text in texts]
 
         result = safety_scores(data=data, method="sensitive_topics")
-        scores = result[1]["all_scores"][0]
-        is_safe = scores["pred_class"] == "none"
-        report = ""
-        if not is_safe:
-            report += f"Predicted class: {scores['pred_class']}\n"
-            report += "|" + "|".join(f"{n:^10}" for n in [list(k.keys())[0] for k in scores["class_scores"]]) + "|\n"
-            report += "|" + "|".join(f"{n:^10.5}" for n in [list(k.values())[0] for k in scores["class_scores"]]) + "|\n"
-        return "Sensitive Topics", is_safe, report
-
-
-class SalesforceSafetyChecker(object):
+        results = []
+        for scores in result[1]["all_scores"]:
+            is_safe = scores["pred_class"] == "none"
+            report = ""
+            if not is_safe:
+                report += f"Predicted class: {scores['pred_class']}\n"
+                report += "|" + "|".join(f"{n:^10}" for n in [list(k.keys())[0] for k in scores["class_scores"]]) + "|\n"
+                report += "|" + "|".join(f"{n:^10.5}" for n in [list(k.values())[0] for k in scores["class_scores"]]) + "|\n"
+            results.append(("Sensitive Topics", is_safe, report))
+        return results
+
+
+class SalesforceSafetyChecker(SafetyChecker):
     def __init__(self):
-        pass
-
-    def __call__(self, output_text, **kwargs):
         from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, AutoConfig
 
         config = AutoConfig.from_pretrained("Salesforce/safety-flan-t5-base")
-        tokenizer = AutoTokenizer.from_pretrained("Salesforce/safety-flan-t5-base")
-        model = AutoModelForSeq2SeqLM.from_pretrained("Salesforce/safety-flan-t5-base", config=config)
-        model.eval()
+        self.tokenizer = AutoTokenizer.from_pretrained("Salesforce/safety-flan-t5-base")
+        self.model = AutoModelForSeq2SeqLM.from_pretrained("Salesforce/safety-flan-t5-base", config=config)
+        self.model.eval()
 
+    def check_many(self, texts, **kwargs):
         prefix = "Is the <Text> field safe or unsafe?"
-        input_ids = tokenizer(prefix + " <Text> " + output_text + " <Context> ", return_tensors="pt").input_ids
+        batch = self.tokenizer(
+            [prefix + " <Text> " + output_text + " <Context> " for output_text in texts],
+            padding=True,
+            return_tensors="pt",
+        )
 
-        if len(input_ids[0]) > 512:
+        if int(batch.attention_mask.sum(dim=1).max()) > 512:
             warnings.warn(
                 "Input length is > 512 token. Safety check result could be incorrect."
             )
 
         with torch.no_grad():
-            outputs = model.generate(
-                input_ids,
+            outputs = self.model.generate(
+                **batch.to(self.model.device),
                 output_scores=True,
                 return_dict_in_generate=True,
                 max_new_tokens=20,
                 )
 
-        is_safe = tokenizer.decode(outputs.sequences[0], skip_special_tokens=True).split(" ")[0] == "safe"
+        true_false_ids = self.tokenizer("true false").input_ids[:2]
+        keys = ["toxicity", "hate", "identity", "violence", "physical", "sexual", "profanity", "biased"]
+        results = []
+        for row, sequence in enumerate(outputs.sequences):
+            is_safe = self.tokenizer.decode(sequence, skip_special_tokens=True).split(" ")[0] == "safe"
 
-        report = ""
-        if not is_safe:
-            true_false_ids = tokenizer("true false").input_ids[:2]
-            keys = ["toxicity", "hate", "identity", "violence", "physical", "sexual", "profanity", "biased"]
-            scores = {}
-            for k, i in zip(keys, range(3,20,2)):
-                scores[k] = round(outputs.scores[i][0,true_false_ids].softmax(dim=0)[0].item(), 5)
+            report = ""
+            if not is_safe:
+                scores = {}
+                for k, i in zip(keys, range(3, min(20, len(outputs.scores)), 2)):
+                    scores[k] = round(outputs.scores[i][row, true_false_ids].softmax(dim=0)[0].item(), 5)
 
-            report += "|" + "|".join(f"{n:^10}" for n in scores.keys()) + "|\n"
-            report += "|" + "|".join(f"{n:^10}" for n in scores.values()) + "|\n"
-        return "Salesforce Content Safety Flan T5 Base", is_safe, report
+                report += "|" + "|".join(f"{n:^10}" for n in scores.keys()) + "|\n"
+                report += "|" + "|".join(f"{n:^10}" for n in scores.values()) + "|\n"
+            results.append(("Salesforce Content Safety Flan T5 Base", is_safe, report))
+        return results
 
 
     def get_total_length(self, data):
@@ -90,7 +115,7 @@ class SalesforceSafetyChecker(object):
 
 
 # Class for performing safety checks using Azure Content Safety service
-class AzureSaftyChecker(object):
+class AzureSaftyChecker(SafetyChecker):
     def __init__(self):
         try:
             from azure.ai.contentsafety import ContentSafetyClient
@@ -154,7 +179,7 @@ class AzureSaftyChecker(object):
 
         return "Azure Content Safety API", is_safe, report
 
-class LlamaGuardSafetyChecker(object):
+class LlamaGuardSafetyChecker(SafetyChecker):
 
     def __init__(self):
         from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
@@ -167,43 +192,72 @@ class LlamaGuardSafetyChecker(object):
         self.tokenizer = AutoTokenizer.from_pretrained(model_id)
         self.model = AutoModelForCausalLM.from_pretrained(model_id, quantization_config=quantization_config, device_map="auto")
 
-    def __call__(self, output_text, **kwargs):
-
-        agent_type = kwargs.get('agent_type', AgentType.USER)
-        user_prompt = kwargs.get('user_prompt', "")
-
+    def _build_chat(self, output_text, agent_type, user_prompt):
         model_prompt = output_text.strip()
         if(agent_type == AgentType.AGENT):
             if user_prompt == "":
-                print("empty user prompt for agent check, returning unsafe")
-                return "Llama Guard", False, "Missing user_prompt from Agent response check"
-            else:
-                model_prompt = model_prompt.replace(user_prompt, "")
-                user_prompt = f"User: {user_prompt}"
-                agent_prompt = f"Agent: {model_prompt}"
-                chat = [
-                    {"role": "user", "content": user_prompt},
-                    {"role": "assistant", "content": agent_prompt},
-                ]
-        else:
-            chat = [
-                {"role": "user", "content": model_prompt},
+                return None
+            model_prompt = model_prompt.replace(user_prompt, "")
+            user_prompt = f"User: {user_prompt}"
+            agent_prompt = f"Agent: {model_prompt}"
+            return [
+                {"role": "user", "content": user_prompt},
+                {"role": "assistant", "content": agent_prompt},
             ]
+        return [
+            {"role": "user", "content": model_prompt},
+        ]
+
+    def __call__(self, output_text, **kwargs):
+        agent_type = kwargs.get('agent_type', AgentType.USER)
+        user_prompt = kwargs.get('user_prompt', "")
+        return self.check_many([output_text], agent_type=agent_type, user_prompts=[user_prompt])[0]
+
+    def check_many(self, texts, agent_type=AgentType.USER, user_prompts=None):
+        user_prompts = user_prompts or [""] * len(texts)
+        chats = [self._build_chat(text, agent_type, user_prompt) for text, user_prompt in zip(texts, user_prompts)]
+        results = [("Llama Guard", False, "Missing user_prompt from Agent response check")] * len(texts)
+        if any(chat is None for chat in chats):
+            print("empty user prompt for agent check, returning unsafe")
+
+        to_check = [i for i, chat in enumerate(chats) if chat is not None]
+        if not to_check:
+            return results
+        prompts = [self.tokenizer.apply_chat_template(chats[i], tokenize=False) for i in to_check]
+        # Left padding keeps the generated tokens of all rows at the same offset
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        batch = self.tokenizer(prompts, padding=True, add_special_tokens=False, return_tensors="pt").to(self.model.device)
+        prompt_len = batch["input_ids"].shape[-1]
+        with torch.no_grad():
+            output = self.model.generate(**batch, max_new_tokens=100, pad_token_id=self.tokenizer.pad_token_id)
+
+        for i, row in zip(to_check, output):
+            result = self.tokenizer.decode(row[prompt_len:], skip_special_tokens=True)
+
+            splitted_result = result.split("\n")[0];
+            is_safe = splitted_result == "safe"
 
-        input_ids = self.tokenizer.apply_chat_template(chat, return_tensors="pt").to("cuda")
-        prompt_len = input_ids.shape[-1]
-        output = self.model.generate(input_ids=input_ids, max_new_tokens=100, pad_token_id=0)
-        result = self.tokenizer.decode(output[0][prompt_len:], skip_special_tokens=True)
+            report = result
 
-        splitted_result = result.split("\n")[0];
-        is_safe = splitted_result == "safe"
+            results[i] = ("Llama Guard", is_safe, report)
+        return results
 
-        report = result
 
-        return "Llama Guard", is_safe, report
+# Process wide registry of the loaded safety checkers, every checker (and its model) is created once and reused
+_SAFETY_CHECKERS = {}
+_SAFETY_CHECKERS_LOCK = threading.Lock()
+
+
+def load_safety_checker(checker_class):
+    """Returns the shared instance of checker_class, loading it on first use"""
+    with _SAFETY_CHECKERS_LOCK:
+        if checker_class not in _SAFETY_CHECKERS:
+            _SAFETY_CHECKERS[checker_class] = checker_class()
+        return _SAFETY_CHECKERS[checker_class]
 
 
-# Function to load the PeftModel for performance optimization
 # Function to determine which safety checker to use based on the options selected
 def get_safety_checker(enable_azure_content_safety,
                        enable_sensitive_topics,
@@ -211,12 +265,141 @@ def get_safety_checker(enable_azure_content_safety,
                        enable_llamaguard_content_safety):
     safety_checker = []
     if enable_azure_content_safety:
-        safety_checker.append(AzureSaftyChecker())
+        safety_checker.append(load_safety_checker(AzureSaftyChecker))
     if enable_sensitive_topics:
-        safety_checker.append(AuditNLGSensitiveTopics())
+        safety_checker.append(load_safety_checker(AuditNLGSensitiveTopics))
     if enable_salesforce_content_safety:
-        safety_checker.append(SalesforceSafetyChecker())
+        safety_checker.append(load_safety_checker(SalesforceSafetyChecker))
     if enable_llamaguard_content_safety:
-        safety_checker.append(LlamaGuardSafetyChecker())
+        safety_checker.append(load_safety_checker(LlamaGuardSafetyChecker))
     return safety_checker
 
+
+def check_many(safety_checker, texts, **kwargs):
+    """
+    Runs every checker of safety_checker on a batch of texts.
+    Returns one list of (method, is_safe, report) tuples per text, in the order of safety_checker.
+    """
+    per_checker = [check.check_many(texts, **kwargs) for check in safety_checker]
+    return [list(results) for results in zip(*per_checker)] if per_checker else [[] for _ in texts]
+
+
+class _CheckerBatcher(object):
+    """Runs one checker on its own thread, texts submitted close together are checked in one check_many call"""
+    def __init__(self, checker, max_batch_size, max_wait):
+        self.checker = checker
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, text, agent_type, user_prompt):
+        future = Future()
+        self.queue.put((text, agent_type, user_prompt, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            for agent_type in {item[1] for item in batch}:
+                items = [item for item in batch if item[1] == agent_type]
+                try:
+                    results = self.checker.check_many(
+                        [text for text, _, _, _ in items],
+                        agent_type=agent_type,
+                        user_prompts=[user_prompt for _, _, user_prompt, _ in items],
+                    )
+                except Exception as e:
+                    for item in items:
+                        item[3].set_exception(e)
+                    continue
+                for item, result in zip(items, results):
+                    item[3].set_result(result)
+
+
+class PendingSafetyCheck(object):
+    """The running checks of one text, result() returns the (method, is_safe, report) tuple of every checker"""
+    def __init__(self, futures):
+        self.futures = futures
+
+    def done(self):
+        return all(f.done() for f in self.futures)
+
+    def result(self, timeout=None):
+        return [f.result(timeout) for f in self.futures]
+
+
+class SafetyPipeline(object):
+    """
+    Checks texts with all checkers concurrently: every checker runs on its own thread, so a check takes as long as
+    the slowest checker instead of the sum of all of them. Texts submitted within max_wait seconds of each other,
+    e.g. by concurrent requests, are batched into a single check_many call per checker.
+    """
+    def __init__(self, safety_checker, max_batch_size=16, max_wait=0.005):
+        self.batchers = [_CheckerBatcher(check, max_batch_size, max_wait) for check in safety_checker]
+
+    def submit(self, text, agent_type=AgentType.USER, user_prompt=""):
+        return PendingSafetyCheck([b.submit(text, agent_type, user_prompt) for b in self.batchers])
+
+    def check(self, text, agent_type=AgentType.USER, user_prompt=""):
+        return self.submit(text, agent_type, user_prompt).result()
+
+    def stream(self, agent_type=AgentType.AGENT, user_prompt="", min_new_chars=200):
+        return StreamingSafetyCheck(self, agent_type, user_prompt, min_new_chars)
+
+
+class StreamingSafetyCheck(object):
+    """
+    Checks a model output while it is generated. feed() is called with the output so far and starts a new check
+    every min_new_chars characters when the previous one is done, unsafe tells if any of them failed so generation
+    can be stopped early. finish() checks the final output, reusing the last partial check if the text is unchanged.
+    """
+    def __init__(self, pipeline, agent_type, user_prompt, min_new_chars):
+        self.pipeline = pipeline
+        self.agent_type = agent_type
+        self.user_prompt = user_prompt
+        self.min_new_chars = min_new_chars
+        self.pending = None
+        self.pending_text = ""
+        self.unsafe_results = None
+
+    def _collect(self):
+        if self.pending is not None and self.pending.done() and self.unsafe_results is None:
+            results = self.pending.result()
+            if not all(r[1] for r in results):
+                self.unsafe_results = results
+
+    def feed(self, text):
+        self._collect()
+        if len(text) - len(self.pending_text) < self.min_new_chars:
+            return
+        if self.pending is None or self.pending.done():
+            self.pending = self.pipeline.submit(text, self.agent_type, self.user_prompt)
+            self.pending_text = text
+
+    @property
+    def unsafe(self):
+        self._collect()
+        return self.unsafe_results is not None
+
+    def finish(self, text):
+        if self.pending is not None and self.pending_text == text:
+            results = self.pending.result()
+        else:
+            results = self.pipeline.check(text, self.agent_type, self.user_prompt)
+        self._collect()
+        if self.unsafe_results is not None and all(r[1] for r in results):
+            return self.unsafe_results
+        return results
@@ -10,5 +10,8 @@ from llama_cookbook.model_checkpointing.checkpoint_handler import (
     save_optimizer_checkpoint,
     save_model_and_optimizer_sharded,
     load_model_sharded,
-    load_sharded_model_single_gpu
+    load_sharded_model_single_gpu,
+    save_training_state,
+    load_training_state,
 )
+from llama_cookbook.model_checkpointing.async_checkpoint import wait_for_checkpoints
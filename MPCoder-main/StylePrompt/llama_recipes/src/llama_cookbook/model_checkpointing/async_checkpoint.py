@@ -0,0 +1,78 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import torch
+import torch.distributed as dist
+import torch.distributed.checkpoint as dcp
+
+
+def _to_host(obj):
+    """copy all device tensors of a (nested) state dict to pinned host memory, host tensors are kept as they are"""
+    if isinstance(obj, torch.Tensor):
+        if obj.device.type == "cpu":
+            return obj
+        host = torch.empty(obj.size(), dtype=obj.dtype, device="cpu", pin_memory=torch.cuda.is_available())
+        host.copy_(obj, non_blocking=True)
+        return host
+    if isinstance(obj, dict):
+        return {k: _to_host(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_host(v) for v in obj)
+    return obj
+
+
+class AsyncCheckpointer:
+    """
+    Writes checkpoints in the background while training continues.
+
+    The state is first copied to host memory, which is the only part training waits for. Only one checkpoint
+    is written at a time: every save first waits for the previous one to finish.
+    """
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = []
+        self.process_group = None
+
+    def wait(self):
+        """completion fence, blocks until all checkpoints started so far are on disk"""
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    def save(self, obj, path):
+        """torch.save obj to path from a background thread"""
+        self.wait()
+        host_obj = _to_host(obj)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        self.pending.append(self.executor.submit(torch.save, host_obj, path))
+
+    def save_state_dict(self, state_dict, storage_writer, planner=None):
+        """distributed checkpoint save of a sharded state dict, staged to host memory and written in the background"""
+        self.wait()
+        if not hasattr(dcp, "async_save"):
+            # torch < 2.3 has no async distributed checkpointing
+            dcp.save_state_dict(state_dict=state_dict, storage_writer=storage_writer, planner=planner)
+            return
+        if self.process_group is None and dist.is_initialized():
+            # The background thread runs collectives, they must not interleave with the NCCL ones of training
+            self.process_group = dist.new_group(backend="gloo")
+        self.pending.append(dcp.async_save(
+            state_dict,
+            storage_writer=storage_writer,
+            planner=planner,
+            process_group=self.process_group,
+        ))
+
+
+async_checkpointer = AsyncCheckpointer()
+
+
+def wait_for_checkpoints():
+    """blocks until all asynchronous checkpoints are written"""
+    t0 = time.perf_counter()
+    async_checkpointer.wait()
+    return time.perf_counter() - t0
@@ -3,6 +3,8 @@
 
 from pathlib import Path
 from datetime import datetime
+import os
+import shutil
 import torch
 import time
 
@@ -26,11 +28,13 @@ from torch.distributed.checkpoint.default_planner import (
 )
 
 
-from torch.distributed.checkpoint.state_dict import get_model_state_dict, StateDictOptions
+from torch.distributed.checkpoint.state_dict import get_model_state_dict, get_state_dict, set_state_dict, StateDictOptions
 from torch.distributed.fsdp.fully_sharded_data_parallel import StateDictType
 import torch.distributed._shard.checkpoint as dist_cp
 import torch.distributed as dist
 
+from llama_cookbook.model_checkpointing.async_checkpoint import async_checkpointer
+
 
 def get_date_of_run():
     """create date and time for file save uniqueness
@@ -110,16 +114,27 @@ def save_model_and_optimizer_sharded(model, rank, cfg,optim=None):
         if optim is not None:
             state_dict["optim"] = FSDP.optim_state_dict(model, optim)
 
-        dist_cp.save_state_dict(
-            state_dict=state_dict,
-            storage_writer=distributed_writer,
-            planner=DefaultSavePlanner(),
-            
-        )
+        if getattr(cfg, "async_checkpointing", False):
+            # returns once the shards are copied to host memory, the files are written in the background
+            async_checkpointer.save_state_dict(
+                state_dict=state_dict,
+                storage_writer=distributed_writer,
+                planner=DefaultSavePlanner(),
+            )
+        else:
+            dist_cp.save_state_dict(
+                state_dict=state_dict,
+                storage_writer=distributed_writer,
+                planner=DefaultSavePlanner(),
+                
+            )
     dist.barrier()
     t1 = time.perf_counter()
     if rank == 0:
-        print(f"Sharded state checkpoint saved to {save_dir}")
+        if getattr(cfg, "async_checkpointing", False):
+            print(f"Sharded state checkpoint is being saved to {save_dir} in the background")
+        else:
+            print(f"Sharded state checkpoint saved to {save_dir}")
         print(
             f"Checkpoint Time = {t1-t0:.4f}\n"
         )
@@ -156,10 +171,12 @@ def save_fsdp_model_checkpoint_full(
         save_full_path = str(save_dir) + "/" + save_name
 
         # save model
-        torch.save(cpu_state, save_full_path)
-
-        
-        print(f"model checkpoint saved for epoch {epoch} at {save_full_path}\n")
+        if getattr(cfg, "async_checkpointing", False):
+            async_checkpointer.save(cpu_state, save_full_path)
+            print(f"model checkpoint for epoch {epoch} is being saved at {save_full_path} in the background\n")
+        else:
+            torch.save(cpu_state, save_full_path)
+            print(f"model checkpoint saved for epoch {epoch} at {save_full_path}\n")
       
 
 
@@ -221,9 +238,13 @@ def save_optimizer_checkpoint(model, optimizer, rank, cfg, epoch=1):
 
         print(f"--> saving optimizer state...")
 
-        torch.save(optim_state, opt_save_full_path)
+        if getattr(cfg, "async_checkpointing", False):
+            async_checkpointer.save(optim_state, opt_save_full_path)
+            print(f"--> saving {opt_save_full_path} to disk in the background")
+        else:
+            torch.save(optim_state, opt_save_full_path)
 
-        print(f"--> saved {opt_save_full_path} to disk")
+            print(f"--> saved {opt_save_full_path} to disk")
 
 
 def load_optimizer_checkpoint(model, optimizer_checkpoint_path, rank):
@@ -287,4 +308,65 @@ def save_model_checkpoint(model, output_dir):
     state_dict = model.state_dict()
     
     torch.save(state_dict, output_file)
+
+
+def save_training_state(model, optimizer, train_state, save_dir, rank, enable_fsdp=False):
+    """
+    save a resumable training checkpoint: model, optimizer and the per rank train_state dict
+    (scheduler, scaler, RNG states and data position), in a step_<N> folder of save_dir.
+    The file "latest" points to the last complete checkpoint, older checkpoints are removed.
+    """
+    save_dir = Path(save_dir)
+    step_dir = save_dir / f"step_{train_state['total_train_steps']}"
+    step_dir.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+
+    if enable_fsdp:
+        model_state, optim_state = get_state_dict(model, optimizer)
+        dist_cp.save_state_dict(
+            state_dict={"model": model_state, "optim": optim_state},
+            storage_writer=FileSystemWriter(step_dir),
+            planner=DefaultSavePlanner(),
+        )
+    else:
+        torch.save({"model": model.state_dict(), "optim": optimizer.state_dict()}, step_dir / "model_and_optimizer.pt")
+    torch.save(train_state, step_dir / f"train_state_{rank}.pt")
+
+    if enable_fsdp:
+        dist.barrier()
+    if rank == 0:
+        latest = save_dir / "latest"
+        previous = latest.read_text().strip() if latest.is_file() else None
+        tmp = save_dir / "latest.tmp"
+        tmp.write_text(step_dir.name)
+        os.replace(tmp, latest)
+        if previous and previous != step_dir.name:
+            shutil.rmtree(save_dir / previous, ignore_errors=True)
+        print(f"training state saved to {step_dir} in {time.perf_counter() - t0:.4f}s")
+
+
+def load_training_state(model, optimizer, load_dir, rank, enable_fsdp=False):
+    """load a checkpoint written by save_training_state into model and optimizer, returns the train_state dict of this rank"""
+    load_dir = Path(load_dir)
+    latest = load_dir / "latest"
+    if latest.is_file():
+        load_dir = load_dir / latest.read_text().strip()
+    if rank == 0:
+        print(f"resuming training from {load_dir}")
+
+    if enable_fsdp:
+        model_state, optim_state = get_state_dict(model, optimizer)
+        state_dict = {"model": model_state, "optim": optim_state}
+        dist_cp.load_state_dict(
+            state_dict=state_dict,
+            storage_reader=FileSystemReader(load_dir),
+        )
+        set_state_dict(model, optimizer, model_state_dict=state_dict["model"], optim_state_dict=state_dict["optim"])
+    else:
+        checkpoint = torch.load(load_dir / "model_and_optimizer.pt", map_location="cpu")
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optim"])
+
+    # The train state holds RNG states and python objects
+    return torch.load(load_dir / f"train_state_{rank}.pt", weights_only=False)
     
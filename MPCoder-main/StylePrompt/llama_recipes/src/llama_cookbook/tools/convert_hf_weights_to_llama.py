@@ -2,13 +2,16 @@
 # This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
 
 import json
+import math
 import os
-from typing import List, Union
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Optional
 
 import fire
 import torch
+from huggingface_hub import snapshot_download
+from safetensors import safe_open
 from tqdm import tqdm
-from transformers import LlamaForCausalLM  # @manual
 
 NUM_SHARDS = {
     "7B": 1,
@@ -21,11 +24,62 @@ NUM_SHARDS = {
 }
 
 
-def write_model(model_path, model_size, output_base_path):
+class CheckpointReader:
+    """
+    Reads tensors of a Hugging Face checkpoint one at a time from memory mapped files, so the model is never loaded
+    as a whole. A shard of a tensor only reads its own slice from safetensors files.
+    """
+    def __init__(self, model_dir: str, dtype: torch.dtype = torch.bfloat16):
+        self.model_dir = model_dir
+        self.dtype = dtype
+        self._files = {}
+        self.weight_map = {}
+        for index_name in ("model.safetensors.index.json", "pytorch_model.bin.index.json"):
+            index_path = os.path.join(model_dir, index_name)
+            if os.path.isfile(index_path):
+                with open(index_path, "r") as f:
+                    self.weight_map = json.load(f)["weight_map"]
+                break
+        else:
+            for file_name in ("model.safetensors", "pytorch_model.bin"):
+                if os.path.isfile(os.path.join(model_dir, file_name)):
+                    self.weight_map = {name: file_name for name in self._open(file_name).keys()}
+                    break
+        if not self.weight_map:
+            raise FileNotFoundError(f"No safetensors or pytorch_model.bin checkpoint in {model_dir}")
+
+    def _open(self, file_name):
+        if file_name not in self._files:
+            path = os.path.join(self.model_dir, file_name)
+            if file_name.endswith(".safetensors"):
+                self._files[file_name] = safe_open(path, framework="pt", device="cpu")
+            else:
+                self._files[file_name] = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        return self._files[file_name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.weight_map
+
+    def get(self, name: str, dim: Optional[int] = None, index: int = 0, num_chunks: int = 1) -> torch.Tensor:
+        """Returns the chunk `index` of `num_chunks` along `dim` like torch.chunk, or the whole tensor if dim is None"""
+        opened = self._open(self.weight_map[name])
+        # pytorch_model.bin files are loaded as a dict of memory mapped tensors, both can be sliced the same way
+        tensor = opened[name] if isinstance(opened, dict) else opened.get_slice(name)
+        index_slices = (slice(None),)
+        if dim is not None:
+            size = tensor.shape[dim] if isinstance(opened, dict) else tensor.get_shape()[dim]
+            chunk_size = math.ceil(size / num_chunks)
+            index_slices = (slice(None),) * dim + (slice(index * chunk_size, min((index + 1) * chunk_size, size)),)
+        selected = tensor[index_slices]
+        # Copy out of the memory map, a view would save the whole storage of the checkpoint
+        return selected.to(self.dtype, copy=True).contiguous()
+
+
+def write_shard(model_dir: str, shard: int, params: Dict, num_shards: int, output_base_path: str, show_progress: bool = False) -> str:
+    """Converts and saves consolidated.{shard:02d}.pth, reading only the slices of the weights this shard holds"""
     dtype = torch.bfloat16
+    reader = CheckpointReader(model_dir, dtype)
 
-    params = json.load(open(os.path.join(output_base_path, "params.json"), "r"))
-    num_shards = NUM_SHARDS[model_size]
     n_layers = params["n_layers"]
     n_heads = params["n_heads"]
     n_heads_per_shard = n_heads // num_shards
@@ -36,136 +90,105 @@ def write_model(model_path, model_size, output_base_path):
     if "n_kv_heads" in params:
         num_key_value_heads = params["n_kv_heads"]  # for GQA / MQA
         num_local_key_value_heads = num_key_value_heads // num_shards
-        key_value_dim = dims_per_head * num_key_value_heads
     else:  # compatibility with other checkpoints
-        num_key_value_heads = n_heads
         num_local_key_value_heads = n_heads_per_shard
-        key_value_dim = dim
 
-    model = LlamaForCausalLM.from_pretrained(
-        model_path,
-        torch_dtype=dtype,
-        low_cpu_mem_usage=True,
-    )
-    loaded = model.state_dict()
-
-    # permute for sliced rotary
-    def permute(w, n_heads=n_heads, dim1=dim, dim2=dim):
+    # permute for sliced rotary, heads are permuted independently so each shard permutes its own heads
+    def permute(w, n_heads):
+        dim1, dim2 = w.shape
         return (
             w.view(n_heads, 2, dim1 // n_heads // 2, dim2)
             .transpose(1, 2)
             .reshape(dim1, dim2)
         )
 
-    state_dict = [{} for _ in range(num_shards)]
-
-    def insert(name: str, tensor: Union[List, torch.Tensor]):
-        for i in range(num_shards):
-            state_dict[i][name] = (
-                tensor[i].clone() if isinstance(tensor, list) else tensor
-            )
-
-    def insert_chunk(name: str, tensor: torch.Tensor, dim: int):
-        tensors = tensor.chunk(num_shards, dim=dim)
-        for i, tensor in enumerate(tensors):
-            state_dict[i][name] = tensor.clone()
+    def chunk(name: str, dim: int) -> torch.Tensor:
+        return reader.get(name, dim=dim, index=shard, num_chunks=num_shards)
 
+    state_dict = {}
     concat_dim = 0 if llama_version == 3 else 1
-    insert_chunk(
-        "tok_embeddings.weight", loaded["model.embed_tokens.weight"], concat_dim
-    )
-    insert("norm.weight", loaded["model.norm.weight"])
-    insert_chunk("output.weight", loaded["lm_head.weight"], 0)
-
-    for layer_i in tqdm(range(n_layers), desc="Converting layers"):
-
-        ts = (
-            permute(loaded[f"model.layers.{layer_i}.self_attn.q_proj.weight"])
-            .view(n_heads_per_shard * num_shards, dims_per_head, dim)
-            .chunk(num_shards, dim=0)
-        )
-        insert(f"layers.{layer_i}.attention.wq.weight", [t.view(-1, dim) for t in ts])
-
-        ts = (
-            permute(
-                loaded[f"model.layers.{layer_i}.self_attn.k_proj.weight"],
-                num_key_value_heads,
-                key_value_dim,
-                dim,
-            )
-            .view(num_local_key_value_heads * num_shards, dims_per_head, dim)
-            .chunk(num_shards, dim=0)
-        )
-        insert(f"layers.{layer_i}.attention.wk.weight", [t.view(-1, dim) for t in ts])
-
-        ts = (
-            loaded[f"model.layers.{layer_i}.self_attn.v_proj.weight"]
-            .view(num_local_key_value_heads * num_shards, dims_per_head, dim)
-            .chunk(num_shards, dim=0)
-        )
-        insert(f"layers.{layer_i}.attention.wv.weight", [t.view(-1, dim) for t in ts])
-
-        insert_chunk(
-            f"layers.{layer_i}.attention.wo.weight",
-            loaded[f"model.layers.{layer_i}.self_attn.o_proj.weight"],
-            1,
-        )
-
-        insert_chunk(
-            f"layers.{layer_i}.feed_forward.w1.weight",
-            loaded[f"model.layers.{layer_i}.mlp.gate_proj.weight"],
-            0,
-        )
-
-        insert_chunk(
-            f"layers.{layer_i}.feed_forward.w2.weight",
-            loaded[f"model.layers.{layer_i}.mlp.down_proj.weight"],
-            1,
+    state_dict["tok_embeddings.weight"] = chunk("model.embed_tokens.weight", concat_dim)
+    state_dict["norm.weight"] = reader.get("model.norm.weight")
+    # Checkpoints with tied embeddings do not store lm_head
+    lm_head = "lm_head.weight" if "lm_head.weight" in reader else "model.embed_tokens.weight"
+    state_dict["output.weight"] = chunk(lm_head, 0)
+
+    layers = range(n_layers)
+    if show_progress:
+        layers = tqdm(layers, desc="Converting layers")
+    for layer_i in layers:
+        prefix = f"model.layers.{layer_i}"
+        state_dict[f"layers.{layer_i}.attention.wq.weight"] = permute(
+            chunk(f"{prefix}.self_attn.q_proj.weight", 0), n_heads_per_shard
         )
-
-        insert_chunk(
-            f"layers.{layer_i}.feed_forward.w3.weight",
-            loaded[f"model.layers.{layer_i}.mlp.up_proj.weight"],
-            0,
+        state_dict[f"layers.{layer_i}.attention.wk.weight"] = permute(
+            chunk(f"{prefix}.self_attn.k_proj.weight", 0), num_local_key_value_heads
         )
+        state_dict[f"layers.{layer_i}.attention.wv.weight"] = chunk(f"{prefix}.self_attn.v_proj.weight", 0)
+        state_dict[f"layers.{layer_i}.attention.wo.weight"] = chunk(f"{prefix}.self_attn.o_proj.weight", 1)
+        state_dict[f"layers.{layer_i}.feed_forward.w1.weight"] = chunk(f"{prefix}.mlp.gate_proj.weight", 0)
+        state_dict[f"layers.{layer_i}.feed_forward.w2.weight"] = chunk(f"{prefix}.mlp.down_proj.weight", 1)
+        state_dict[f"layers.{layer_i}.feed_forward.w3.weight"] = chunk(f"{prefix}.mlp.up_proj.weight", 0)
+        state_dict[f"layers.{layer_i}.attention_norm.weight"] = reader.get(f"{prefix}.input_layernorm.weight")
+        state_dict[f"layers.{layer_i}.ffn_norm.weight"] = reader.get(f"{prefix}.post_attention_layernorm.weight")
 
-        insert(
-            f"layers.{layer_i}.attention_norm.weight",
-            loaded[f"model.layers.{layer_i}.input_layernorm.weight"],
-        )
-        insert(
-            f"layers.{layer_i}.ffn_norm.weight",
-            loaded[f"model.layers.{layer_i}.post_attention_layernorm.weight"],
-        )
     if llama_version != 3:
         base = 10000.0
         inv_freq = (
             1.0 / (base ** (torch.arange(0, dims_per_head, 2).float() / dims_per_head))
         ).to(dtype)
-        insert("rope.freqs", inv_freq)
+        state_dict["rope.freqs"] = inv_freq
 
-    for i in tqdm(range(num_shards), desc="Saving checkpoint shards"):
-        torch.save(
-            state_dict[i], os.path.join(output_base_path, f"consolidated.{i:02d}.pth")
-        )
+    path = os.path.join(output_base_path, f"consolidated.{shard:02d}.pth")
+    torch.save(state_dict, path)
+    return path
+
+
+def write_model(model_path, model_size, output_base_path, num_workers: int = 1):
+    """
+    Writes the consolidated shards one by one, or num_workers at a time in separate processes. Only the shards being
+    written are held in memory, peak RAM is about num_workers / num_shards of the model size.
+    """
+    params = json.load(open(os.path.join(output_base_path, "params.json"), "r"))
+    num_shards = NUM_SHARDS[model_size]
+    if os.path.isdir(model_path):
+        model_dir = model_path
+    else:
+        model_dir = snapshot_download(model_path, allow_patterns=["*.json", "*.safetensors"])
+
+    num_workers = max(1, min(num_workers, num_shards))
+    if num_workers == 1:
+        for shard in range(num_shards):
+            write_shard(model_dir, shard, params, num_shards, output_base_path, show_progress=True)
+        return
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(write_shard, model_dir, shard, params, num_shards, output_base_path)
+            for shard in range(num_shards)
+        ]
+        for future in tqdm(as_completed(futures), total=num_shards, desc="Saving checkpoint shards"):
+            future.result()
 
 
 def main(
     model_path: str,
     model_size: str,
     output_dir: str,
+    num_workers: int = 1,
 ):
     """Convert llama weights from huggingface format to consolidated format.
     params:
     model_path: model name or path to the model directory.
     model_size: Llama model size, one of 7B, 13B, 34B, 30B, 65B, 70B.
     output_dir: directory to save Llama weights, should contains params.json.
+    num_workers: number of shards converted in parallel, each holds one shard in memory.
     """
     assert model_size in NUM_SHARDS, f"Unknown model size {model_size}"
     params_path = os.path.join(output_dir, "params.json")
     assert os.path.isfile(params_path), f"{params_path} does not exist"
 
-    write_model(model_path, model_size, output_dir)
+    write_model(model_path, model_size, output_dir, num_workers)
 
 
 if __name__ == "__main__":
@@ -17,6 +17,8 @@ from transformers.data import DataCollatorForSeq2Seq
 
 from llama_cookbook.configs import datasets, lora_config, llama_adapter_config, prefix_config, train_config
 from llama_cookbook.data.sampler import LengthBasedBatchSampler, DistributedLengthBasedBatchSampler
+from llama_cookbook.data.eval_sampler import ShardedEvalBatchSampler
+from llama_cookbook.data.token_budget_sampler import TokenBudgetBatchSampler, DistributedTokenBudgetBatchSampler
 from llama_cookbook.datasets import DATASET_PREPROC
 
 def update_config(config, **kwargs):
@@ -90,6 +92,20 @@ def get_dataloader_kwargs(train_config, dataset, dataset_processer, mode):
         else:
             kwargs["batch_sampler"] = LengthBasedBatchSampler(dataset, batch_size, drop_last=True, shuffle=mode=="train")
         kwargs["collate_fn"] = DataCollatorForSeq2Seq(dataset_processer)
+    elif train_config.batching_strategy == "token_budget":
+        max_tokens = train_config.token_budget if train_config.token_budget > 0 else batch_size * train_config.context_length
+        if train_config.enable_fsdp:
+            kwargs["batch_sampler"] = DistributedTokenBudgetBatchSampler(
+                dataset,
+                max_tokens=max_tokens,
+                rank=dist.get_rank(),
+                num_replicas=dist.get_world_size(),
+                shuffle=mode=="train",
+                seed=train_config.seed,
+            )
+        else:
+            kwargs["batch_sampler"] = TokenBudgetBatchSampler(dataset, max_tokens, shuffle=mode=="train", seed=train_config.seed)
+        kwargs["collate_fn"] = DataCollatorForSeq2Seq(dataset_processer)
     elif train_config.batching_strategy == "packing":
         if train_config.enable_fsdp:
             kwargs["sampler"] = DistributedSampler(
@@ -104,6 +120,19 @@ def get_dataloader_kwargs(train_config, dataset, dataset_processer, mode):
         kwargs["collate_fn"] = default_data_collator
     else:
         raise ValueError(f"Unknown batching strategy: {train_config.batching_strategy}")
+
+    if mode != "train" and train_config.enable_fsdp:
+        # Shard the validation set across ranks instead of dropping or duplicating batches to even them out
+        for key in ("sampler", "batch_size", "drop_last"):
+            kwargs.pop(key, None)
+        kwargs["batch_sampler"] = ShardedEvalBatchSampler(
+            dataset,
+            batch_size=batch_size,
+            rank=dist.get_rank(),
+            num_replicas=dist.get_world_size(),
+            max_tokens=max_tokens if train_config.batching_strategy == "token_budget" else 0,
+            sort_by_length=train_config.batching_strategy != "packing",
+        )
     return kwargs
 
 
@@ -3,13 +3,15 @@
 
 import torch
 
-from llama_cookbook.data.concatenator import ConcatDataset
+from llama_cookbook.data.eval_sampler import get_eval_subset
+from llama_cookbook.data.packing import PackedDataset
+from llama_cookbook.data.token_cache import get_cached_dataset, get_token_cache_path
 from llama_cookbook.datasets import DATASET_PREPROC, DATALOADER_COLLATE_FUNC
 from llama_cookbook.utils.config_utils import get_dataloader_kwargs
 
 
 def get_preprocessed_dataset(
-    tokenizer, dataset_config, split: str = "train"
+    tokenizer, dataset_config, split: str = "train", cache_dir: str = None
 ) -> torch.utils.data.Dataset:
     if not dataset_config.dataset in DATASET_PREPROC:
         raise NotImplementedError(f"{dataset_config.dataset} is not (yet) implemented")
@@ -21,11 +23,19 @@ def get_preprocessed_dataset(
             else dataset_config.test_split
         )
 
-    return DATASET_PREPROC[dataset_config.dataset](
-        dataset_config,
-        tokenizer,
-        get_split(),
-    )
+    def build_dataset():
+        return DATASET_PREPROC[dataset_config.dataset](
+            dataset_config,
+            tokenizer,
+            get_split(),
+        )
+
+    if not cache_dir:
+        return build_dataset()
+
+    # Tokenize once into a memory-mapped cache keyed by dataset config and tokenizer
+    cache_path = get_token_cache_path(cache_dir, tokenizer, dataset_config, get_split())
+    return get_cached_dataset(build_dataset, cache_path)
 
 def get_custom_data_collator(
     dataset_processer, dataset_config
@@ -39,11 +49,19 @@ def get_custom_data_collator(
     )
 
 def get_dataloader(tokenizer, dataset_config, train_config, split: str = "train"):
-    dataset = get_preprocessed_dataset(tokenizer, dataset_config, split)
+    dataset = get_preprocessed_dataset(tokenizer, dataset_config, split, cache_dir=train_config.tokenized_cache_dir)
+    if split != "train":
+        dataset = get_eval_subset(dataset, train_config.eval_max_samples, train_config.seed)
     dl_kwargs = get_dataloader_kwargs(train_config, dataset, tokenizer, split)
     
     if split == "train" and train_config.batching_strategy == "packing":
-        dataset = ConcatDataset(dataset, chunk_size=train_config.context_length)
+        dataset = PackedDataset(
+            dataset,
+            chunk_size=train_config.context_length,
+            strategy=train_config.packing_strategy,
+            position_ids=train_config.packing_position_ids,
+            pad_token_id=tokenizer.pad_token_id or 0,
+        )
 
     # Create data loader
     dataloader = torch.utils.data.DataLoader(
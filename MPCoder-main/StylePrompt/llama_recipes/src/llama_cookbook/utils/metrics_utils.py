@@ -0,0 +1,120 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import json
+import queue
+import threading
+
+import torch
+
+METRIC_NAMES = [
+    "train_step_loss",
+    "train_epoch_loss",
+    "train_step_perplexity",
+    "train_epoch_perplexity",
+    "val_step_loss",
+    "val_epoch_loss",
+    "val_step_perplexity",
+    "val_epoch_perplexity",
+]
+
+
+class StepLossBuffer:
+    """
+    Keeps per-step losses on the device in a preallocated buffer and copies them to the host
+    in one transfer every flush_interval steps, so logging never forces a sync per step.
+    """
+    def __init__(self, flush_interval: int = 10):
+        self.flush_interval = max(1, int(flush_interval))
+        self.buffer = None
+        self.steps = []
+
+    def append(self, step: int, loss: torch.Tensor) -> bool:
+        """Records the loss of a step, returns True when the buffer is full and should be flushed"""
+        loss = loss.detach()
+        if self.buffer is None or self.buffer.device != loss.device:
+            self.buffer = torch.empty(self.flush_interval, dtype=torch.float32, device=loss.device)
+        # In-place device copy, does not wait for the loss to be computed
+        self.buffer[len(self.steps)].copy_(loss.float())
+        self.steps.append(step)
+        return len(self.steps) == self.flush_interval
+
+    def flush(self):
+        """Returns the buffered (step, loss) pairs as host values and empties the buffer"""
+        if not self.steps:
+            return []
+        values = self.buffer[:len(self.steps)].tolist()
+        flushed = list(zip(self.steps, values))
+        self.steps = []
+        return flushed
+
+
+class MetricsWriter:
+    """
+    Appends metrics to a JSON lines file from a background thread.
+
+    Every call to append() becomes one line mapping metric names to the values added since the last call,
+    so the cost of saving metrics stays constant per call instead of growing with the length of the run.
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        with open(self.filename, "a") as f:
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    break
+                if self.error is not None:
+                    continue
+                try:
+                    f.write(json.dumps(record) + "\n")
+                    f.flush()
+                except Exception as e:
+                    self.error = e
+
+    def append(self, **metrics):
+        """Queues the new values of one or more metrics, e.g. append(train_step_loss=[0.5, 0.4])"""
+        if self.error is not None:
+            raise self.error
+        record = {k: list(v) for k, v in metrics.items() if len(v) > 0}
+        if record:
+            self.queue.put(record)
+
+    def close(self):
+        """Waits until all queued metrics are written"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def iter_metrics(filename: str):
+    """Yields the records of a metrics file one line at a time"""
+    with open(filename, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def read_metrics(filename: str, metric_names=None) -> dict:
+    """
+    Reads the requested metrics (all by default) of a metrics file written by MetricsWriter.
+    Files in the older single JSON format are read as a whole.
+    """
+    metric_names = METRIC_NAMES if metric_names is None else metric_names
+    metrics = {name: [] for name in metric_names}
+    if filename.endswith(".json"):
+        with open(filename, "r") as f:
+            data = json.load(f)
+        return {name: data.get(name, []) for name in metric_names}
+    for record in iter_metrics(filename):
+        for name in metric_names:
+            metrics[name].extend(record.get(name, []))
+    return metrics
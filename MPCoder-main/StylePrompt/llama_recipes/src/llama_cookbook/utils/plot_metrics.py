@@ -6,6 +6,8 @@ import matplotlib.pyplot as plt
 import argparse
 import os
 
+from llama_cookbook.utils.metrics_utils import read_metrics
+
 def plot_metric(data, metric_name, x_label, y_label, title, colors):
     plt.figure(figsize=(7, 6))
     
@@ -40,35 +42,42 @@ def plot_metrics(file_path):
         print(f"File {file_path} does not exist.")
         return
 
-    with open(file_path, 'r') as f:
+    # Only the metrics of the current plot are held in memory, the file is read again for every plot
+    def load(*metric_names):
         try:
-            data = json.load(f)
+            return read_metrics(file_path, metric_names)
         except json.JSONDecodeError:
-            print("Invalid JSON file.")
-            return
+            print("Invalid metrics file.")
+            return None
 
     directory = os.path.dirname(file_path)
     filename_prefix = os.path.basename(file_path).split('.')[0]
 
+    data = load('train_epoch_loss', 'val_epoch_loss')
+    if data is None:
+        return
     plot_metric(data, 'loss', 'Epoch', 'Loss', 'Loss', ['b', 'r'])
     plt.savefig(os.path.join(directory, f"{filename_prefix}_train_and_validation_loss.png"))
     plt.close()
 
+    data = load('train_epoch_perplexity', 'val_epoch_perplexity')
     plot_metric(data, 'perplexity', 'Epoch', 'Perplexity', 'Perplexity', ['g', 'm'])
     plt.savefig(os.path.join(directory, f"{filename_prefix}_train_and_validation_perplexity.png"))
     plt.close()
 
+    data = load('train_step_loss', 'val_step_loss')
     plot_metrics_by_step(data, 'loss', 'Step', 'Loss', ['b', 'r'])
     plt.savefig(os.path.join(directory, f"{filename_prefix}_train_and_validation_loss_by_step.png"))
     plt.close()
 
+    data = load('train_step_perplexity', 'val_step_perplexity')
     plot_metrics_by_step(data, 'perplexity', 'Step', 'Loss', ['g', 'm'])
     plt.savefig(os.path.join(directory, f"{filename_prefix}_train_and_validation_perplexity_by_step.png"))
     plt.close()
     
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Plot metrics from JSON file.')
-    parser.add_argument('--file_path', required=True, type=str, help='Path to the metrics JSON file.')
+    parser = argparse.ArgumentParser(description='Plot metrics from a metrics JSON lines (or JSON) file.')
+    parser.add_argument('--file_path', required=True, type=str, help='Path to the metrics file.')
     args = parser.parse_args()
 
     plot_metrics(args.file_path)
@@ -0,0 +1,75 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import torch
+from accelerate.utils import is_xpu_available
+
+
+def get_batch_device(train_config, local_rank=None):
+    """Returns the device batches are moved to, or None when training runs on CPU"""
+    if train_config.enable_fsdp:
+        if is_xpu_available():
+            return torch.device(f"xpu:{local_rank}")
+        return torch.device(f"cuda:{local_rank}")
+    if is_xpu_available():
+        return torch.device("xpu:0")
+    if torch.cuda.is_available():
+        return torch.device("cuda:0")
+    return None
+
+
+class DevicePrefetcher:
+    """
+    Wraps a dataloader and copies batch N+1 to the device while batch N is being computed.
+
+    On CUDA the non_blocking copies are issued on a side stream and the compute stream waits for
+    them only when the batch is handed out. On other devices batches are copied with non_blocking=True
+    and on CPU (device=None) they are passed through unchanged.
+    Batches are only overlapped with compute if the dataloader uses pin_memory=True.
+    """
+    def __init__(self, dataloader, device=None):
+        self.dataloader = dataloader
+        self.device = torch.device(device) if device is not None else None
+        self.stream = None
+        if self.device is not None and self.device.type == "cuda" and torch.cuda.is_available():
+            self.stream = torch.cuda.Stream(device=self.device)
+
+    def __len__(self):
+        return len(self.dataloader)
+
+    def _to_device(self, batch):
+        return {
+            k: v.to(self.device, non_blocking=True) if isinstance(v, torch.Tensor) else v
+            for k, v in batch.items()
+        }
+
+    def _preload(self, iterator):
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(self.stream):
+            return self._to_device(batch)
+
+    def __iter__(self):
+        if self.device is None:
+            yield from self.dataloader
+            return
+        if self.stream is None:
+            for batch in self.dataloader:
+                yield self._to_device(batch)
+            return
+
+        iterator = iter(self.dataloader)
+        next_batch = self._preload(iterator)
+        while next_batch is not None:
+            compute_stream = torch.cuda.current_stream(self.device)
+            compute_stream.wait_stream(self.stream)
+            batch = next_batch
+            for v in batch.values():
+                if isinstance(v, torch.Tensor):
+                    # The memory was allocated on the side stream but is used on the compute stream
+                    v.record_stream(compute_stream)
+            # Start copying the next batch before handing out the current one
+            next_batch = self._preload(iterator)
+            yield batch
@@ -0,0 +1,81 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import itertools
+import random
+
+import numpy as np
+import torch
+
+
+def _get_sampler_rngs(dataloader):
+    # Samplers such as TokenBudgetBatchSampler shuffle with their own random.Random instead of the global one
+    rngs = []
+    sampler = getattr(dataloader, "batch_sampler", None)
+    while sampler is not None:
+        if isinstance(getattr(sampler, "rng", None), random.Random):
+            rngs.append(sampler.rng)
+        sampler = getattr(sampler, "batch_sampler", None)
+    return rngs
+
+
+def get_rng_state(dataloader=None) -> dict:
+    """Returns the python, numpy and torch RNG states, plus the RNG states of the samplers of dataloader if given"""
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    if dataloader is not None:
+        state["samplers"] = [rng.getstate() for rng in _get_sampler_rngs(dataloader)]
+    return state
+
+
+def set_rng_state(state: dict, dataloader=None) -> None:
+    """Restores RNG states returned by get_rng_state"""
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+    if dataloader is not None and "samplers" in state:
+        for rng, rng_state in zip(_get_sampler_rngs(dataloader), state["samplers"]):
+            rng.setstate(rng_state)
+
+
+class _ResumedBatchSampler:
+    def __init__(self, batches, rng_state=None):
+        self.batches = batches
+        self.rng_state = rng_state
+
+    def __iter__(self):
+        if self.rng_state is not None:
+            # Restored once the dataloader iterator exists, so the state is the one of the interrupted step
+            set_rng_state(self.rng_state)
+        yield from self.batches
+
+    def __len__(self):
+        return len(self.batches)
+
+
+def skip_consumed_batches(dataloader, num_batches: int, rng_state=None):
+    """
+    Returns a dataloader over the batches of the current epoch of dataloader that come after the first num_batches.
+
+    The batch order of the epoch is drawn right away from the current RNG states, which need to be those of the start
+    of the epoch. Only the sample ids of the skipped batches are generated, their samples are never loaded.
+    If rng_state is given, it is restored when iterating over the returned dataloader starts.
+    """
+    if dataloader.batch_sampler is None:
+        raise ValueError("Resuming within an epoch requires a dataloader with a (batch) sampler")
+    remaining = list(itertools.islice(iter(dataloader.batch_sampler), num_batches, None))
+    return torch.utils.data.DataLoader(
+        dataloader.dataset,
+        batch_sampler=_ResumedBatchSampler(remaining, rng_state),
+        collate_fn=dataloader.collate_fn,
+        num_workers=dataloader.num_workers,
+        pin_memory=dataloader.pin_memory,
+        worker_init_fn=dataloader.worker_init_fn,
+    )
@@ -20,10 +20,14 @@ import json
 
 
 from llama_cookbook.model_checkpointing import save_fsdp_model_checkpoint_full, save_model_and_optimizer_sharded, save_optimizer_checkpoint, save_peft_checkpoint, save_model_checkpoint
+from llama_cookbook.model_checkpointing import save_training_state, load_training_state, wait_for_checkpoints
 from llama_cookbook.policies import fpSixteen,bfSixteen, get_llama_wrapper
 from llama_cookbook.utils.memory_utils import MemoryTrace
 from accelerate.utils import is_xpu_available, is_ccl_available
 from llama_cookbook.utils.flop_utils import FlopMeasure
+from llama_cookbook.utils.metrics_utils import MetricsWriter, StepLossBuffer
+from llama_cookbook.utils.prefetch_utils import DevicePrefetcher, get_batch_device
+from llama_cookbook.utils.resume_utils import get_rng_state, set_rng_state, skip_consumed_batches
 def set_tokenizer_params(tokenizer: LlamaTokenizer):
     tokenizer.pad_token_id = 0
     tokenizer.padding_side = "left"
@@ -103,20 +107,58 @@ def train(model, train_dataloader,eval_dataloader, tokenizer, optimizer, lr_sche
     if train_config.save_metrics:
         if not os.path.exists(train_config.output_dir):
             os.makedirs(train_config.output_dir, exist_ok=True)
-        metrics_filename = f"{train_config.output_dir}/metrics_data_{local_rank}-{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
-        train_step_perplexity = []
-        train_step_loss = []
-        val_step_loss = []
-        val_step_perplexity = []
+        metrics_filename = f"{train_config.output_dir}/metrics_data_{local_rank}-{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.jsonl"
+        # Metrics are appended to the file by a background thread as they come in
+        metrics_writer = MetricsWriter(metrics_filename)
 
     epoch_times = []
     checkpoint_times = []
     results = {}
     best_val_loss = float("inf")
+    batch_device = get_batch_device(train_config, local_rank)
+    step_losses = StepLossBuffer(train_config.metrics_flush_interval)
+
+    def log_step_losses(epoch, pbar):
+        # Copy the buffered step losses to the host in one transfer and log them
+        flushed = step_losses.flush()
+        if not flushed:
+            return
+        if train_config.save_metrics:
+            metrics_writer.append(
+                train_step_loss=[l for _, l in flushed],
+                train_step_perplexity=torch.exp(torch.tensor([l for _, l in flushed])).tolist(),
+            )
+        for step, step_loss in flushed:
+            if wandb_run:
+                if not train_config.enable_fsdp or rank==0:
+                    wandb_run.log({
+                        'train/epoch': epoch + 1,
+                        'train/step': epoch * len(train_dataloader) + step,
+                        'train/loss': step_loss,
+                    })
+        step, step_loss = flushed[-1]
+        pbar.set_description(f"Training Epoch: {epoch+1}/{train_config.num_epochs}, step {step}/{len(train_dataloader)} completed (loss: {step_loss})")
+
     total_train_steps = 0
     max_steps_reached = False  # Flag to indicate max training steps reached
+    checkpoint_rank = rank if train_config.enable_fsdp else 0
+    if train_config.checkpoint_every_n_steps > 0 and train_config.checkpoint_every_n_steps % gradient_accumulation_steps != 0:
+        raise ValueError(f"checkpoint_every_n_steps ({train_config.checkpoint_every_n_steps}) needs to be a multiple of gradient_accumulation_steps ({gradient_accumulation_steps})")
+    train_state = None
+    start_epoch = 0
+    if train_config.resume_from_checkpoint:
+        train_state = load_training_state(model, optimizer, train_config.resume_from_checkpoint, checkpoint_rank, train_config.enable_fsdp)
+        start_epoch = train_state["epoch"]
+        total_train_steps = train_state["total_train_steps"]
+        best_val_loss = train_state["best_val_loss"]
+        train_loss, train_prep = train_state["train_loss"], train_state["train_prep"]
+        val_loss, val_prep = train_state["val_loss"], train_state["val_prep"]
+        lr_scheduler.load_state_dict(train_state["lr_scheduler"])
+        if train_config.use_fp16:
+            scaler.load_state_dict(train_state["scaler"])
+    last_checkpoint_step = total_train_steps
     # Start the training loop
-    for epoch in range(train_config.num_epochs):
+    for epoch in range(start_epoch, train_config.num_epochs):
         print(f"Starting epoch {epoch}/{train_config.num_epochs}")
         print(f"train_config.max_train_step: {train_config.max_train_step}")
         # stop when the maximum number of training steps is reached
@@ -126,10 +168,24 @@ def train(model, train_dataloader,eval_dataloader, tokenizer, optimizer, lr_sche
         with MemoryTrace() as memtrace:  # track the memory usage
             model.train()
             total_loss = 0.0
+            epoch_dataloader = train_dataloader
+            resume_step = 0
+            if train_state is not None or train_config.checkpoint_every_n_steps > 0:
+                # The batch order of the epoch is drawn up front from a saved RNG state, so a resumed run can replay it
+                resume_rng_state = None
+                if train_state is not None:
+                    set_rng_state(train_state["epoch_rng_state"], train_dataloader)
+                    resume_step, resume_rng_state = train_state["step"], train_state["rng_state"]
+                    total_loss = torch.tensor(train_state["total_loss"], device=batch_device)
+                    train_state = None
+                epoch_rng_state = get_rng_state(train_dataloader)
+                # Skips the batches the interrupted run already consumed without loading them
+                epoch_dataloader = skip_consumed_batches(train_dataloader, resume_step, resume_rng_state)
             total_length = len(train_dataloader)//gradient_accumulation_steps
-            pbar = tqdm(colour="blue", desc=f"Training Epoch: {epoch+1}", total=total_length, dynamic_ncols=True)
+            pbar = tqdm(colour="blue", desc=f"Training Epoch: {epoch+1}", total=total_length, initial=resume_step//gradient_accumulation_steps, dynamic_ncols=True)
             with profile(train_config,local_rank) as profile_context:
-                for step, batch in enumerate(train_dataloader):
+                # Batches are copied to the device ahead of time, overlapping the copy with compute
+                for step, batch in enumerate(DevicePrefetcher(epoch_dataloader, batch_device), start=resume_step):
                     total_train_steps += 1
                     # stop when the maximum number of training steps is reached
                     if train_config.max_train_step > 0 and total_train_steps > train_config.max_train_step:
@@ -137,28 +193,16 @@ def train(model, train_dataloader,eval_dataloader, tokenizer, optimizer, lr_sche
                         if not train_config.enable_fsdp or local_rank==0:
                             print("max training steps reached, stopping training, total train steps finished: ", total_train_steps-1)
                         break
-                    for key in batch.keys():
-                        if train_config.enable_fsdp:
-                            if is_xpu_available():
-                                batch[key] = batch[key].to(torch.device(f"xpu:{local_rank}"))
-                            else:
-                                batch[key] = batch[key].to(local_rank)
-                        else:
-                            if is_xpu_available():
-                                batch[key] = batch[key].to('xpu:0')
-                            elif torch.cuda.is_available():
-                                batch[key] = batch[key].to('cuda:0')
                     with autocast():
                         loss = model(**batch).loss
                     total_loss += loss.detach().float()
                     loss = loss / gradient_accumulation_steps
-                    if train_config.save_metrics:
-                        train_step_loss.append(loss.detach().float().item())
-                        train_step_perplexity.append(float(torch.exp(loss.detach().float())))
+                    # The optimizer steps every gradient_accumulation_steps batches and on the last batch of the epoch
+                    optimizer_step_now = (step + 1) % gradient_accumulation_steps == 0 or step == len(train_dataloader) - 1
                     if train_config.use_fp16:
                         # if fp16 is enabled, use gradient scaler to handle gradient update
                         scaler.scale(loss).backward()
-                        if (step + 1) % gradient_accumulation_steps == 0 or step == len(train_dataloader) - 1:
+                        if optimizer_step_now:
                             if train_config.gradient_clipping and train_config.gradient_clipping_threshold > 0.0:
                                 scaler.unscale_(optimizer)
                                 if train_config.enable_fsdp:
@@ -172,7 +216,7 @@ def train(model, train_dataloader,eval_dataloader, tokenizer, optimizer, lr_sche
                     else:
                         # regular backpropagation when fp16 is not used
                         loss.backward()
-                        if (step + 1) % gradient_accumulation_steps == 0 or step == len(train_dataloader) - 1:
+                        if optimizer_step_now:
                             if train_config.gradient_clipping and train_config.gradient_clipping_threshold > 0.0:
                                 if train_config.enable_fsdp:
                                     model.clip_grad_norm_(train_config.gradient_clipping_threshold)
@@ -185,18 +229,43 @@ def train(model, train_dataloader,eval_dataloader, tokenizer, optimizer, lr_sche
                         profile_context.step()
                     if train_config.flop_counter and profile_context.is_done():
                         TFlops = profile_context.get_flops_per_sec() / 1e12
-                    if wandb_run:
-                        if not train_config.enable_fsdp or rank==0:
-                            wandb_run.log({
-                                'train/epoch': epoch + 1,
-                                'train/step': epoch * len(train_dataloader) + step,
-                                'train/loss': loss.detach().float(),
-                            })
-
-                    pbar.set_description(f"Training Epoch: {epoch+1}/{train_config.num_epochs}, step {step}/{len(train_dataloader)} completed (loss: {loss.detach().float()})")
-
-                    if train_config.save_metrics:
-                        save_to_json(metrics_filename, train_step_loss, train_loss, train_step_perplexity, train_prep, val_step_loss, val_loss, val_step_perplexity, val_prep)
+
+                    # Step losses stay on the device and are only copied to the host every metrics_flush_interval steps
+                    if step_losses.append(step, loss):
+                        log_step_losses(epoch, pbar)
+
+                    # Save everything needed to resume from the next batch, at the first optimizer step boundary
+                    # at or after each multiple of checkpoint_every_n_steps, which the short last accumulation
+                    # of an epoch can shift off the multiple
+                    checkpoint_now = train_config.checkpoint_every_n_steps > 0 and total_train_steps // train_config.checkpoint_every_n_steps > last_checkpoint_step // train_config.checkpoint_every_n_steps
+                    if checkpoint_now and optimizer_step_now:
+                        last_checkpoint_step = total_train_steps
+                        checkpoint_start_time = time.perf_counter()
+                        save_training_state(model, optimizer, {
+                            "epoch": epoch,
+                            "step": step + 1,
+                            "total_train_steps": total_train_steps,
+                            "total_loss": float(total_loss),
+                            "best_val_loss": best_val_loss,
+                            "train_loss": train_loss,
+                            "train_prep": train_prep,
+                            "val_loss": val_loss,
+                            "val_prep": val_prep,
+                            "lr_scheduler": lr_scheduler.state_dict(),
+                            "scaler": scaler.state_dict() if train_config.use_fp16 else None,
+                            "epoch_rng_state": epoch_rng_state,
+                            "rng_state": get_rng_state(),
+                        }, os.path.join(train_config.output_dir, "training_state"), checkpoint_rank, train_config.enable_fsdp)
+                        checkpoint_times.append(time.perf_counter() - checkpoint_start_time)
+
+                    # Evaluate within the epoch, the last step of the epoch is covered by the evaluation below
+                    eval_now = train_config.eval_every_n_steps > 0 and total_train_steps % train_config.eval_every_n_steps == 0
+                    if train_config.run_validation and eval_now and step < len(train_dataloader) - 1:
+                        _, _, temp_val_loss, temp_step_perplexity = evaluation(model, train_config, eval_dataloader, local_rank, tokenizer, wandb_run)
+                        if train_config.save_metrics:
+                            metrics_writer.append(val_step_loss=temp_val_loss, val_step_perplexity=temp_step_perplexity)
+                        model.train()
+                log_step_losses(epoch, pbar)
                 pbar.close()
 
         epoch_end_time = time.perf_counter()-epoch_start_time
@@ -223,8 +292,7 @@ def train(model, train_dataloader,eval_dataloader, tokenizer, optimizer, lr_sche
         if train_config.run_validation:
             eval_ppl, eval_epoch_loss, temp_val_loss, temp_step_perplexity = evaluation(model, train_config, eval_dataloader, local_rank, tokenizer, wandb_run)
             if train_config.save_metrics:
-                val_step_loss.extend(temp_val_loss)
-                val_step_perplexity.extend(temp_step_perplexity)
+                metrics_writer.append(val_step_loss=temp_val_loss, val_step_perplexity=temp_step_perplexity)
             should_save_model = train_config.save_model and eval_epoch_loss < best_val_loss
         
         checkpoint_start_time = time.perf_counter()
@@ -295,9 +363,15 @@ def train(model, train_dataloader,eval_dataloader, tokenizer, optimizer, lr_sche
         else:
             print(f"Epoch {epoch+1}: train_perplexity={train_perplexity:.4f}, train_epoch_loss={train_epoch_loss:.4f}, epoch time {epoch_end_time}s")
 
-        # Saving the results every epoch to plot later
+        # Saving the epoch results to plot later
         if train_config.save_metrics:
-            save_to_json(metrics_filename, train_step_loss, train_loss, train_step_perplexity, train_prep, val_step_loss, val_loss, val_step_perplexity, val_prep)
+            metrics_writer.append(train_epoch_loss=train_loss[-1:], train_epoch_perplexity=train_prep[-1:])
+            if train_config.run_validation:
+                metrics_writer.append(val_epoch_loss=val_loss[-1:], val_epoch_perplexity=val_prep[-1:])
+
+    if train_config.async_checkpointing:
+        # Make sure the checkpoints still being written in the background are complete before returning
+        checkpoint_times.append(wait_for_checkpoints())
 
     avg_epoch_time = sum(epoch_times)/ len(epoch_times)
     avg_checkpoint_time = sum(checkpoint_times)/ len(checkpoint_times) if len(checkpoint_times) > 0 else 0
@@ -315,6 +389,7 @@ def train(model, train_dataloader,eval_dataloader, tokenizer, optimizer, lr_sche
     results["avg_epoch_time"] = avg_epoch_time
     results["avg_checkpoint_time"] = avg_checkpoint_time
     if train_config.save_metrics:
+        metrics_writer.close()
         results["metrics_filename"] = metrics_filename
     if train_config.flop_counter:
         results["model_tflops"]= TFlops
@@ -328,64 +403,82 @@ def evaluation(model,train_config, eval_dataloader, local_rank, tokenizer, wandb
     """
     Evaluates the model on the given dataloader
 
+    Only the loss is computed, the argmax predictions are decoded as well if train_config.eval_decode_predictions is set.
+    With FSDP every rank evaluates its own shard of the eval set. Ranks with fewer batches repeat their last batch
+    without counting it, so that all ranks run the same number of forward passes.
+
     Args:
         model: The model to evaluate
         eval_dataloader: The dataloader containing the evaluation data
         local_rank: The rank of the current node in a distributed setting
         tokenizer: The tokenizer used to decode predictions
 
-    Returns: eval_ppl, eval_epoch_loss
+    Returns: eval_ppl, eval_epoch_loss, val_step_loss, val_step_perplexity
     """
-    if train_config.enable_fsdp:
-        world_size = int(os.environ["WORLD_SIZE"])
     model.eval()
     eval_preds = []
     val_step_loss = []
     val_step_perplexity = []
+    step_losses = StepLossBuffer(train_config.metrics_flush_interval)
     eval_loss = 0.0  # Initialize evaluation loss
-    total_eval_steps = 0
+    batch_device = get_batch_device(train_config, local_rank)
+
+    num_batches = len(eval_dataloader)
+    # stop when the maximum number of eval steps is reached
+    if train_config.max_eval_step > 0 and num_batches > train_config.max_eval_step:
+        num_batches = train_config.max_eval_step
+        if not train_config.enable_fsdp or local_rank==0:
+            print("max eval steps reached, stopping evaluation, total_eval_steps: ", num_batches)
+    num_steps = num_batches
+    if train_config.enable_fsdp:
+        counts = torch.tensor([num_batches, -num_batches], device=batch_device)
+        dist.all_reduce(counts, op=dist.ReduceOp.MAX)
+        num_steps, min_batches = counts[0].item(), -counts[1].item()
+        if min_batches == 0:
+            raise ValueError(f"The eval set is too small to give each of the {dist.get_world_size()} ranks at least one batch")
+
     with MemoryTrace() as memtrace:
-        for step, batch in enumerate(tqdm(eval_dataloader,colour="green", desc="evaluating Epoch", dynamic_ncols=True)):
-            total_eval_steps += 1
-            # stop when the maximum number of eval steps is reached
-            if train_config.max_eval_step > 0 and total_eval_steps > train_config.max_eval_step:
-                if not train_config.enable_fsdp or local_rank==0:
-                    print("max eval steps reached, stopping evaluation, total_eval_steps: ", total_eval_steps - 1)
-                break
-            for key in batch.keys():
-                if train_config.enable_fsdp:
-                    batch[key] = batch[key].to(local_rank)
-                else:
-                    if is_xpu_available():
-                        batch[key] = batch[key].to('xpu:0')
-                    else:
-                        batch[key] = batch[key].to('cuda:0')
+        batches = iter(DevicePrefetcher(eval_dataloader, batch_device))
+        for step in tqdm(range(num_steps), colour="green", desc="evaluating Epoch", dynamic_ncols=True):
+            counted = step < num_batches
+            if counted:
+                batch = next(batches)
             # Ensure no gradients are computed for this scope to save memory
             with torch.no_grad():
                 # Forward pass and compute loss
                 outputs = model(**batch)
-                loss = outputs.loss
-                if train_config.save_metrics:
-                    val_step_loss.append(loss.detach().float().item())
-                    val_step_perplexity.append(float(torch.exp(loss.detach().float())))
-
-                eval_loss += loss.detach().float()
-            # Decode predictions and add to evaluation predictions list
-            preds = torch.argmax(outputs.logits, -1)
-            eval_preds.extend(
-                tokenizer.batch_decode(preds.detach().cpu().numpy(), skip_special_tokens=True)
-            )
+            if not counted:
+                continue
+            loss = outputs.loss
+            if train_config.save_metrics and step_losses.append(step, loss):
+                val_step_loss.extend(l for _, l in step_losses.flush())
+
+            eval_loss += loss.detach().float()
+            if train_config.eval_decode_predictions:
+                # Decode predictions and add to evaluation predictions list
+                preds = torch.argmax(outputs.logits, -1)
+                eval_preds.extend(
+                    tokenizer.batch_decode(preds.detach().cpu().numpy(), skip_special_tokens=True)
+                )
 
-    # If there's more than one CUDA device, reduce evaluation loss across all devices
-    if is_xpu_available() and (torch.xpu.device_count() > 1 and train_config.enable_fsdp):
-        dist.all_reduce(eval_loss, op=dist.ReduceOp.SUM)
-    if torch.cuda.device_count() > 1 and train_config.enable_fsdp:
+    if train_config.save_metrics:
+        val_step_loss.extend(l for _, l in step_losses.flush())
+        val_step_perplexity = torch.exp(torch.tensor(val_step_loss)).tolist()
+
+    if train_config.eval_decode_predictions:
+        os.makedirs(train_config.output_dir, exist_ok=True)
+        with open(os.path.join(train_config.output_dir, f"eval_predictions_{local_rank}.json"), "w") as f:
+            json.dump(eval_preds, f)
+
+    # Sum the losses and the number of evaluated batches over all ranks, the shards can differ in size
+    eval_loss = torch.as_tensor(eval_loss, dtype=torch.float32, device=batch_device)
+    num_evaluated = torch.tensor(float(num_batches), device=batch_device)
+    if train_config.enable_fsdp:
         dist.all_reduce(eval_loss, op=dist.ReduceOp.SUM)
+        dist.all_reduce(num_evaluated, op=dist.ReduceOp.SUM)
 
     # Compute average loss and perplexity
-    eval_epoch_loss = eval_loss / len(eval_dataloader)
-    if train_config.enable_fsdp:
-        eval_epoch_loss = eval_epoch_loss/world_size
+    eval_epoch_loss = eval_loss / num_evaluated
     eval_ppl = torch.exp(eval_epoch_loss)
 
     # Print evaluation metrics
@@ -0,0 +1,21 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import torch
+
+from llama_cookbook.model_checkpointing.async_checkpoint import AsyncCheckpointer
+
+
+def test_async_save(tmp_path):
+    checkpointer = AsyncCheckpointer()
+    state = {"weight": torch.ones(4), "nested": {"step": 3, "bias": torch.zeros(2)}}
+
+    checkpointer.save(state, tmp_path / "first.pt")
+    checkpointer.save(state, tmp_path / "second.pt")
+    checkpointer.wait()
+
+    assert checkpointer.pending == []
+    for name in ["first.pt", "second.pt"]:
+        loaded = torch.load(tmp_path / name)
+        assert torch.equal(loaded["weight"], state["weight"])
+        assert loaded["nested"]["step"] == 3
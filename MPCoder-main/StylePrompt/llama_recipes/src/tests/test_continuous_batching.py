@@ -0,0 +1,204 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from llama_cookbook.inference.continuous_batching import ContinuousBatchingEngine, sample_next_tokens
+from llama_cookbook.inference.openai_server import create_server
+
+
+class FakeTokenizer:
+    pad_token_id = 0
+    eos_token_id = 2
+
+    def __call__(self, text, add_special_tokens=True):
+        return {"input_ids": [1] + [3 + ord(c) % 60 for c in text]}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(ord("a") + i % 26) for i in ids)
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=64,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=128,
+        eos_token_id=2,
+        pad_token_id=0,
+    )
+    return LlamaForCausalLM(config).eval()
+
+
+def get_prompts():
+    generator = torch.Generator().manual_seed(1)
+    return [
+        [1] + torch.randint(3, 64, (int(n),), generator=generator).tolist()
+        for n in torch.randint(2, 12, (10,), generator=generator)
+    ]
+
+
+def reference_generate(model, prompt, max_new_tokens):
+    output = model.generate(
+        torch.tensor([prompt]),
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        eos_token_id=2,
+        pad_token_id=0,
+    )
+    return output[0, len(prompt):].tolist()
+
+
+def test_greedy_matches_generate(model):
+    prompts = get_prompts()
+    max_new_tokens = [4 + 3 * (i % 4) for i in range(len(prompts))]
+
+    # A small batch forces requests to be admitted while others are decoding
+    with ContinuousBatchingEngine(model, FakeTokenizer(), max_batch_size=4, max_prefill_batch_size=2) as engine:
+        handles = [engine.submit(p, max_new_tokens=n) for p, n in zip(prompts, max_new_tokens)]
+        for handle in handles:
+            handle.result(timeout=60)
+
+    for handle, prompt, n in zip(handles, prompts, max_new_tokens):
+        assert handle.output_ids == reference_generate(model, prompt, n)
+        assert handle.finish_reason in ("stop", "length")
+
+
+def test_stream_tokens(model):
+    prompt = get_prompts()[0]
+    with ContinuousBatchingEngine(model, FakeTokenizer()) as engine:
+        handle = engine.submit(prompt, max_new_tokens=5)
+        streamed = list(handle.stream_tokens())
+
+    assert streamed == handle.output_ids
+    assert len(streamed) <= 5
+
+
+def test_sample_next_tokens():
+    logits = torch.tensor([[0.0, 5.0, 1.0], [3.0, 0.0, 2.0]])
+    greedy = sample_next_tokens(
+        logits,
+        temperature=torch.ones(2),
+        top_k=torch.zeros(2, dtype=torch.long),
+        top_p=torch.ones(2),
+        do_sample=torch.zeros(2, dtype=torch.bool),
+    )
+    assert greedy.tolist() == [1, 0]
+
+    # top_k=1 leaves a single candidate to sample from
+    sampled = sample_next_tokens(
+        logits,
+        temperature=torch.ones(2),
+        top_k=torch.ones(2, dtype=torch.long),
+        top_p=torch.ones(2),
+        do_sample=torch.ones(2, dtype=torch.bool),
+    )
+    assert sampled.tolist() == [1, 0]
+
+
+def test_openai_completions(model):
+    prompts = get_prompts()[:2]
+    with ContinuousBatchingEngine(model, FakeTokenizer()) as engine:
+        server = create_server(engine, "tiny-llama", host="127.0.0.1", port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/v1/completions"
+            body = json.dumps({"prompt": prompts, "max_tokens": 6, "temperature": 0}).encode()
+            with urllib.request.urlopen(urllib.request.Request(url, data=body)) as response:
+                completion = json.load(response)
+
+            body = json.dumps({"prompt": prompts, "max_tokens": 6, "temperature": 0, "stream": True}).encode()
+            with urllib.request.urlopen(urllib.request.Request(url, data=body)) as response:
+                events = [line[len(b"data: "):] for line in response.read().splitlines() if line.startswith(b"data: ")]
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    tokenizer = FakeTokenizer()
+    expected = [tokenizer.decode(reference_generate(model, p, 6)) for p in prompts]
+    assert [c["text"] for c in completion["choices"]] == expected
+    assert completion["usage"]["prompt_tokens"] == sum(len(p) for p in prompts)
+
+    assert events[-1] == b"[DONE]"
+    # Every prompt streams its own choice
+    choices = [json.loads(e)["choices"][0] for e in events[:-1]]
+    assert ["".join(c["text"] for c in choices if c["index"] == i) for i in range(len(prompts))] == expected
+    assert sum(c["finish_reason"] is not None for c in choices) == len(prompts)
+
+
+def test_stop_aborts_pending_requests(model):
+    engine = ContinuousBatchingEngine(model, FakeTokenizer(), max_batch_size=1)
+    # Without stop tokens the requests would run for much longer than the test
+    engine.eos_token_ids = []
+    handles = [engine.submit(p, max_new_tokens=10000) for p in get_prompts()[:3]]
+    engine.stop()
+
+    for handle in handles:
+        handle.result(timeout=5)
+        assert handle.finish_reason == "abort"
+        # The stream ends after the tokens generated before the abort
+        assert list(handle.stream_tokens()) == handle.output_ids
+    with pytest.raises(RuntimeError):
+        engine.submit(get_prompts()[0])
+
+
+def test_submit_rejects_malformed_prompts(model):
+    with ContinuousBatchingEngine(model, FakeTokenizer()) as engine:
+        for prompt in ([], ["a"], [1.5], 3):
+            with pytest.raises(ValueError):
+                engine.submit(prompt)
+
+
+def test_prefill_failure_only_fails_its_request(model):
+    prompts = get_prompts()[:2]
+    # max_prefill_batch_size=1 prefills the requests separately, the out of vocabulary id fails only its own prefill
+    with ContinuousBatchingEngine(model, FakeTokenizer(), max_prefill_batch_size=1) as engine:
+        engine.eos_token_ids = []
+        valid = engine.submit(prompts[0], max_new_tokens=20)
+        invalid = engine.submit([1, 10 ** 6], max_new_tokens=20)
+        other = engine.submit(prompts[1], max_new_tokens=20)
+        for handle in (valid, invalid, other):
+            handle.result(timeout=60)
+
+    assert invalid.finish_reason == "error"
+    for handle in (valid, other):
+        assert handle.finish_reason == "length"
+        assert len(handle.output_ids) == 20
+
+
+def test_openai_invalid_requests(model):
+    engine = ContinuousBatchingEngine(model, FakeTokenizer()).start()
+    server = create_server(engine, "tiny-llama", host="127.0.0.1", port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def post(body):
+        url = f"http://127.0.0.1:{server.server_address[1]}/v1/completions"
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, data=json.dumps(body).encode())) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    try:
+        assert post({"prompt": [[]], "max_tokens": 4}) == 400
+        assert post({"prompt": [get_prompts()[0], ["x"]], "max_tokens": 4}) == 400
+        engine.stop()
+        assert post({"prompt": get_prompts()[0], "max_tokens": 4}) == 503
+    finally:
+        server.shutdown()
+        server.server_close()
+        engine.stop()
@@ -0,0 +1,86 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import json
+
+import pytest
+import torch
+from safetensors.torch import save_file
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from llama_cookbook.tools.convert_hf_weights_to_llama import write_model
+
+
+def reference_shards(state_dict, params, num_shards):
+    # The conversion of the full model in memory, as the converter did before it streamed the weights
+    n_heads, dim = params["n_heads"], params["dim"]
+    dims_per_head = dim // n_heads
+    n_kv_heads = params["n_kv_heads"]
+    llama_version = 3 if params.get("vocab_size") == 128256 else 2
+
+    def permute(w, n_heads, dim1):
+        return w.view(n_heads, 2, dim1 // n_heads // 2, dim).transpose(1, 2).reshape(dim1, dim)
+
+    shards = [{} for _ in range(num_shards)]
+
+    def insert_chunk(name, tensor, chunk_dim):
+        for shard, t in zip(shards, tensor.chunk(num_shards, dim=chunk_dim)):
+            shard[name] = t
+
+    insert_chunk("tok_embeddings.weight", state_dict["model.embed_tokens.weight"], 0 if llama_version == 3 else 1)
+    insert_chunk("output.weight", state_dict["lm_head.weight"], 0)
+    for i in range(params["n_layers"]):
+        prefix = f"model.layers.{i}"
+        insert_chunk(f"layers.{i}.attention.wq.weight", permute(state_dict[f"{prefix}.self_attn.q_proj.weight"], n_heads, dim), 0)
+        insert_chunk(
+            f"layers.{i}.attention.wk.weight",
+            permute(state_dict[f"{prefix}.self_attn.k_proj.weight"], n_kv_heads, dims_per_head * n_kv_heads),
+            0,
+        )
+        insert_chunk(f"layers.{i}.attention.wv.weight", state_dict[f"{prefix}.self_attn.v_proj.weight"], 0)
+        insert_chunk(f"layers.{i}.attention.wo.weight", state_dict[f"{prefix}.self_attn.o_proj.weight"], 1)
+        insert_chunk(f"layers.{i}.feed_forward.w1.weight", state_dict[f"{prefix}.mlp.gate_proj.weight"], 0)
+        insert_chunk(f"layers.{i}.feed_forward.w2.weight", state_dict[f"{prefix}.mlp.down_proj.weight"], 1)
+        insert_chunk(f"layers.{i}.feed_forward.w3.weight", state_dict[f"{prefix}.mlp.up_proj.weight"], 0)
+    return shards
+
+
+@pytest.mark.parametrize("vocab_size,file_format,num_workers", [(64, "safetensors", 2), (128256, "bin", 1)])
+def test_convert_hf_weights_to_llama(tmp_path, vocab_size, file_format, num_workers):
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        tie_word_embeddings=False,
+    )
+    state_dict = {k: v.to(torch.bfloat16).contiguous() for k, v in LlamaForCausalLM(config).state_dict().items()}
+    model_dir = tmp_path / "hf"
+    model_dir.mkdir()
+    if file_format == "safetensors":
+        # Split over two files like sharded hub checkpoints
+        names = sorted(state_dict)
+        weight_map = {name: f"model-0000{i % 2 + 1}-of-00002.safetensors" for i, name in enumerate(names)}
+        for file_name in set(weight_map.values()):
+            save_file({n: state_dict[n] for n in names if weight_map[n] == file_name}, str(model_dir / file_name))
+        (model_dir / "model.safetensors.index.json").write_text(json.dumps({"weight_map": weight_map}))
+    else:
+        torch.save(state_dict, model_dir / "pytorch_model.bin")
+
+    params = {"dim": 32, "n_layers": 2, "n_heads": 4, "n_kv_heads": 2, "vocab_size": vocab_size}
+    output_dir = tmp_path / "consolidated"
+    output_dir.mkdir()
+    (output_dir / "params.json").write_text(json.dumps(params))
+
+    write_model(str(model_dir), "13B", str(output_dir), num_workers=num_workers)
+
+    for i, expected in enumerate(reference_shards(state_dict, params, num_shards=2)):
+        shard = torch.load(output_dir / f"consolidated.{i:02d}.pth")
+        assert ("rope.freqs" in shard) == (vocab_size != 128256)
+        assert torch.equal(shard["norm.weight"], state_dict["model.norm.weight"])
+        for name, tensor in expected.items():
+            assert shard[name].dtype == torch.bfloat16
+            assert torch.equal(shard[name], tensor), name
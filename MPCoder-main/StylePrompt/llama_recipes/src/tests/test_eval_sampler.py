@@ -0,0 +1,46 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import random
+import pytest
+
+from llama_cookbook.data.eval_sampler import ShardedEvalBatchSampler, get_eval_subset
+
+SAMPLES = 103
+BATCH_SIZE = 4
+
+
+@pytest.fixture
+def dataset():
+    random.seed(42)
+    return [{"input_ids": random.randint(1, 20) * [1,]} for _ in range(SAMPLES)]
+
+
+@pytest.mark.parametrize("max_tokens", [0, 40])
+@pytest.mark.parametrize("num_replicas", [1, 2, 3])
+def test_sharded_eval_sampling(dataset, num_replicas, max_tokens):
+    samplers = [
+        ShardedEvalBatchSampler(
+            dataset,
+            batch_size=BATCH_SIZE,
+            num_replicas=num_replicas,
+            rank=rank,
+            max_tokens=max_tokens,
+        )
+        for rank in range(num_replicas)
+    ]
+
+    # Every sample is evaluated exactly once
+    ids = [i for s in samplers for b in s for i in b]
+    assert sorted(ids) == list(range(SAMPLES))
+    lengths = [len(s) for s in samplers]
+    assert max(lengths) - min(lengths) <= 1
+
+
+def test_eval_subset(dataset):
+    subset = get_eval_subset(dataset, 10, seed=1)
+
+    assert len(subset) == 10
+    assert subset.indices == get_eval_subset(dataset, 10, seed=1).indices
+    assert get_eval_subset(dataset, 0) is dataset
+    assert get_eval_subset(dataset, SAMPLES + 1) is dataset
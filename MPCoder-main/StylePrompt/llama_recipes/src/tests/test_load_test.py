@@ -0,0 +1,66 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import asyncio
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+INFERENCE_BENCHMARKS_DIR = Path(__file__).parents[2] / "end-to-end-use-cases" / "benchmarks" / "inference"
+
+
+@pytest.fixture
+def load_test(monkeypatch):
+    monkeypatch.syspath_prepend(str(INFERENCE_BENCHMARKS_DIR))
+    import load_test
+
+    return load_test
+
+
+@pytest.mark.parametrize(
+    "backend,path,concurrency,request_rate",
+    [
+        ("openai-chat", "/v1/chat/completions", 4, None),
+        ("openai", "/v1/completions", None, 200.0),
+    ],
+)
+def test_run_load_against_mock_server(load_test, backend, path, concurrency, request_rate):
+    num_requests, output_len = 8, 5
+
+    async def run():
+        runner = await load_test.start_mock_server(ttft=0.02, itl=0.005)
+        try:
+            host, port = runner.addresses[0][:2]
+            return await load_test.run_load(
+                load_test.ASYNC_REQUEST_FUNCS[backend],
+                [f"http://{host}:{port}{path}"],
+                "What is Deep Learning",
+                4,
+                "mock-model",
+                output_len,
+                num_requests,
+                concurrency=concurrency,
+                request_rate=request_rate,
+            )
+        finally:
+            await runner.cleanup()
+
+    outputs, duration = asyncio.run(run())
+
+    # The token counts come from the usage chunk the server sends at the end of the stream
+    assert [o.output_tokens for o in outputs] == [output_len] * num_requests
+    metrics = load_test.summarize(outputs, duration, lambda o: o.output_tokens)
+    assert metrics["num_requests"] == num_requests
+    assert metrics["failed"] == 0
+    assert metrics["mean_ttft"] > 0
+    assert metrics["mean_itl"] > 0
+    assert metrics["p99_latency"] >= metrics["p50_latency"] > 0
+    assert metrics["output_tps"] == pytest.approx(num_requests * output_len / duration)
+    assert metrics["input_tps"] == pytest.approx(num_requests * 4 / duration)
+
+
+def test_closed_loop_needs_concurrency(load_test):
+    with pytest.raises(ValueError):
+        asyncio.run(load_test.run_load(None, [], "", 0, "", 1, 1))
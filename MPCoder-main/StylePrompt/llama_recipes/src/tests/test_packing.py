@@ -0,0 +1,94 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import random
+
+import numpy as np
+import pytest
+
+from llama_cookbook.data.packing import PackedDataset, first_fit_decreasing
+from llama_cookbook.data.token_cache import get_cached_dataset
+
+CHUNK_SIZE = 16
+
+
+@pytest.fixture
+def dataset():
+    random.seed(42)
+    samples = []
+    token = 1
+    for _ in range(40):
+        n = random.randint(1, 2 * CHUNK_SIZE)
+        ids = list(range(token, token + n))
+        token += n
+        samples.append({
+            "input_ids": ids,
+            "attention_mask": [1] * n,
+            "labels": [-100] + ids[1:],
+        })
+    return samples
+
+
+def concat_reference(dataset, chunk_size):
+    buffer = {k: [] for k in dataset[0].keys()}
+    samples = []
+    for sample in dataset:
+        buffer = {k: v + sample[k] for k, v in buffer.items()}
+        while len(buffer["input_ids"]) > chunk_size:
+            samples.append({k: v[:chunk_size] for k, v in buffer.items()})
+            buffer = {k: v[chunk_size:] for k, v in buffer.items()}
+    return samples
+
+
+def test_concat_matches_reference(dataset):
+    packed = PackedDataset(dataset, chunk_size=CHUNK_SIZE)
+    expected = concat_reference(dataset, CHUNK_SIZE)
+
+    assert len(packed) == len(expected)
+    assert [packed[i] for i in range(len(packed))] == expected
+
+
+def test_concat_from_token_cache(dataset, tmp_path):
+    cached = get_cached_dataset(lambda: dataset, str(tmp_path / "cache"))
+    packed = PackedDataset(cached, chunk_size=CHUNK_SIZE)
+
+    assert [packed[i] for i in range(len(packed))] == concat_reference(dataset, CHUNK_SIZE)
+
+
+def test_ffd_keeps_all_tokens(dataset):
+    packed = PackedDataset(dataset, chunk_size=CHUNK_SIZE, strategy="ffd", pad_token_id=0)
+    chunks = [packed[i] for i in range(len(packed))]
+
+    assert all(len(c["input_ids"]) == CHUNK_SIZE for c in chunks)
+    packed_ids = [t for c in chunks for t, m in zip(c["input_ids"], c["attention_mask"]) if m]
+    assert sorted(packed_ids) == [t for s in dataset for t in s["input_ids"]]
+    assert all(l == -100 for c in chunks for l, m in zip(c["labels"], c["attention_mask"]) if not m)
+    assert packed.padding_ratio < 0.25
+
+
+def test_position_ids_restart_at_documents(dataset):
+    packed = PackedDataset(dataset, chunk_size=CHUNK_SIZE, position_ids=True)
+    doc_starts = set(s["input_ids"][0] for s in dataset)
+
+    for i in range(len(packed)):
+        chunk = packed[i]
+        assert chunk["position_ids"][0] == 0
+        # flash_attention_2 only uses the position ids to separate the documents when there is no attention mask
+        assert "attention_mask" not in chunk
+        for pos, token in zip(chunk["position_ids"][1:], chunk["input_ids"][1:]):
+            assert (pos == 0) == (token in doc_starts)
+
+
+def test_first_fit_decreasing():
+    lengths = np.array([5, 7, 3, 2, 4, 9, 1])
+    bin_ids = first_fit_decreasing(lengths, 10)
+
+    loads = np.bincount(bin_ids, weights=lengths)
+    assert loads.max() <= 10
+    assert len(loads) == 4
+    assert bin_ids.tolist() == [2, 1, 1, 3, 2, 0, 0]
+
+
+def test_unknown_strategy(dataset):
+    with pytest.raises(ValueError):
+        PackedDataset(dataset, chunk_size=CHUNK_SIZE, strategy="best_fit")
@@ -0,0 +1,40 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+from datasets import Dataset
+
+from llama_cookbook.configs.datasets import samsum_dataset
+from llama_cookbook.datasets.preprocessing import get_map_kwargs, tokenize_prompt_and_completion
+from utils import FakeTokenizer
+
+
+def reference(tokenizer, prompt, completion):
+    prompt_ids = tokenizer.encode(tokenizer.bos_token + prompt, add_special_tokens=False)
+    completion_ids = tokenizer.encode(completion + tokenizer.eos_token, add_special_tokens=False)
+    return {
+        "input_ids": prompt_ids + completion_ids,
+        "attention_mask": [1] * (len(prompt_ids) + len(completion_ids)),
+        "labels": [-100] * len(prompt_ids) + completion_ids,
+    }
+
+
+def test_batched_tokenization_matches_per_sample():
+    tokenizer = FakeTokenizer()
+    samples = [{"prompt": f"prompt {'x' * i} number {i}", "completion": f"completion {i}"} for i in range(50)]
+    dataset = Dataset.from_list(samples)
+
+    config = samsum_dataset(num_proc=2, preprocessing_batch_size=8)
+    tokenized = dataset.map(
+        lambda batch: tokenize_prompt_and_completion(tokenizer, batch["prompt"], batch["completion"]),
+        remove_columns=list(dataset.features),
+        **get_map_kwargs(config),
+    )
+
+    assert len(tokenized) == len(samples)
+    for sample, expected in zip(tokenized, samples):
+        assert sample == reference(tokenizer, expected["prompt"], expected["completion"])
+
+
+def test_map_kwargs():
+    assert get_map_kwargs(samsum_dataset())["num_proc"] is None
+    assert get_map_kwargs(samsum_dataset(num_proc=8)) == {"batched": True, "batch_size": 1000, "num_proc": 8}
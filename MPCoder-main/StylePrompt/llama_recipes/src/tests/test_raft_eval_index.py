@@ -0,0 +1,82 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 3 Community License Agreement.
+
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip("evaluate")
+pytest.importorskip("langchain.text_splitter")
+pytest.importorskip("langchain_openai")
+document_loaders = pytest.importorskip("langchain_community.document_loaders")
+
+RAFT_DIR = Path(__file__).parents[2] / "end-to-end-use-cases" / "RAFT-Chatbot"
+
+
+def fake_embedding(text):
+    return np.frombuffer(hashlib.sha256(text.encode("utf-8")).digest()[:16], dtype=np.uint8).astype(np.float32)
+
+
+class FakeEmbeddings:
+    calls = []
+
+    def __init__(self, model_name, model_kwargs, encode_kwargs):
+        pass
+
+    def embed_documents(self, texts):
+        FakeEmbeddings.calls.append(list(texts))
+        return [fake_embedding(t) for t in texts]
+
+
+class FakeFAISS:
+    @classmethod
+    def from_embeddings(cls, text_embeddings, embedding, metadatas, distance_strategy):
+        store = cls()
+        store.text_embeddings = list(text_embeddings)
+        return store
+
+    def as_retriever(self, search_kwargs):
+        return self
+
+
+@pytest.fixture
+def raft_eval(monkeypatch):
+    monkeypatch.syspath_prepend(str(RAFT_DIR))
+    import raft_eval
+
+    # Plain text loader, the default unstructured loader is not needed to test the index bookkeeping
+    monkeypatch.setattr(
+        raft_eval,
+        "DirectoryLoader",
+        lambda path, glob: document_loaders.DirectoryLoader(path, glob=glob, loader_cls=document_loaders.TextLoader),
+    )
+    monkeypatch.setattr(raft_eval, "HuggingFaceEmbeddings", FakeEmbeddings)
+    monkeypatch.setattr(raft_eval, "FAISS", FakeFAISS)
+    FakeEmbeddings.calls = []
+    return raft_eval
+
+
+def test_build_retriever_keeps_vectors_aligned(raft_eval, tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("first paragraph\n\nsecond paragraph")
+    # Glob characters in a file name must not match another file
+    (data_dir / "notes[1].txt").write_text("third paragraph")
+    (data_dir / "notes1.txt").write_text("fourth paragraph")
+    api_config = {"data_dir": str(data_dir), "chunk_size": 20, "index_dir": str(tmp_path / "index")}
+
+    def check(store):
+        texts = [text for text, _ in store.text_embeddings]
+        assert sorted(texts) == ["first paragraph", "fourth paragraph", "second paragraph", "third paragraph"]
+        for text, vector in store.text_embeddings:
+            assert np.array_equal(vector, fake_embedding(text)), text
+
+    check(raft_eval.build_retriever(api_config, "org/model"))
+    assert len(FakeEmbeddings.calls) == 1
+
+    # Renaming a file keeps the same chunks in another order, the stored vectors must follow the chunks
+    (data_dir / "a.txt").rename(data_dir / "z.txt")
+    check(raft_eval.build_retriever(api_config, "org/model"))
+    assert len(FakeEmbeddings.calls) == 1
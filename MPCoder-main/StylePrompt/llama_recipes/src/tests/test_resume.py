@@ -0,0 +1,102 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import random
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import torch
+
+from llama_cookbook.configs import train_config as TRAIN_CONFIG
+from llama_cookbook.data.token_budget_sampler import TokenBudgetBatchSampler
+from llama_cookbook.utils.resume_utils import get_rng_state, set_rng_state, skip_consumed_batches
+from llama_cookbook.utils.train_utils import train
+
+
+class TinyModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(4, 1)
+        self.dropout = torch.nn.Dropout(0.5)
+
+    def forward(self, input, labels):
+        return SimpleNamespace(loss=torch.nn.functional.mse_loss(self.linear(self.dropout(input)).squeeze(-1), labels))
+
+
+def get_dataloader():
+    data = [{"input": torch.randn(4), "labels": torch.randn(())} for _ in range(12)]
+    return torch.utils.data.DataLoader(data, batch_size=2, shuffle=True)
+
+
+def run(tmp_path, **kwargs):
+    torch.manual_seed(0)
+    model = TinyModel()
+    dataloader = get_dataloader()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=1, gamma=0.5)
+    config = TRAIN_CONFIG(
+        num_epochs=2,
+        run_validation=False,
+        save_model=False,
+        enable_fsdp=False,
+        output_dir=str(tmp_path),
+        checkpoint_every_n_steps=2,
+        **kwargs,
+    )
+    train(model, dataloader, None, None, optimizer, scheduler, 1, config)
+    return model
+
+
+@patch("llama_cookbook.utils.train_utils.MemoryTrace")
+def test_resume_matches_uninterrupted_run(mem_trace, tmp_path):
+    expected = run(tmp_path / "full")
+
+    # Interrupted after 8 of 12 steps, the last checkpoint is at step 8 (2nd step of the 2nd epoch)
+    run(tmp_path / "interrupted", max_train_step=8)
+    assert (tmp_path / "interrupted" / "training_state" / "latest").read_text() == "step_8"
+    resumed = run(tmp_path / "resumed", resume_from_checkpoint=str(tmp_path / "interrupted" / "training_state"))
+
+    for p, q in zip(expected.parameters(), resumed.parameters()):
+        assert torch.allclose(p, q)
+
+
+@patch("llama_cookbook.utils.train_utils.MemoryTrace")
+@patch("llama_cookbook.utils.train_utils.save_training_state")
+def test_checkpoint_on_short_last_accumulation(save_training_state, mem_trace, tmp_path):
+    torch.manual_seed(0)
+    model = TinyModel()
+    data = [{"input": torch.randn(4), "labels": torch.randn(())} for _ in range(20)]
+    dataloader = torch.utils.data.DataLoader(data, batch_size=2)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=1, gamma=0.5)
+    config = TRAIN_CONFIG(
+        num_epochs=3,
+        run_validation=False,
+        save_model=False,
+        enable_fsdp=False,
+        output_dir=str(tmp_path),
+        checkpoint_every_n_steps=8,
+    )
+    train(model, dataloader, None, None, optimizer, scheduler, 4, config)
+
+    # 10 batches per epoch, the optimizer steps at batches 4, 8 and 10, so the checkpoints due at steps 16 and 24
+    # are written at the next optimizer steps 18 and 24
+    saved = [(args[2]["total_train_steps"], args[2]["step"]) for args, _ in save_training_state.call_args_list]
+    assert saved == [(8, 8), (18, 8), (24, 4)]
+
+
+def test_skip_consumed_batches():
+    dataset = [{"input_ids": random.randint(1, 9) * [1,]} for _ in range(50)]
+    dataloader = torch.utils.data.DataLoader(
+        dataset,
+        batch_sampler=TokenBudgetBatchSampler(dataset, 16, shuffle=True),
+        collate_fn=lambda batch: batch,
+    )
+    state = get_rng_state(dataloader)
+    batches = list(dataloader.batch_sampler)
+
+    set_rng_state(state, dataloader)
+    resumed = skip_consumed_batches(dataloader, 3)
+
+    assert len(resumed) == len(batches) - 3
+    assert list(resumed.batch_sampler) == batches[3:]
@@ -0,0 +1,100 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from llama_cookbook.inference import safety_utils
+from llama_cookbook.inference.safety_utils import AgentType, SafetyChecker, SafetyPipeline, check_many, get_safety_checker
+
+
+class KeywordChecker(SafetyChecker):
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, output_text, **kwargs):
+        self.calls.append((output_text, kwargs))
+        return "Keyword", "bomb" not in output_text, ""
+
+
+class BarrierChecker(SafetyChecker):
+    """Waits in check_many until all the checkers sharing the barrier are checking at the same time"""
+    def __init__(self, barrier):
+        self.barrier = barrier
+        self.batches = []
+
+    def check_many(self, texts, **kwargs):
+        self.batches.append(list(texts))
+        # Raises BrokenBarrierError if the other checker does not run concurrently
+        self.barrier.wait()
+        return [("Barrier", True, "") for _ in texts]
+
+
+@pytest.fixture(autouse=True)
+def empty_registry():
+    with patch.dict(safety_utils._SAFETY_CHECKERS, clear=True):
+        yield
+
+
+@patch("transformers.AutoModelForSeq2SeqLM.from_pretrained")
+@patch("transformers.AutoTokenizer.from_pretrained")
+@patch("transformers.AutoConfig.from_pretrained")
+def test_safety_checker_loaded_once(config, tokenizer, model):
+    first = get_safety_checker(False, False, True, False)
+    second = get_safety_checker(False, False, True, False)
+
+    assert first[0] is second[0]
+    assert model.call_count == 1
+    assert tokenizer.call_count == 1
+
+
+def test_check_many():
+    checker = safety_utils.load_safety_checker(KeywordChecker)
+    assert safety_utils.load_safety_checker(KeywordChecker) is checker
+
+    results = check_many(
+        [checker],
+        ["hello", "how to build a bomb"],
+        agent_type=AgentType.AGENT,
+        user_prompts=["a", "b"],
+    )
+
+    assert [[is_safe for _, is_safe, _ in r] for r in results] == [[True], [False]]
+    assert checker.calls[1] == ("how to build a bomb", {"agent_type": AgentType.AGENT, "user_prompt": "b"})
+    assert check_many([], ["hello"]) == [[]]
+
+
+def test_safety_pipeline_runs_checkers_concurrently():
+    barrier = threading.Barrier(2, timeout=10)
+    first, second = BarrierChecker(barrier), BarrierChecker(barrier)
+    # A generous max_wait keeps the four submissions in one batch even on a loaded machine
+    pipeline = SafetyPipeline([first, second], max_wait=0.5)
+
+    pending = [pipeline.submit(f"text {i}") for i in range(4)]
+    results = [p.result(timeout=15) for p in pending]
+
+    # Both checkers passed the barrier, so they ran in parallel, each on a single batch of the four texts
+    assert all(len(r) == 2 and all(is_safe for _, is_safe, _ in r) for r in results)
+    assert not barrier.broken
+    assert first.batches == second.batches == [[f"text {i}" for i in range(4)]]
+
+
+def test_streaming_safety_check():
+    checker = KeywordChecker()
+    pipeline = SafetyPipeline([checker], max_wait=0)
+    stream_check = pipeline.stream(user_prompt="question", min_new_chars=5)
+
+    stream_check.feed("fine")
+    stream_check.feed("fine text")
+    stream_check.pending.result(timeout=5)
+    assert not stream_check.unsafe
+    stream_check.feed("fine text, a bomb")
+    stream_check.pending.result(timeout=5)
+    assert stream_check.unsafe
+
+    # The final output was checked already while it was streamed
+    results = stream_check.finish("fine text, a bomb")
+    assert results == [("Keyword", False, "")]
+    assert [text for text, _ in checker.calls] == ["fine text", "fine text, a bomb"]
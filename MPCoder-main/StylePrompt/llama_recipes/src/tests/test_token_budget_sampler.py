@@ -0,0 +1,59 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import random
+import pytest
+
+from llama_cookbook.data.token_budget_sampler import TokenBudgetBatchSampler
+from llama_cookbook.data.token_budget_sampler import DistributedTokenBudgetBatchSampler
+
+SAMPLES = 101
+MAX_TOKENS = 64
+
+@pytest.fixture
+def dataset():
+    random.seed(42)
+    dataset = [random.randint(1, 9) * [1,] for _ in range(SAMPLES - 1)]
+    # One sample longer than the whole budget
+    dataset.append((MAX_TOKENS + 5) * [1,])
+    return [{"input_ids": d, "attention_mask": d} for d in random.sample(dataset, len(dataset))]
+
+
+def test_token_budget_batches(dataset):
+    sampler = TokenBudgetBatchSampler(dataset, MAX_TOKENS, shuffle=True)
+    batches = list(sampler)
+
+    assert len(batches) == len(sampler)
+    assert sorted(i for b in batches for i in b) == list(range(SAMPLES))
+
+    for b in batches:
+        padded = len(b) * max(len(dataset[i]["input_ids"]) for i in b)
+        assert padded <= MAX_TOKENS or len(b) == 1
+
+    # Short samples are batched together, far more than a fixed batch size of 1 would allow
+    assert len(sampler) < SAMPLES // 4
+
+
+@pytest.mark.parametrize("num_replicas", [2, 3])
+def test_dist_token_budget_sampling(dataset, num_replicas):
+    samplers = [
+        DistributedTokenBudgetBatchSampler(
+            dataset,
+            max_tokens=MAX_TOKENS,
+            rank=rank,
+            num_replicas=num_replicas,
+            shuffle=True,
+            seed=7,
+        )
+        for rank in range(num_replicas)
+    ]
+
+    # Every rank runs the same number of steps
+    assert len(set(len(s) for s in samplers)) == 1
+    ids = [[i for b in s for i in b] for s in samplers]
+    for a in range(num_replicas):
+        for b in range(a + 1, num_replicas):
+            assert set(ids[a]).isdisjoint(ids[b])
+
+    single = TokenBudgetBatchSampler(dataset, MAX_TOKENS, shuffle=False)
+    assert len(samplers[0]) == len(single) // num_replicas
@@ -0,0 +1,75 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
+
+import pickle
+from dataclasses import dataclass
+from unittest.mock import MagicMock
+
+from llama_cookbook.data.token_cache import (
+    MemmapTokenDataset,
+    get_cached_dataset,
+    get_token_cache_path,
+    is_token_cacheable,
+)
+from utils import FakeTokenizer
+
+
+@dataclass
+class Config:
+    dataset: str = "fake_dataset"
+    train_split: str = "train"
+
+
+def get_fake_dataset():
+    return [
+        {
+            "input_ids": list(range(1, n + 1)),
+            "attention_mask": [1] * n,
+            "labels": [-100] * (n // 2) + list(range(n // 2 + 1, n + 1)),
+        }
+        for n in (3, 7, 1, 12)
+    ]
+
+
+def test_token_cache_roundtrip(tmp_path):
+    dataset = get_fake_dataset()
+    cache_path = get_token_cache_path(str(tmp_path), FakeTokenizer(), Config(), "train")
+
+    build_dataset = MagicMock(return_value=dataset)
+    cached = get_cached_dataset(build_dataset, cache_path)
+
+    assert isinstance(cached, MemmapTokenDataset)
+    assert len(cached) == len(dataset)
+    assert [cached[i] for i in range(len(cached))] == dataset
+    assert list(cached.lengths) == [3, 7, 1, 12]
+
+    # A second run reads the cache without building the dataset again
+    build_dataset.reset_mock()
+    cached = get_cached_dataset(build_dataset, cache_path)
+    assert build_dataset.call_count == 0
+    assert cached[-1] == dataset[-1]
+
+    # Workers receive a picklable dataset without the mapped arrays
+    unpickled = pickle.loads(pickle.dumps(cached))
+    assert unpickled._tokens is None
+    assert unpickled[1] == dataset[1]
+
+
+def test_token_cache_key(tmp_path):
+    path = get_token_cache_path(str(tmp_path), FakeTokenizer(), Config(), "train")
+
+    assert path == get_token_cache_path(str(tmp_path), FakeTokenizer(), Config(), "train")
+    assert path != get_token_cache_path(str(tmp_path), FakeTokenizer(), Config(), "test")
+    assert path != get_token_cache_path(str(tmp_path), FakeTokenizer(), Config(train_split="other"), "train")
+
+    tokenizer = FakeTokenizer()
+    tokenizer.eos_token_id = 44
+    assert path != get_token_cache_path(str(tmp_path), tokenizer, Config(), "train")
+
+
+def test_uncacheable_dataset(tmp_path):
+    dataset = [{"input_ids": [1, 2], "image": "pixels"}]
+    assert not is_token_cacheable(dataset[0])
+
+    cache_path = get_token_cache_path(str(tmp_path), FakeTokenizer(), Config(), "train")
+    assert get_cached_dataset(lambda: dataset, cache_path) is dataset
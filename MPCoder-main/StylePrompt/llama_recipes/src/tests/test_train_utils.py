@@ -9,7 +9,8 @@ import torch
 import os
 import shutil
 
-from llama_cookbook.utils.train_utils import train
+from llama_cookbook.utils.metrics_utils import read_metrics
+from llama_cookbook.utils.train_utils import evaluation, train
 
 TEMP_OUTPUT_DIR = os.getcwd() + "/tmp"
 
@@ -53,6 +54,11 @@ def test_gradient_accumulation(
     train_config.max_train_step = 0
     train_config.max_eval_step = 0
     train_config.save_metrics = False
+    train_config.metrics_flush_interval = 10
+    train_config.eval_every_n_steps = 0
+    train_config.checkpoint_every_n_steps = 0
+    train_config.resume_from_checkpoint = ""
+    train_config.async_checkpointing = False
     train_config.flop_counter_start = 0
     train_config.use_profiler = False
     train_config.flop_counter = True
@@ -110,6 +116,11 @@ def test_save_to_json(temp_output_dir, mocker):
     train_config.run_validation = False
     train_config.gradient_clipping = False
     train_config.save_metrics = True
+    train_config.metrics_flush_interval = 2
+    train_config.eval_every_n_steps = 0
+    train_config.checkpoint_every_n_steps = 0
+    train_config.resume_from_checkpoint = ""
+    train_config.async_checkpointing = False
     train_config.max_train_step = 0
     train_config.max_eval_step = 0
     train_config.output_dir = temp_output_dir
@@ -130,3 +141,31 @@ def test_save_to_json(temp_output_dir, mocker):
 
     assert results["metrics_filename"] not in ["", None]
     assert os.path.isfile(results["metrics_filename"])
+
+    metrics = read_metrics(results["metrics_filename"])
+    assert len(metrics["train_step_loss"]) == len(train_dataloader)
+    assert len(metrics["train_step_perplexity"]) == len(train_dataloader)
+    assert len(metrics["train_epoch_loss"]) == 1
+    assert metrics["val_step_loss"] == []
+
+def test_evaluation_loss_only(mocker):
+    model = mocker.MagicMock(name="model")
+    model.return_value.loss = torch.tensor(2.0)
+    eval_dataloader = [{"input": torch.ones(2)} for _ in range(4)]
+    tokenizer = mocker.MagicMock()
+    train_config = mocker.MagicMock()
+    train_config.enable_fsdp = False
+    train_config.max_eval_step = 3
+    train_config.save_metrics = True
+    train_config.metrics_flush_interval = 2
+    train_config.eval_decode_predictions = False
+
+    eval_ppl, eval_loss, val_step_loss, val_step_perplexity = evaluation(
+        model, train_config, eval_dataloader, 0, tokenizer, None
+    )
+
+    assert model.call_count == 3
+    assert tokenizer.batch_decode.call_count == 0
+    assert eval_loss.item() == pytest.approx(2.0)
+    assert val_step_loss == [2.0] * 3
+    assert len(val_step_perplexity) == 3
@@ -19,8 +19,10 @@ class FakeTokenizer(object):
         self.tokenizer = self
         self.padding_side = "left"
 
-    def __call__(self, *args, **kwargs):
-        ids = self.encode(*args, **kwargs)
+    def __call__(self, text, *args, **kwargs):
+        if isinstance(text, list):
+            return {"input_ids": [self.encode(t, *args, **kwargs) for t in text]}
+        ids = self.encode(text, *args, **kwargs)
         return {"input_ids": ids}
 
     def encode(self, text, *args, **kwargs):